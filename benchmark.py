@@ -1,11 +1,210 @@
 import subprocess
+import sys
+import codecs
 import time
 import re
 import os
 import getpass
+import platform
+import socket
+import csv
+import math
+import statistics
+import threading
+import concurrent.futures
 import click
 from datetime import datetime
 
+# Summary lines printed by email_downloader.py at the end of a run.
+# Bytes patterns so they run directly on the raw pipe data.
+_RE_DOWN = re.compile(rb"Downloaded:\s+(\d+)")
+_RE_SKIP = re.compile(rb"Skipped \(Duplicates\):\s+(\d+)")
+_RE_ERR = re.compile(rb"Final Errors:\s+(\d+)")
+_RE_SPEED = re.compile(rb"Average Speed:\s+([\d\.]+)")
+
+# (cheap substring prefilter, regex, metrics key, converter)
+_METRIC_PATTERNS = (
+    (b"Downloaded:", _RE_DOWN, 'downloaded', int),
+    (b"Skipped (Duplicates):", _RE_SKIP, 'skipped', int),
+    (b"Final Errors:", _RE_ERR, 'errors', int),
+    (b"Average Speed:", _RE_SPEED, 'speed', float),
+)
+
+# Failure markers used for the Notes column, one group per flag
+_RE_NOTES = re.compile(rb"(Authentication failed)|(Could not connect)|(Too many connections)|((?i:socket))")
+_NOTE_FLAGS = ('auth', 'conn', 'limit_hit', 'sock')
+
+def parse_metrics_line(line, metrics):
+    """
+    Updates the metrics dict in place from a single line of downloader output.
+    The regex only runs when the line contains the metric's label.
+    """
+    for prefix, pattern, key, convert in _METRIC_PATTERNS:
+        if prefix in line:
+            match = pattern.search(line)
+            if match:
+                metrics[key] = convert(match.group(1))
+
+def update_note_flags(data, flags):
+    """
+    Sets the failure-analysis flags in place from a block of downloader output.
+    All markers are found in a single regex pass, without lowercasing a copy.
+    """
+    for match in _RE_NOTES.finditer(data):
+        flags[_NOTE_FLAGS[match.lastindex - 1]] = True
+
+def format_time(seconds):
+    """Formats a duration in seconds as HH:MM:SS."""
+    s = int(seconds)
+    return f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}"
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list of numbers."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def aggregate_runs(runs):
+    """
+    Combines the repeated runs of one thread count into a single result row.
+    The first run is a warm-up (cold TCP/TLS, uncached server state) and is
+    left out of the statistics whenever there is more than one run.
+    """
+    runs = sorted(runs, key=lambda r: r['run'])
+    measured = runs[1:] if len(runs) > 1 else runs
+    durations = [r['duration'] for r in measured]
+    last = measured[-1]
+    notes = []
+    for r in runs:
+        if r['notes'] and r['notes'] not in notes:
+            notes.append(r['notes'])
+    return {
+        'threads': last['threads'],
+        'runs': len(measured),
+        'median': statistics.median(durations),
+        'p95': percentile(durations, 95),
+        'speed': statistics.median(r['speed'] for r in measured),
+        'downloaded': last['downloaded'],
+        'skipped': last['skipped'],
+        'errors': last['errors'],
+        'notes': "; ".join(notes),
+        'limit_hit': any(r['limit_hit'] for r in runs)
+    }
+
+def connection_limit_cutoff(thread_counts, limit_hits):
+    """
+    Returns the thread count above which trials are pointless, or None.
+    One connection-limit hit may be a fluke, but once two consecutive thread
+    counts both hit it, every higher count will too.
+    """
+    for lower, higher in zip(thread_counts, thread_counts[1:]):
+        if limit_hits.get(lower) and limit_hits.get(higher):
+            return higher
+    return None
+
+def format_report_row(r):
+    """Formats one aggregated result dict as a markdown table row."""
+    return f"| {r['threads']} | {format_time(r['median'])} | {format_time(r['p95'])} | {r['speed']:.2f} | {r['downloaded']} | {r['skipped']} | {r['errors']} | {r['notes']} |\n"
+
+def drain_output(fd, tag, log, log_lock, metrics, notes_flags, t0):
+    """
+    Pumps a trial's combined stdout/stderr pipe until EOF.
+    Echoes output to the console, appends it to the shared detailed log and
+    fills metrics/notes_flags in place. Log lines are stamped with seconds
+    since t0 (a time.perf_counter() value taken at trial start). Runs on its
+    own thread so the trial thread can simply block in process.wait().
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = bytearray()  # Holds the trailing partial line between reads
+    last_flush = time.time()
+
+    while True:
+        # Blocking read: returns as soon as any output is available, b'' on EOF.
+        # (select() cannot wait on pipes on Windows, so it is not used here.)
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+
+        # Stream to console right away, including partial lines (progress bars)
+        sys.stdout.write(decoder.decode(chunk))
+        sys.stdout.flush()
+
+        buffer += chunk
+        cut = max(buffer.rfind(b"\n"), buffer.rfind(b"\r")) + 1
+        if not cut:
+            continue
+        complete = bytes(buffer[:cut])
+        del buffer[:cut]
+        for raw_line in complete.splitlines():
+            parse_metrics_line(raw_line, metrics)
+        update_note_flags(complete, notes_flags)
+        text = complete.decode('utf-8', 'replace')
+
+        # Detailed logging: one timestamp and one write per chunk. The lock
+        # keeps lines from concurrent trials from interleaving mid-line.
+        prefix = f"[{time.perf_counter() - t0:8.3f}s] [{tag}] "
+        block = "".join(f"{prefix}{line}\n" for line in text.splitlines() if line)
+        with log_lock:
+            log.write(block)
+            now = time.time()
+            if now - last_flush >= 1.0:
+                log.flush()
+                last_flush = now
+
+    if buffer:
+        parse_metrics_line(bytes(buffer), metrics)
+        update_note_flags(bytes(buffer), notes_flags)
+        text = buffer.decode('utf-8', 'replace')
+        with log_lock:
+            log.write(f"[{time.perf_counter() - t0:8.3f}s] [{tag}] {text}\n")
+
+def parse_cpu_list(spec):
+    """Parses a CPU list such as '0,1' or '0-3,6' into a set of CPU indexes."""
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+def _collect_env(email, server=None, port=993):
+    """
+    Gathers the machine/network context the numbers were measured in.
+    The IMAP host is the --server value, a known provider for the email domain,
+    or the usual imap.<domain> guess. RTT is one TCP connect to that host.
+    """
+    host = server
+    if not host:
+        domain = email.split('@')[-1].lower()
+        try:
+            from imap_client import AutoIMAPClient
+            host = AutoIMAPClient.COMMON_PROVIDERS.get(domain)
+        except ImportError:
+            host = None
+        host = host or f"imap.{domain}"
+
+    rtt = "n/a"
+    try:
+        start = time.perf_counter()
+        with socket.create_connection((host, port), timeout=5):
+            rtt = f"{(time.perf_counter() - start) * 1000:.1f}"
+    except OSError as e:
+        rtt = f"n/a ({e.__class__.__name__})"
+
+    return {
+        'cpu': platform.processor() or platform.machine(),
+        'cores': os.cpu_count(),
+        'os': f"{platform.system()} {platform.release()}",
+        'python': platform.python_version(),
+        'imap_host': f"{host}:{port}",
+        'rtt_ms': rtt,
+    }
+
 @click.command()
 @click.option('--email', prompt='Email address', help='Your email address')
 @click.option('--password', help='Your email password (or App Password).')
@@ -13,10 +212,26 @@ from datetime import datetime
 @click.option('--start-date', help='Start date (YYYY-MM-DD)', default=None)
 @click.option('--end-date', help='End date (YYYY-MM-DD)', default=None)
 @click.option('--output-dir', default='benchmark_results', help='Directory to save downloaded emails (subfolders will be created)')
-def benchmark(email, password, days, start_date, end_date, output_dir):
+@click.option('--server', help='IMAP server hostname, passed to email_downloader.py (default: auto-detect)', default=None)
+@click.option('--port', default=993, help='IMAP server port', type=int)
+@click.option('--parallel', default=1, type=click.IntRange(min=1), help='Number of thread-count trials to run at the same time (default: 1, sequential)')
+@click.option('--in-process', is_flag=True, help='Call email_downloader.main in this interpreter instead of spawning a new Python process per trial (not with --parallel or --per-trial-timeout)')
+@click.option('--cpu-affinity', default=None, help='Pin the benchmark and its trials to these CPUs, e.g. "0,1" or "0-3" (Linux only)')
+@click.option('--per-trial-timeout', default=3600, type=click.IntRange(min=1), help='Kill a trial that runs longer than this many seconds (default: 3600; subprocess mode only)')
+@click.option('--repeats', default=3, type=click.IntRange(min=1), help='Runs per thread count; the first is a warm-up and is excluded when repeats > 1 (default: 3)')
+def benchmark(email, password, days, start_date, end_date, output_dir, server, port, parallel, in_process, cpu_affinity, per_trial_timeout, repeats):
     """
     Runs email_downloader.py with different thread counts to find the optimal setting.
     """
+    if in_process:
+        # Trials in one interpreter share module state (DNS cache, folder paths,
+        # autoconfig memo) and cannot be killed, so they must run one at a time
+        ctx = click.get_current_context()
+        if parallel > 1:
+            raise click.BadParameter("cannot be combined with --in-process", param_hint="'--parallel'")
+        if ctx.get_parameter_source('per_trial_timeout') is not click.core.ParameterSource.DEFAULT:
+            raise click.BadParameter("cannot be combined with --in-process", param_hint="'--per-trial-timeout'")
+
     if not password:
         password = getpass.getpass("Password (hidden): ")
 
@@ -24,166 +239,286 @@ def benchmark(email, password, days, start_date, end_date, output_dir):
     if not days and not start_date:
         days = 3
 
+    if cpu_affinity:
+        # Fewer scheduler migrations between trials means less run-to-run noise.
+        # Child processes inherit the mask set on this process.
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, parse_cpu_list(cpu_affinity))
+            except (ValueError, OSError) as e:
+                raise click.BadParameter(f"cannot pin to CPUs '{cpu_affinity}': {e}", param_hint="'--cpu-affinity'")
+        else:
+            print("Warning: --cpu-affinity is not supported on this platform; ignoring it.")
+
     thread_counts = [1, 2, 3, 5,7,8,9,10,11,12,13,14,15,17,19,20]
     results = []
     
     log_file = "benchmark_detailed.log"
-    with open(log_file, "w") as f:
-        f.write(f"Benchmark Started: {datetime.now().isoformat()}\n")
-        f.write("-" * 80 + "\n")
-
-    print(f"Starting benchmark for {email}")
-    if days: print(f"Mode: Last {days} days")
-    if start_date: print(f"Mode: Since {start_date}")
-    print(f"Testing thread counts: {thread_counts}")
-    print(f"Detailed log: {os.path.abspath(log_file)}")
-    print("-" * 60)
-
-    def format_time(seconds):
-        m, s = divmod(seconds, 60)
-        h, m = divmod(m, 60)
-        return f"{int(h):02d}:{int(m):02d}:{int(s):02d}"
-
-    for threads in thread_counts:
-        print(f"\nRunning with {threads} threads...")
+    log_lock = threading.Lock()
+    # One handle for the whole run; trials share it under log_lock.
+    with open(log_file, "w", buffering=1 << 16) as log_fh:
+        log_fh.write(f"Benchmark Started: {datetime.now().isoformat()}\n")
+        log_fh.write("-" * 80 + "\n")
+
+        print(f"Starting benchmark for {email}")
+        if days: print(f"Mode: Last {days} days")
+        if start_date: print(f"Mode: Since {start_date}")
+        print(f"Testing thread counts: {thread_counts}")
+        if repeats > 1: print(f"Runs per thread count: {repeats} (first one is a warm-up)")
+        if parallel > 1: print(f"Running up to {parallel} trials in parallel")
+        if cpu_affinity and hasattr(os, 'sched_getaffinity'): print(f"CPU affinity: {sorted(os.sched_getaffinity(0))}")
+        print(f"Detailed log: {os.path.abspath(log_file)}")
+        env = _collect_env(email, server, port)
+        print(f"Environment: {env['os']}, {env['cores']} cores, Python {env['python']}, RTT to {env['imap_host']} (ms): {env['rtt_ms']}")
+        print("-" * 60)
+
+        def run_one_trial(threads, log, run=1):
+            """Runs email_downloader.py once with the given thread count and returns the result row."""
+            label = f"{threads} threads" if repeats == 1 else f"{threads} threads (run {run}/{repeats})"
+            print(f"\nRunning with {label}...")
         
-        run_output_dir = os.path.join(output_dir, f"run_threads_{threads}")
+            # One directory per run: runs sharing one would skip each other's
+            # emails as duplicates, and parallel runs would write into it at once
+            run_output_dir = os.path.join(output_dir, f"run_threads_{threads}_{run}")
         
-        cmd = [
-            "python", "email_downloader.py",
-            "--email", email,
-            "--password", password,
-            "--output-dir", run_output_dir,
-            "--threads", str(threads),
-            "--batch",
-            "--max-retries", "0"
-        ]
+            downloader_args = [
+                "--email", email,
+                "--password", password,
+                "--output-dir", run_output_dir,
+                "--threads", str(threads),
+                "--batch",
+                "--max-retries", "0"
+            ]
         
-        if days:
-            cmd.extend(["--days", str(days)])
-        if start_date:
-            cmd.extend(["--start-date", start_date])
-        if end_date:
-            cmd.extend(["--end-date", end_date])
+            if days:
+                downloader_args.extend(["--days", str(days)])
+            if start_date:
+                downloader_args.extend(["--start-date", start_date])
+            if end_date:
+                downloader_args.extend(["--end-date", end_date])
+            if server:
+                downloader_args.extend(["--server", server])
+            if port != 993:
+                downloader_args.extend(["--port", str(port)])
         
-        start_time = time.time()
-        full_output = ""
+            start_time = time.perf_counter()
         
-        # Log run start
-        with open(log_file, "a") as f:
-            f.write(f"\n{'='*30}\nRUNNING WITH {threads} THREADS\n{'='*30}\n")
+            # Log run start
+            with log_lock:
+                log.write(f"\n{'='*30}\nRUNNING WITH {label.upper()}\nStarted: {datetime.now().isoformat()}\n{'='*30}\n")
         
-        try:
-            # Use Popen to stream output
-            process = subprocess.Popen(
-                cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.STDOUT, 
-                text=True, 
-                encoding='utf-8',
-                bufsize=1
-            )
+            try:
+                metrics = {'downloaded': 0, 'skipped': 0, 'errors': 0, 'speed': 0.0}
+                notes_flags = {'auth': False, 'conn': False, 'sock': False, 'limit_hit': False}
+                timed_out = False
             
-            # Read line by line to show progress and log
-            with open(log_file, "a") as log:
-                while True:
-                    line = process.stdout.readline()
-                    if not line and process.poll() is not None:
-                        break
-                    if line:
-                        print(line, end='') # Stream to console
-                        full_output += line
-                        # Detailed logging with timestamp
-                        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-                        log.write(f"[{timestamp}] {line}")
-                        log.flush()
-            
-            end_time = time.time()
-            duration = end_time - start_time
-            
-            # Extract metrics
-            downloaded = 0
-            skipped = 0
-            errors = 0
-            speed = 0.0
-            
-            m_down = re.search(r"Downloaded:\s+(\d+)", full_output)
-            if m_down: downloaded = int(m_down.group(1))
-            
-            m_skip = re.search(r"Skipped \(Duplicates\):\s+(\d+)", full_output)
-            if m_skip: skipped = int(m_skip.group(1))
+                if in_process:
+                    # Imported lazily so the subprocess mode never pays for it.
+                    # Console output goes straight to our stdout; the numbers come
+                    # from the summary dict main() returns instead of parsed text.
+                    import email_downloader
+                    summary = email_downloader.main.main(args=downloader_args, standalone_mode=False)
+                    if isinstance(summary, dict):
+                        for key in metrics:
+                            metrics[key] = summary.get(key, metrics[key])
+                        # Same markers the subprocess mode finds in the console output
+                        messages = [summary.get('status', '')] + summary.get('connection_errors', [])
+                        update_note_flags("\n".join(messages).encode('utf-8', 'replace'), notes_flags)
+                    with log_lock:
+                        log.write(f"[{time.perf_counter() - start_time:8.3f}s] [T{threads}] In-process summary: {summary}\n")
+                else:
+                    # Use Popen to stream output. The pipe is read as raw bytes in large
+                    # chunks on a separate pump thread to keep harness overhead low.
+                    process = subprocess.Popen(
+                        ["python", "email_downloader.py"] + downloader_args,
+                        stdout=subprocess.PIPE, 
+                        stderr=subprocess.STDOUT
+                    )
+                
+                    # The pump thread owns metrics/notes_flags until it is joined.
+                    pump = threading.Thread(
+                        target=drain_output,
+                        args=(process.stdout.fileno(), f"T{threads}", log, log_lock, metrics, notes_flags, start_time),
+                        daemon=True
+                    )
+                    pump.start()
+                    try:
+                        process.wait(timeout=per_trial_timeout)
+                    except subprocess.TimeoutExpired:
+                        # A wedged trial must not stall the remaining thread counts
+                        process.kill()
+                        process.wait()
+                        timed_out = True
+                        with log_lock:
+                            log.write(f"\n[ERROR] {label} exceeded {per_trial_timeout}s and was killed\n")
+                    pump.join()
             
-            m_err = re.search(r"Final Errors:\s+(\d+)", full_output)
-            if m_err: errors = int(m_err.group(1))
+                duration = time.perf_counter() - start_time
             
-            m_speed = re.search(r"Average Speed:\s+([\d\.]+)", full_output)
-            if m_speed: speed = float(m_speed.group(1))
+                downloaded = metrics['downloaded']
+                skipped = metrics['skipped']
+                errors = metrics['errors']
+                speed = metrics['speed']
             
-            # Analyze for notes
-            notes = ""
-            if downloaded == 0 and skipped == 0:
-                if "Authentication failed" in full_output:
-                    notes = "Auth Failed"
-                elif "Could not connect" in full_output:
-                    notes = "Connection Failed"
-                elif "Too many connections" in full_output or "socket" in full_output.lower():
-                    notes = "Socket/Limit Error"
-                else:
-                    notes = "No Data/Crash"
-            elif errors > 100:
-                notes = "High Errors (Limit?)"
+                # Analyze for notes
+                notes = ""
+                if downloaded == 0 and skipped == 0:
+                    if notes_flags['auth']:
+                        notes = "Auth Failed"
+                    elif notes_flags['conn']:
+                        notes = "Connection Failed"
+                    elif notes_flags['limit_hit'] or notes_flags['sock']:
+                        notes = "Socket/Limit Error"
+                    else:
+                        notes = "No Data/Crash"
+                elif errors > 100:
+                    notes = "High Errors (Limit?)"
             
-            # Check for specific connection errors in output even if some downloads succeeded
-            if "Too many connections" in full_output:
-                notes += " (Hit Conn Limit)"
-
-            print(f"  -> Duration: {format_time(duration)}")
-            print(f"  -> Speed: {speed:.2f} emails/h")
-            print(f"  -> Downloaded: {downloaded}, Skipped: {skipped}, Errors: {errors}")
-            if notes: print(f"  -> Note: {notes}")
+                # Check for specific connection errors in output even if some downloads succeeded
+                if notes_flags['limit_hit']:
+                    notes += " (Hit Conn Limit)"
+                if timed_out:
+                    notes += " (Timed out)"
+
+                print(f"  -> Duration: {format_time(duration)}")
+                print(f"  -> Speed: {speed:.2f} emails/h")
+                print(f"  -> Downloaded: {downloaded}, Skipped: {skipped}, Errors: {errors}")
+                if notes: print(f"  -> Note: {notes}")
             
-            results.append({
-                'threads': threads,
-                'duration': duration,
-                'speed': speed,
-                'downloaded': downloaded,
-                'skipped': skipped,
-                'errors': errors,
-                'notes': notes
-            })
+                return {
+                    'threads': threads,
+                    'run': run,
+                    'duration': duration,
+                    'speed': speed,
+                    'downloaded': downloaded,
+                    'skipped': skipped,
+                    'errors': errors,
+                    'notes': notes,
+                    'limit_hit': notes_flags['limit_hit']
+                }
             
-        except Exception as e:
-            print(f"  -> Error running benchmark: {e}")
-            with open(log_file, "a") as log:
-                log.write(f"\n[ERROR] Exception in benchmark loop: {e}\n")
-            results.append({
-                'threads': threads,
-                'duration': 0,
-                'speed': 0,
-                'downloaded': 0,
-                'skipped': 0,
-                'errors': -1,
-                'notes': str(e)
-            })
-
-    # Generate Report
-    report_file = "benchmark_results.md"
+            except Exception as e:
+                print(f"  -> Error running benchmark: {e}")
+                with log_lock:
+                    log.write(f"\n[ERROR] Exception in benchmark loop ({label}): {e}\n")
+                return {
+                    'threads': threads,
+                    'run': run,
+                    'duration': 0,
+                    'speed': 0,
+                    'downloaded': 0,
+                    'skipped': 0,
+                    'errors': -1,
+                    'notes': str(e),
+                    'limit_hit': False
+                }
+
+        # Report header is written up front and each row is appended as soon as all
+        # runs of its thread count finish, so an aborted run still leaves a usable
+        # (unsorted) table.
+        report_file = "benchmark_results.md"
+        header = [f"# Benchmark Results - {datetime.now().isoformat()}\n\n"]
+        header.append(f"**Email**: {email}\n")
+        if days: header.append(f"**Days**: {days}\n")
+        if start_date: header.append(f"**Start Date**: {start_date}\n")
+        if end_date: header.append(f"**End Date**: {end_date}\n")
+        if repeats > 1: header.append(f"**Runs per thread count**: {repeats} (first excluded as warm-up)\n")
+        header.append("\n")
+    
+        header.append("## Environment\n\n")
+        header.extend(f"- **{key}**: {value}\n" for key, value in env.items())
+        header.append("\n")
+    
+        header.append("## Results\n\n")
+        header.append("| Threads | Median | p95 | Speed (emails/h) | Downloaded | Skipped | Errors | Notes |\n")
+        header.append("|---------|--------|-----|------------------|------------|---------|--------|-------|\n")
+        header = "".join(header)
+
+        # Trials are independent, so up to `parallel` of them can run at once.
+        # Each still uses its own thread count internally.
+        with open(report_file, "w") as report:
+            report.write(header)
+            report.flush()
+            runs_by_threads = {t: [] for t in thread_counts}
+            limit_hits = {}
+            cutoff = None
+
+            def record(run_result):
+                """Store a finished run; returns True once its thread count is complete."""
+                runs = runs_by_threads[run_result['threads']]
+                runs.append(run_result)
+                if len(runs) != repeats:
+                    return False
+                result = aggregate_runs(runs)
+                results.append(result)
+                report.write(format_report_row(result))
+                report.flush()
+                limit_hits[result['threads']] = result['limit_hit']
+                return True
+
+            def announce_cutoff():
+                skipped = [t for t in thread_counts if t > cutoff]
+                if skipped:
+                    print(f"\nConnection limit hit at consecutive thread counts; skipping {skipped}")
+                    with log_lock:
+                        log_fh.write(f"\n[INFO] Connection limit hit up to {cutoff} threads; skipping {skipped}\n")
+
+            # Warm-ups run one at a time before any measured trial, so a cold
+            # connection never overlaps with, and skews, a run that is measured.
+            # They count towards the connection-limit cutoff like any other run.
+            first_measured = 1
+            if repeats > 1:
+                first_measured = 2
+                for t in thread_counts:
+                    warm_up = run_one_trial(t, log_fh, 1)
+                    record(warm_up)
+                    limit_hits[t] = warm_up['limit_hit']
+                    cutoff = connection_limit_cutoff(thread_counts, limit_hits)
+                    if cutoff is not None:
+                        announce_cutoff()
+                        break
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+                futures = {
+                    executor.submit(run_one_trial, t, log_fh, run): t
+                    for t in thread_counts if cutoff is None or t <= cutoff
+                    for run in range(first_measured, repeats + 1)
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    if not record(future.result()) or cutoff is not None:
+                        continue
+
+                    # Stop climbing once the server keeps refusing connections
+                    cutoff = connection_limit_cutoff(thread_counts, limit_hits)
+                    if cutoff is not None:
+                        announce_cutoff()
+                        for f, t in futures.items():
+                            if t > cutoff:
+                                f.cancel()
+
+    # Trials may finish out of order; rewrite the final table sorted by thread count
+    results.sort(key=lambda r: r['threads'])
+    footer = ""
+    if cutoff is not None and cutoff < thread_counts[-1]:
+        footer = f"\nThread counts above {cutoff} that had not started yet were skipped after consecutive connection-limit errors.\n"
     with open(report_file, "w") as f:
-        f.write(f"# Benchmark Results - {datetime.now().isoformat()}\n\n")
-        f.write(f"**Email**: {email}\n")
-        if days: f.write(f"**Days**: {days}\n")
-        if start_date: f.write(f"**Start Date**: {start_date}\n")
-        if end_date: f.write(f"**End Date**: {end_date}\n")
-        f.write("\n")
-        
-        f.write("| Threads | Duration | Speed (emails/h) | Downloaded | Skipped | Errors | Notes |\n")
-        f.write("|---------|----------|------------------|------------|---------|--------|-------|\n")
-        
-        for r in results:
-            dur_fmt = format_time(r['duration'])
-            f.write(f"| {r['threads']} | {dur_fmt} | {r['speed']:.2f} | {r['downloaded']} | {r['skipped']} | {r['errors']} | {r['notes']} |\n")
+        f.write(header + "".join(format_report_row(r) for r in results) + footer)
+
+    # Same data as plain CSV for spreadsheets and plotting scripts
+    csv_file = "benchmark_results.csv"
+    with open(csv_file, "w", newline="") as c:
+        # Environment as leading comment lines (e.g. pandas read_csv(comment='#'))
+        c.writelines(f"# {key}: {value}\n" for key, value in env.items())
+        writer = csv.writer(c)
+        writer.writerow(['threads', 'runs', 'median_s', 'p95_s', 'speed', 'downloaded', 'skipped', 'errors', 'notes'])
+        writer.writerows(
+            (r['threads'], r['runs'], f"{r['median']:.3f}", f"{r['p95']:.3f}", f"{r['speed']:.2f}", r['downloaded'], r['skipped'], r['errors'], r['notes'])
+            for r in results
+        )
             
-    print(f"\nBenchmark complete! Results saved to {report_file}")
+    print(f"\nBenchmark complete! Results saved to {report_file} and {csv_file}")
     print(f"Detailed execution log saved to {log_file}")
 
 if __name__ == '__main__':
@@ -0,0 +1,129 @@
+
+import threading
+import time
+from contextlib import contextmanager
+
+from imap_client import AutoIMAPClient
+
+
+class ImapConnectionPool:
+    """
+    Reusable logged-in IMAP connections for one account and server.
+    Every new connection costs a TLS handshake plus LOGIN, so folder scans and
+    download tasks borrow an idle connection instead of opening their own.
+    Connections idle for more than validate_after seconds are checked with NOOP
+    before reuse; a reaper thread closes them before the server drops them
+    (many servers do so after ~30 minutes).
+    """
+
+    def __init__(self, email: str, password: str, server_address: str, port: int = 993,
+                 use_ssl: bool = True, maxsize: int = 4, idle_timeout: float = 25 * 60,
+                 validate_after: float = 30.0):
+        """
+        Args:
+            email: Account email address.
+            password: Account password.
+            server_address: IMAP server already discovered for the account.
+            port: IMAP server port.
+            use_ssl: Whether to connect with SSL.
+            maxsize: Maximum number of idle connections kept open.
+            idle_timeout: Seconds after which an idle connection is closed.
+            validate_after: Connections idle for less than this are reused without NOOP.
+        """
+        self.email = email
+        self.password = password
+        self.server_address = server_address
+        self.port = port
+        self.use_ssl = use_ssl
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.validate_after = validate_after
+        self._idle = []  # (client, last_used) stack; the most recent is reused first
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stop_event = threading.Event()
+        self._reaper = threading.Thread(target=self._reap_loop, name="ImapPoolReaper", daemon=True)
+        self._reaper.start()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Context manager yielding a connected AutoIMAPClient, or None if no
+        connection could be made. The client goes back to the pool on exit.
+        """
+        client = self.checkout()
+        try:
+            yield client
+        finally:
+            if client is not None:
+                self.release(client)
+
+    def checkout(self):
+        """
+        Returns a live connection: the most recently used idle one (checked with
+        NOOP if it sat idle for a while), or a new one. Returns None if connecting fails.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                client, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.validate_after:
+                return client
+            try:
+                client.connection.noop()
+                return client
+            except Exception:
+                self._discard(client)
+
+        client = AutoIMAPClient(self.email, self.password)
+        if client.connect(server_hostname=self.server_address, port=self.port, verbose=False, use_ssl=self.use_ssl):
+            return client
+        return None
+
+    def release(self, client: AutoIMAPClient):
+        """Returns a connection to the pool; closes it if the pool is full or closed."""
+        if not client.connection:
+            return
+        with self._lock:
+            if not self._closed and len(self._idle) < self.maxsize:
+                self._idle.append((client, time.monotonic()))
+                return
+        self._discard(client)
+
+    def close(self):
+        """Closes all idle connections and stops the reaper. Later releases just close."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        self._stop_event.set()
+        for client, _ in idle:
+            self._discard(client)
+
+    def reap_idle(self):
+        """Closes connections that have been idle longer than idle_timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            stale = [c for c, last_used in self._idle if last_used < cutoff]
+            self._idle = [(c, t) for c, t in self._idle if t >= cutoff]
+        for client in stale:
+            self._discard(client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _reap_loop(self):
+        interval = max(1.0, self.idle_timeout / 5)
+        while not self._stop_event.wait(interval):
+            self.reap_idle()
+
+    @staticmethod
+    def _discard(client: AutoIMAPClient):
+        try:
+            client.close()
+        except Exception:
+            pass
+        client.connection = None
@@ -11,13 +11,20 @@ import msvcrt
 import sys
 import threading
 import json
+import functools
+from array import array
+from collections import deque
 import urllib.request
 import urllib.error
 import ssl
-from imap_client import AutoIMAPClient
-from utils import ensure_directory, create_zip_archive, calculate_hashes, sanitize_filename
+import imaplib
+from imap_client import AutoIMAPClient, build_search_criteria
+from utils import (ensure_directory, write_file, create_zip_archive, sanitize_filename, set_deflate_impl, ConcurrentSet, message_id_key,
+                   HASH_ALGORITHMS, FAST_HASH_ALGORITHMS, HASH_LABELS, ZIP_ZSTANDARD)
 from error_logger import ErrorLogger
-from interactive_menu import InteractiveMenu, DownloadSettings
+from file_writer import FileWriter, ZipFileWriter
+from connection_pool import ImapConnectionPool
+from interactive_menu import InteractiveMenu, DownloadSettings, KeyReader, wait_for_key
 
 GITHUB_REPO = "vasel/email-downloader"
 GITHUB_API_LATEST = f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest"
@@ -242,7 +249,8 @@ def timed_input(prompt, timeout=10, default='y'):
     last_shown = -1
     
     while True:
-        remaining = max(0, int(timeout - (time.time() - start_time)))
+        elapsed = time.time() - start_time
+        remaining = max(0, int(timeout - elapsed))
         
         # Update countdown display only when the second changes
         if remaining != last_shown:
@@ -255,7 +263,8 @@ def timed_input(prompt, timeout=10, default='y'):
             sys.stdout.flush()
             return default
         
-        if msvcrt.kbhit():
+        # Sleep until a key arrives or the countdown display has to change
+        if wait_for_key(timeout - remaining - elapsed):
             char = msvcrt.getwche()
             if char == '\r' or char == '\n':  # Enter pressed
                 sys.stdout.write("\n")
@@ -265,12 +274,40 @@ def timed_input(prompt, timeout=10, default='y'):
             sys.stdout.write("\n")
             sys.stdout.flush()
             return input_char  # Return immediately on first char for y/n
-        
-        time.sleep(0.25)
+
+def write_checksum_file(checksum_file, zip_filename, file_size, hashes, details):
+    """
+    Writes the integrity report for a ZIP archive: version, file name, size
+    and digests, followed by the given detail lines. The report is built in
+    memory and written with a single write call.
+    """
+    lines = [
+        f"Email Downloader v{get_current_version()}",
+        f"File: {zip_filename}",
+        f"Size: {file_size} bytes",
+    ]
+    lines.extend(f"{HASH_LABELS[algo]}: {digest}" for algo, digest in hashes.items())
+    lines.append(f"Date: {datetime.now().isoformat()}")
+    lines.extend(details)
+    with open(checksum_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
             
 # Thread-local storage for IMAP connections
 thread_local = threading.local()
 
+# PyPI package providing each optional --deflate-impl
+DEFLATE_PACKAGES = {'isal': 'isal', 'libdeflate': 'deflate'}
+
+# Emails fetched per UID FETCH command (one download task per batch)
+FETCH_BATCH_SIZE = 64
+# A batch is held in memory until written, so batches are also capped by the
+# sizes the server reports; a larger email is fetched in a batch of its own
+FETCH_BATCH_MAX_BYTES = 32 * 1024 * 1024
+# Connections scanning the non-inbox folders in parallel (each SELECT + SEARCH
+# is a round trip); kept small so threads plus scanners stay under the
+# per-account connection limit of common servers (about 15)
+SCAN_WORKERS = 3
+
 def get_thread_client(email, password, server_address, port, use_ssl):
     """
     Returns a thread-local AutoIMAPClient, connecting if necessary.
@@ -300,17 +337,153 @@ def get_thread_client(email, password, server_address, port, use_ssl):
                 
     return client
 
-def download_email_task(email, password, server_address, folder, email_id, output_dir, seen_ids=None, seen_lock=None, shutdown_event=None, port=993, use_ssl=True):
+def borrow_client(pool, email, password, server_address, port, use_ssl):
+    """
+    Returns a connected client from pool (an ImapConnectionPool), or the
+    thread-local client when no pool is given. Returns None if connecting fails.
+    """
+    if pool is not None:
+        return pool.checkout()
+    return get_thread_client(email, password, server_address, port, use_ssl)
+
+def invalidate_client(client):
+    """Closes a client whose connection is in an unknown state after an error."""
+    if client is None:
+        client = getattr(thread_local, 'client', None)
+    if client is not None:
+        try:
+            client.close()
+        except:
+            pass
+        client.connection = None
+
+def select_folder_with_reconnect(client, folder, server_address, port, use_ssl):
+    """
+    Selects a folder on the given client, reconnecting once if needed.
+    Nothing is sent if the folder is already selected on this connection, since a
+    worker usually gets several batches of the same folder in a row.
+    Returns None on success, or an error message.
+    """
+    if client.current_folder == folder or client.select_folder(folder):
+        return None
+    # Try reconnecting once if selection fails (maybe folder closed or connection dropped)
+    try:
+        client.close()
+    except:
+        pass
+    if client.connect(server_hostname=server_address, port=port, verbose=False, use_ssl=use_ssl):
+        if not client.select_folder(folder):
+            return f"Failed to select folder {folder}"
+        return None
+    return "Connection lost during folder selection"
+
+def fetch_with_reconnect(client, folder, fetch, server_address, port, use_ssl):
+    """
+    Runs fetch(client). If the server dropped the connection (idle timeout, BYE,
+    reset), reconnects, reselects the folder and runs it once more, so the
+    batch is not lost to the retry phase.
+    """
+    try:
+        return fetch(client)
+    except (imaplib.IMAP4.abort, OSError):
+        try:
+            client.close()
+        except:
+            pass
+        client.connection = None
+        if not client.connect(server_hostname=server_address, port=port, verbose=False, use_ssl=use_ssl):
+            raise
+        if not client.select_folder(folder):
+            raise
+        return fetch(client)
+
+_folder_path_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=256)
+def get_folder_path(output_dir, folder):
+    """
+    Returns (folder_path, file_prefix) for an IMAP folder, creating the directory.
+    file_prefix is the file-system encoded path prefix (bytes): a file name is
+    file_prefix + UID + b".eml", so workers build each path with a single bytes
+    concatenation and never decode the UID. Memoized: the sanitizing, joining and directory check
+    run once per folder.
+    """
+    with _folder_path_lock:
+        return _build_folder_path(output_dir, folder)
+
+def _build_folder_path(output_dir, folder):
+    """Uncached body of get_folder_path."""
+    # Create folder-specific subdirectory
+    # Remove INBOX. or INBOX/ prefix for cleaner folder names
+    # But keep "INBOX" as is.
+    display_folder = folder
+    upper_folder = display_folder.upper()
+    
+    if upper_folder.startswith("INBOX.") or upper_folder.startswith("INBOX/"):
+        display_folder = display_folder[6:]
+    
+    folder_safe = sanitize_filename(display_folder)
+    folder_path = os.path.join(output_dir, folder_safe)
+    ensure_directory(folder_path)
+    return folder_path, os.fsencode(f"{folder_path}{os.sep}email_{folder_safe}_")
+
+def claim_message_id(seen_ids, msg_id, folder, email_id):
+    """
+    Records msg_id as downloaded in seen_ids, a ConcurrentSet, so no lock is needed.
+    Returns False if it was already seen (a duplicate). A claim made earlier
+    for the same folder and UID is not a duplicate, so a retried email can be
+    checked again. The owner is kept as a hash, not the (folder, UID) tuple.
+    """
+    return seen_ids.add_if_absent(msg_id, owner=hash((folder, email_id)))
+
+def filter_duplicates(client, folder, email_ids, seen_ids):
+    """
+    Claims the Message-IDs of email_ids with one header-only UID FETCH, so
+    duplicates are dropped before their bodies are ever downloaded.
+    The folder must already be selected on client.
+    Returns (new_ids, duplicate_ids, sizes); emails without a Message-ID count
+    as new, sizes maps UIDs to the RFC822.SIZE the server reported.
+    """
+    fetched = client.fetch_message_ids_and_sizes_batch(email_ids)
+    new_ids, duplicate_ids = [], []
+    for eid in email_ids:
+        msg_id, _ = fetched.get(eid, (None, None))
+        if msg_id and not claim_message_id(seen_ids, msg_id, folder, eid):
+            duplicate_ids.append(eid)
+        else:
+            new_ids.append(eid)
+    return new_ids, duplicate_ids, {eid: size for eid, (_, size) in fetched.items() if size is not None}
+
+def split_by_size(email_ids, sizes, max_bytes=FETCH_BATCH_MAX_BYTES):
+    """
+    Splits email_ids into consecutive batches of at most max_bytes by the given
+    sizes. Every batch has at least one email; unknown sizes count as zero.
+    """
+    batches, batch, batch_bytes = [], [], 0
+    for eid in email_ids:
+        size = sizes.get(eid, 0)
+        if batch and batch_bytes + size > max_bytes:
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(eid)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def download_email_task(email, password, server_address, folder, email_id, output_dir, seen_ids=None, shutdown_event=None, port=993, use_ssl=True, pool=None, writer=None):
     """
     Worker function to download a single email.
+    The connection is borrowed from pool if given, else the thread-local client is used.
+    If a FileWriter is given, the file is handed to it instead of written inline.
     Returns (success, error_message).
     """
+    client = None
     try:
         if shutdown_event and shutdown_event.is_set():
             return False, "Shutdown initiated"
 
-        # Use thread-local client
-        client = get_thread_client(email, password, server_address, port, use_ssl)
+        client = borrow_client(pool, email, password, server_address, port, use_ssl)
         if not client:
             return False, "Connection failed"
 
@@ -318,67 +491,118 @@ def download_email_task(email, password, server_address, folder, email_id, outpu
             # Do not close the shared connection here, just return
             return False, "Shutdown initiated"
 
-        if not client.select_folder(folder):
-            # Try reconnecting once if selection fails (maybe folder closed or connection dropped)
-            try:
-                client.close()
-            except:
-                pass
-            if client.connect(server_hostname=server_address, port=port, verbose=False, use_ssl=use_ssl):
-                 if not client.select_folder(folder):
-                     return False, f"Failed to select folder {folder}"
-            else:
-                return False, "Connection lost during folder selection"
+        select_error = select_folder_with_reconnect(client, folder, server_address, port, use_ssl)
+        if select_error:
+            return False, select_error
 
         # Deduplication Logic
-        if seen_ids is not None and seen_lock is not None:
-            msg_id = client.fetch_message_id(email_id)
-            if msg_id:
-                with seen_lock:
-                    if msg_id in seen_ids:
-                        # Do not close client
-                        return True, "SKIPPED" # Treated as success but skipped
-                    seen_ids.add(msg_id)
+        content = None
+        if seen_ids is not None:
+            # Message-ID and body come back from one FETCH; the body of a
+            # duplicate is simply discarded.
+            msg_id, content = fetch_with_reconnect(client, folder, lambda c: c.fetch_id_and_content(email_id),
+                                                   server_address, port, use_ssl)
+            if msg_id and not claim_message_id(seen_ids, msg_id, folder, email_id):
+                # Do not close client
+                return True, "SKIPPED" # Treated as success but skipped
             # If no msg_id found, we proceed to download anyway to be safe
-            
+        if not content:
+            # Also the fallback when the combined FETCH came back without a body
+            content = fetch_with_reconnect(client, folder, lambda c: c.fetch_email_content(email_id),
+                                           server_address, port, use_ssl)
+        # Do not close client
+        
         if shutdown_event and shutdown_event.is_set():
             return False, "Shutdown initiated"
-
-        content = client.fetch_email_content(email_id)
-        # Do not close client
         
         if content:
-            # Create folder-specific subdirectory
-            # Remove INBOX. or INBOX/ prefix for cleaner folder names
-            # But keep "INBOX" as is.
-            display_folder = folder
-            upper_folder = display_folder.upper()
-            
-            if upper_folder.startswith("INBOX.") or upper_folder.startswith("INBOX/"):
-                display_folder = display_folder[6:]
-            
-            folder_safe = sanitize_filename(display_folder)
-            folder_path = os.path.join(output_dir, folder_safe)
-            ensure_directory(folder_path)
+            _, file_prefix = get_folder_path(output_dir, folder)
             
             # Save file
-            filename = f"email_{folder_safe}_{email_id.decode()}.eml"
-            file_path = os.path.join(folder_path, filename)
+            file_path = file_prefix + email_id + b".eml"
             
-            with open(file_path, 'wb') as f:
-                f.write(content)
+            if writer:
+                writer.submit(file_path, content, tag=(folder, email_id))
+            else:
+                write_file(file_path, content)
             return True, None
         else:
             return False, f"Empty content (UID: {email_id.decode()})"
     except Exception as e:
         # In case of error, we might want to invalidate the connection for next time
-        if hasattr(thread_local, 'client'):
-             try:
-                 thread_local.client.close()
-             except:
-                 pass
-             thread_local.client.connection = None
+        invalidate_client(client)
         return False, str(e)
+    finally:
+        if pool is not None and client is not None:
+            pool.release(client)  # Dropped by the pool if it was invalidated
+
+def download_email_batch_task(email, password, server_address, folder, email_ids, output_dir, seen_ids=None, shutdown_event=None, port=993, use_ssl=True, writer=None, pool=None):
+    """
+    Worker function to download several emails from one folder.
+    Message-IDs and contents come back from a single UID FETCH, so the IMAP
+    round-trip is paid once per batch instead of once per email.
+    If a FileWriter is given, files are handed to it instead of written inline;
+    write failures are then reported through the writer's on_error callback.
+    The connection is borrowed from pool if given, else the thread-local client is used.
+    Returns a list of (email_id, success, error_message), one per input UID.
+    """
+    results = []
+    client = None
+    try:
+        if shutdown_event and shutdown_event.is_set():
+            return [(eid, False, "Shutdown initiated") for eid in email_ids]
+
+        client = borrow_client(pool, email, password, server_address, port, use_ssl)
+        if not client:
+            return [(eid, False, "Connection failed") for eid in email_ids]
+
+        select_error = select_folder_with_reconnect(client, folder, server_address, port, use_ssl)
+        if select_error:
+            return [(eid, False, select_error) for eid in email_ids]
+
+        # Deduplication Logic: Message-IDs arrive in the same FETCH as the bodies
+        to_save = []
+        if seen_ids is not None:
+            fetched = fetch_with_reconnect(client, folder, lambda c: c.fetch_ids_and_contents_batch(email_ids),
+                                           server_address, port, use_ssl)
+            contents = {}
+            for eid in email_ids:
+                msg_id, content = fetched.get(eid, (None, None))
+                if msg_id and not claim_message_id(seen_ids, msg_id, folder, eid):
+                    results.append((eid, True, "SKIPPED"))
+                    continue
+                contents[eid] = content
+                to_save.append(eid)
+        else:
+            contents = fetch_with_reconnect(client, folder, lambda c: c.fetch_email_contents_batch(email_ids),
+                                            server_address, port, use_ssl)
+            to_save = list(email_ids)
+
+        if shutdown_event and shutdown_event.is_set():
+            return results + [(eid, False, "Shutdown initiated") for eid in to_save]
+
+        _, file_prefix = get_folder_path(output_dir, folder)
+        
+        for eid in to_save:
+            content = contents.get(eid)
+            if content:
+                file_path = file_prefix + eid + b".eml"
+                if writer:
+                    writer.submit(file_path, content, tag=(folder, eid))
+                else:
+                    write_file(file_path, content)
+                results.append((eid, True, None))
+            else:
+                results.append((eid, False, f"Empty content (UID: {eid.decode()})"))
+        return results
+    except Exception as e:
+        # Invalidate the connection; everything not yet handled counts as failed
+        invalidate_client(client)
+        done = {r[0] for r in results}
+        return results + [(eid, False, str(e)) for eid in email_ids if eid not in done]
+    finally:
+        if pool is not None and client is not None:
+            pool.release(client)  # Dropped by the pool if it was invalidated
 
 @click.command()
 @click.version_option(version=get_current_version(), prog_name='Email Downloader')
@@ -389,16 +613,21 @@ def download_email_task(email, password, server_address, folder, email_id, outpu
 @click.option('--days', help='Download emails from the last X days', type=int, default=None)
 @click.option('--output-dir', default='downloaded_emails', help='Directory to save emails')
 @click.option('--threads', default=10, help='Number of threads for downloading')
+@click.option('--fetch-batch-size', default=FETCH_BATCH_SIZE, type=click.IntRange(1, 1000), help='Emails requested per IMAP FETCH command (default: 64)')
 @click.option('--max-retries', default=0, help='Number of auto-retries for failed downloads', type=int)
 @click.option('--batch', is_flag=True, help='Run in batch mode (no interactive prompts, defaults to No for optional steps)')
 @click.option('--server', help='IMAP server hostname (e.g. imap.gmail.com)')
 @click.option('--port', default=993, help='IMAP server port', type=int)
 @click.option('--nossl', is_flag=True, help='Disable SSL (use for servers that do not support SSL)')
 @click.option('--zip-only', help='Only zip and hash this directory (skip download)', default=None)
-@click.option('--compression-level', default=0, help='Compression level (0=Store/No Compression, 1-9=Deflate)', type=int)
+@click.option('--compression-level', default=6, help='Compression level (0=Store/No Compression, 1-9=Deflate, 10-12 with --deflate-impl libdeflate, 1-22 with --zip-method zstd). Default 6: close to the size of 9 at a fraction of its time', type=int)
+@click.option('--deflate-impl', type=click.Choice(['zlib', 'isal', 'libdeflate']), default='zlib', help='DEFLATE implementation for the ZIP (isal = Intel ISA-L, needs the isal package; libdeflate needs the deflate package and allows levels up to 12)')
+@click.option('--zip-method', type=click.Choice(['deflate', 'zstd']), default='deflate', help='ZIP compression method. zstd is faster at a better ratio but needs Python 3.14+ to write and a recent archiver (7-Zip 24+) to open')
+@click.option('--fast-hash', is_flag=True, help='Only write a CRC32 checksum for the ZIP (skip SHA1/SHA256/BLAKE2b)')
+@click.option('--stream-zip', is_flag=True, help='Write emails straight into the ZIP archive instead of .eml files (implies creating the ZIP)')
 @click.option('--detect', help='Detect IMAP server for a domain or email (no login required). Example: --detect tresmarias.mg.gov.br', default=None)
 @click.option('--update', is_flag=True, help='Check for updates and download the latest version')
-def main(email, password, start_date, end_date, days, output_dir, threads, max_retries, batch, server, port, nossl, zip_only, compression_level, detect, update):
+def main(email, password, start_date, end_date, days, output_dir, threads, fetch_batch_size, max_retries, batch, server, port, nossl, zip_only, compression_level, deflate_impl, zip_method, fast_hash, stream_zip, detect, update):
     """
     Downloads emails from an IMAP server with auto-discovery and multi-threading.
     """
@@ -464,10 +693,27 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
         return
 
     # Determine compression settings
-    # Default is STORED (0)
+    # Default is DEFLATE level 6: level 1 leaves noticeably more size on the table for
+    # text-heavy .eml files, while 9 costs several times the CPU for little extra gain.
+    try:
+        set_deflate_impl(deflate_impl)
+    except ImportError:
+        package = DEFLATE_PACKAGES.get(deflate_impl, deflate_impl)
+        click.echo(f"Warning: '{deflate_impl}' is not installed (pip install {package}). Using zlib.")
+        set_deflate_impl('zlib')
+
+    hash_algorithms = FAST_HASH_ALGORITHMS if fast_hash else HASH_ALGORITHMS
+
+    if zip_method == 'zstd' and ZIP_ZSTANDARD is None:
+        click.echo("Warning: Zstandard ZIP members need Python 3.14 or newer. Using deflate.")
+        zip_method = 'deflate'
+
     if compression_level == 0:
         compression_method = zipfile.ZIP_STORED
         compress_lvl_arg = None
+    elif zip_method == 'zstd':
+        compression_method = ZIP_ZSTANDARD
+        compress_lvl_arg = compression_level
     else:
         compression_method = zipfile.ZIP_DEFLATED
         compress_lvl_arg = compression_level
@@ -509,27 +755,20 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
         else:
              click.echo(f"Compression: Deflated (Level {compression_level})")
         
-        create_zip_archive(target_path, zip_path, compression_method=compression_method, compress_level=compress_lvl_arg)
-        
-        click.echo("Calculating hashes...")
-        hashes = calculate_hashes(zip_path)
-        file_size = os.path.getsize(zip_path)
+        # The archive is hashed while it is written, so it is never read back
+        try:
+            file_size, hashes = create_zip_archive(target_path, zip_path, compression_method=compression_method, compress_level=compress_lvl_arg,
+                                                   hash_algorithms=hash_algorithms)
+        except OSError as e:
+            click.echo(f"Error: ZIP creation failed, archive removed: {e}")
+            return
         
-        click.echo(f"SHA1 Hash: {hashes['sha1']}")
-        click.echo(f"SHA256 Hash: {hashes['sha256']}")
-        click.echo(f"BLAKE2b Hash: {hashes['blake2b']}")
+        for algo, digest in hashes.items():
+            click.echo(f"{HASH_LABELS[algo]} Hash: {digest}")
         
         # Save hash
         checksum_file = os.path.join(dest_dir, f"{base_name}.txt")
-        with open(checksum_file, "w") as f:
-            f.write(f"Email Downloader v{get_current_version()}\n")
-            f.write(f"File: {zip_filename}\n")
-            f.write(f"Size: {file_size} bytes\n")
-            f.write(f"SHA1: {hashes['sha1']}\n")
-            f.write(f"SHA256: {hashes['sha256']}\n")
-            f.write(f"BLAKE2b: {hashes['blake2b']}\n")
-            f.write(f"Date: {datetime.now().isoformat()}\n")
-            f.write("Mode: Zip Only\n")
+        write_checksum_file(checksum_file, zip_filename, file_size, hashes, ["Mode: Zip Only"])
             
         click.echo(f"Integrity info saved in {checksum_file}")
         return
@@ -565,6 +804,9 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
         click.echo("Error: Invalid date format. Use YYYY-MM-DD.")
         return
 
+    # Same UID SEARCH criteria for every folder
+    search_criteria = build_search_criteria(s_date, e_date)
+
     # Initial connection to discover server and get IDs
     client = AutoIMAPClient(email, password)
     
@@ -596,7 +838,16 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
             password = new_password # Update local var too if needed elsewhere
             # Retry loop
         else:
-            return
+            # For programmatic callers; status is the message printed above
+            return {
+                'status': "Authentication failed" if is_google else "Could not connect",
+                'downloaded': 0,
+                'skipped': 0,
+                'errors': 0,
+                'remaining': 0,
+                'speed': 0.0,
+                'connection_errors': [err for _, err in client.connection_attempts],
+            }
     
     # Store the discovered server address to pass to threads
     server_address = client.server_address
@@ -618,100 +869,140 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
             else:
                 other_folders.append(f)
         
-        client.close() # Close main connection
+        # Scanners and download workers borrow logged-in connections from here;
+        # the discovery login is handed over so the inbox scan reuses it
+        imap_pool = ImapConnectionPool(email, password, server_address, port=port, use_ssl=use_ssl, maxsize=threads + 1 + SCAN_WORKERS)
+        imap_pool.release(client)
 
         ensure_directory(output_dir)
+        # Directories may have changed since a previous in-process run
+        get_folder_path.cache_clear()
         
         click.echo(f"Starting download with {threads} threads...")
         click.echo("Mode: Immediate Inbox + Background Scan")
         
         # Deduplication globals
-        seen_ids = set()
-        seen_lock = threading.Lock()
+        # Lock-free test-and-add: workers never wait on each other to dedup.
+        # Only a 64-bit digest of each Message-ID is kept, not the header string.
+        seen_ids = ConcurrentSet(key=message_id_key)
         count_lock = threading.Lock()
         shutdown_event = threading.Event()
         
         downloaded_count = 0
         skipped_count = 0
-        failed_tasks = [] # List of (folder, email_id)
+        failed_tasks = deque() # (folder, email_id) pairs
+        retry_failed = None # Collects write failures while a retry round runs
         
         # Download settings (can be changed via interactive menu)
-        settings = DownloadSettings(do_zip=False, max_retries=max_retries)
+        settings = DownloadSettings(do_zip=stream_zip, max_retries=max_retries)
         status = "Completed"
         
-        # Folder stats tracking: {folder_name: {'downloaded': 0, 'skipped': 0, 'failed': 0}}
-        folder_stats = {}
-        folder_stats_lock = threading.Lock()
+        # Folder stats tracking: one int slot per folder in each array, indexed
+        # by folder id. Updated under count_lock; turned into a dict for the summary.
+        folder_ids = {}
+        dl_counts = array('q')
+        skip_counts = array('q')
+        fail_counts = array('q')
+
+        def folder_index(folder):
+            # Caller holds count_lock (or no workers are running yet)
+            fid = folder_ids.get(folder)
+            if fid is None:
+                fid = folder_ids[folder] = len(folder_ids)
+                dl_counts.append(0)
+                skip_counts.append(0)
+                fail_counts.append(0)
+            return fid
+
+        for f in folders:
+            folder_index(f)
 
         # Active threads tracking
         active_threads = 0
         active_threads_lock = threading.Lock()
         
         # Executors
-        # Scan executor: 1 thread for background scan
-        scan_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        # Scan executor: the inbox scan plus the background folder scanners
+        scan_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1 + SCAN_WORKERS)
         # Download executor: N threads
         download_executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
         
-        download_futures = []
+        # Futures not finished yet; emptied by download_done_callback. The wait
+        # loop sleeps on wake_event instead of scanning every future.
+        pending = set()
+        # Caps the batches submitted but not finished. The scanners block once it
+        # is reached, so a huge mailbox never turns into a huge backlog of futures.
+        inflight_slots = threading.BoundedSemaphore(threads * 4)
+        wake_event = threading.Event()
         
         # Progress bar
         pbar = tqdm(total=0, unit=' emails', dynamic_ncols=True)
         
         start_time = time.time()
         
+        last_postfix = None
+
         def update_speed():
+            # The only place the bar is redrawn while downloading: callbacks just
+            # bump pbar.n, so terminal writes follow the 0.5s tick, not the email rate.
+            nonlocal last_postfix
             elapsed = time.time() - start_time
             if elapsed > 0:
                 speed_h = (downloaded_count / elapsed) * 3600
                 with active_threads_lock:
                     current_threads = active_threads
-                pbar.set_postfix_str(f"{speed_h:.0f} emails/h | Active: {current_threads} | Skipped: {skipped_count} | Errors: {len(failed_tasks)}")
+                postfix = f"{speed_h:.0f} emails/h | Active: {current_threads} | Skipped: {skipped_count} | Errors: {len(failed_tasks)}"
+                with count_lock:
+                    if postfix != last_postfix:
+                        pbar.set_postfix_str(postfix, refresh=False)
+                        last_postfix = postfix
+                    pbar.refresh()
 
-        def download_done_callback(future):
+        def record_result(folder, eid, success, error_msg):
+            # Caller holds count_lock
             nonlocal downloaded_count, skipped_count
+            fid = folder_index(folder)
+            if success:
+                if error_msg == "SKIPPED":
+                    skipped_count += 1
+                    skip_counts[fid] += 1
+                else:
+                    downloaded_count += 1
+                    dl_counts[fid] += 1
+            else:
+                failed_tasks.append((folder, eid))
+                error_logger.log(folder, eid, error_msg or "Unknown error")
+                fail_counts[fid] += 1
+
+        def download_done_callback(future):
+            inflight_slots.release()
+            with count_lock:
+                pending.discard(future)
+                if not pending:
+                    wake_event.set()
             # Check if already handled (e.g. by timeout logic)
             if getattr(future, 'handled', False):
                 return
 
-            folder, eid = getattr(future, 'task_info', ("Unknown", b"0"))
+            folder, eids = getattr(future, 'task_info', ("Unknown", [b"0"]))
             
             try:
-                success, error_msg, _, _ = future.result()
+                results = future.result()
                 with count_lock:
                     if getattr(future, 'handled', False): return
                     future.handled = True
                     
-                    if success:
-                        if error_msg == "SKIPPED":
-                            skipped_count += 1
-                            with folder_stats_lock:
-                                if folder not in folder_stats: folder_stats[folder] = {'downloaded': 0, 'skipped': 0, 'failed': 0}
-                                folder_stats[folder]['skipped'] += 1
-                        else:
-                            downloaded_count += 1
-                            with folder_stats_lock:
-                                if folder not in folder_stats: folder_stats[folder] = {'downloaded': 0, 'skipped': 0, 'failed': 0}
-                                folder_stats[folder]['downloaded'] += 1
-                    else:
-                        failed_tasks.append((folder, eid))
-                        error_logger.log(folder, eid, error_msg or "Unknown error")
-                        with folder_stats_lock:
-                            if folder not in folder_stats: folder_stats[folder] = {'downloaded': 0, 'skipped': 0, 'failed': 0}
-                            folder_stats[folder]['failed'] += 1
+                    for eid, success, error_msg in results:
+                        record_result(folder, eid, success, error_msg)
                     
-                    pbar.update(1)
-                    # REMOVED: update_speed() call to reduce I/O contention
+                    pbar.n += len(results) # No redraw; update_speed() refreshes the bar
             except Exception as exc:
                 with count_lock:
                     if getattr(future, 'handled', False): return
                     future.handled = True
-                    failed_tasks.append((folder, eid))
-                    error_logger.log(folder, eid, str(exc))
-                    with folder_stats_lock:
-                        if folder not in folder_stats: folder_stats[folder] = {'downloaded': 0, 'skipped': 0, 'failed': 0}
-                        folder_stats[folder]['failed'] += 1
-                    pbar.update(1)
+                    for eid in eids:
+                        record_result(folder, eid, False, str(exc))
+                    pbar.n += len(eids)
 
         # Generate dynamic filename base upfront
         # Format: emailuser_domain_Start_End
@@ -742,15 +1033,46 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
         error_logger = ErrorLogger(final_subfolder_path)
         menu = InteractiveMenu(settings, error_logger, shutdown_event)
 
+        def write_error_callback(path, tag, error_msg):
+            # The email was already counted as downloaded when it was queued
+            nonlocal downloaded_count
+            folder, eid = tag
+            with count_lock:
+                if retry_failed is not None:
+                    # Retried emails are only counted once the round is over
+                    retry_failed.append((folder, eid))
+                    error_logger.log(folder, eid, f"Write failed: {error_msg}")
+                    return
+                downloaded_count -= 1
+                # May run before the batch result itself is recorded
+                fid = folder_index(folder)
+                dl_counts[fid] -= 1
+                fail_counts[fid] += 1
+                failed_tasks.append((folder, eid))
+                error_logger.log(folder, eid, f"Write failed: {error_msg}")
+
+        # Disk writes happen on one background thread so download threads stay on the network
+        zip_filename = f"{base_name}.zip"
+        zip_path = os.path.join(output_dir, zip_filename)
+        if stream_zip:
+            # Emails go straight into the archive; no .eml files are written
+            click.echo(f"Writing emails to ZIP archive: {zip_path}")
+            file_writer = ZipFileWriter(zip_path, final_subfolder_path, compression_method, compress_lvl_arg,
+                                        hash_algorithms, max_pending=threads * 4, on_error=write_error_callback)
+        else:
+            file_writer = FileWriter(max_pending=threads * 4, on_error=write_error_callback)
+
         # Wrapper to track failures since callback doesn't have context easily
-        def download_wrapper(em, pw, srv, f, eid, out, s_ids, s_lock, s_event, port, use_ssl):
+        def download_wrapper(em, pw, srv, f, eid, out, s_ids, s_event, port, use_ssl):
             nonlocal active_threads
             with active_threads_lock:
                 active_threads += 1
             try:
                 if s_event.is_set():
                     return False, "Shutdown initiated", f, eid
-                res = download_email_task(em, pw, srv, f, eid, out, s_ids, s_lock, s_event, port, use_ssl)
+                # Retries go into the archive too; it stays open until finish()
+                res = download_email_task(em, pw, srv, f, eid, out, s_ids, s_event, port, use_ssl, imap_pool,
+                                          file_writer if stream_zip else None)
                 if not res[0]:
                     return False, res[1], f, eid
                 return True, res[1], f, eid
@@ -758,112 +1080,168 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
                 with active_threads_lock:
                     active_threads -= 1
 
-        def submit_download(folder, eid):
+        def download_batch_wrapper(f, eids, dedup):
+            nonlocal active_threads
+            with active_threads_lock:
+                active_threads += 1
+            try:
+                if shutdown_event.is_set():
+                    return [(eid, False, "Shutdown initiated") for eid in eids]
+                # Use final_subfolder_path directly. Batches deduplicated by the
+                # scanner are already claimed in seen_ids and must not be checked again.
+                batch_seen_ids = seen_ids if dedup else None
+                return download_email_batch_task(email, password, server_address, f, eids, final_subfolder_path, batch_seen_ids, shutdown_event, port, use_ssl, file_writer, imap_pool)
+            finally:
+                with active_threads_lock:
+                    active_threads -= 1
+
+        def submit_download(folder, eids, dedup=False):
+            # Wait for a free slot, but give up promptly on a graceful stop
+            while not inflight_slots.acquire(timeout=0.5):
+                if shutdown_event.is_set():
+                    return None
             if shutdown_event.is_set():
+                inflight_slots.release()
                 return None
             try:
-                # Use final_subfolder_path directly
-                f = download_executor.submit(download_wrapper, email, password, server_address, folder, eid, final_subfolder_path, seen_ids, seen_lock, shutdown_event, port, use_ssl)
-                f.task_info = (folder, eid) # Attach info for timeout handling
+                f = download_executor.submit(download_batch_wrapper, folder, eids, dedup)
+                f.task_info = (folder, eids) # Attach info for timeout handling
+                with count_lock:
+                    pending.add(f)
                 f.add_done_callback(download_done_callback)
-                download_futures.append(f)
                 return f
             except RuntimeError:
                 # Executor likely shutdown
+                inflight_slots.release()
                 return None
 
+        def queue_folder(client, folder, ids):
+            # Duplicates are found with a header-only FETCH per batch on the
+            # scanning connection, so only new emails are downloaded in full.
+            # The same FETCH reports sizes, which keep big emails out of shared batches.
+            for i in range(0, len(ids), fetch_batch_size):
+                if shutdown_event.is_set(): break
+                chunk = ids[i:i + fetch_batch_size]
+                try:
+                    chunk, duplicates, sizes = filter_duplicates(client, folder, chunk, seen_ids)
+                except (imaplib.IMAP4.error, OSError, RuntimeError) as e:
+                    # Leave deduplication to the download task for this batch
+                    error_logger.log(folder, b"SCAN", f"Message-ID prefetch failed: {e}")
+                    submit_download(folder, chunk, dedup=True)
+                    continue
+                if duplicates:
+                    with count_lock:
+                        for eid in duplicates:
+                            record_result(folder, eid, True, "SKIPPED")
+                        pbar.n += len(duplicates)
+                for batch in split_by_size(chunk, sizes):
+                    submit_download(folder, batch)
+
         try:
             # 1. Scan & Download Inbox IMMEDIATELY
+            # Runs on the scan executor too: submitting blocks while the download
+            # queue is full, and the main thread has to stay free for the menu.
+            def scan_inbox():
+                try:
+                    with imap_pool.acquire() as c:
+                        ids = c.fetch_email_ids(inbox_folder, criteria=search_criteria) if c else []
+                        count = len(ids)
+                        if count > 0:
+                            with count_lock:
+                                pbar.total += count
+                                pbar.refresh()
+                            queue_folder(c, inbox_folder, ids)
+                except Exception as e:
+                    error_logger.log(inbox_folder, b"SCAN", str(e))
+
+            scan_futures = []
             if inbox_folder:
                 click.echo(f"Scanning {inbox_folder}...")
-                c = AutoIMAPClient(email, password)
-                if c.connect(server_hostname=server_address, port=port, verbose=False, use_ssl=use_ssl):
-                    ids = c.fetch_email_ids(inbox_folder, s_date, e_date)
-                    c.close()
-                    count = len(ids)
-                    if count > 0:
-                        pbar.total += count
-                        pbar.refresh()
-                        for eid in ids:
-                            if shutdown_event.is_set(): break
-                            submit_download(inbox_folder, eid)
+                scan_futures.append(scan_executor.submit(scan_inbox))
             
             # 2. Background Scan for others
-            def background_scan():
-                # Use a separate client for scanning to avoid conflict
-                scan_client = AutoIMAPClient(email, password)
-                if not scan_client.connect(server_hostname=server_address, port=port, verbose=False, use_ssl=use_ssl):
-                    tqdm.write("Error: Background scanner could not connect.")
-                    return
+            # Scanners take folders from a shared queue, each on its own
+            # connection, so SELECT state never collides between them
+            folder_queue = deque(other_folders)
+            scanners_left = min(SCAN_WORKERS, len(other_folders))
 
-                for folder in other_folders:
-                    if shutdown_event.is_set(): break
-                    try:
-                        # Update status using pbar description safely
-                        with count_lock:
-                            pbar.set_description(f"Scanning: {folder[:20]}")
+            def background_scan():
+                nonlocal scanners_left
+                with imap_pool.acquire() as scan_client:
+                    if scan_client is None:
+                        tqdm.write("Error: Background scanner could not connect.")
+                    while scan_client is not None and not shutdown_event.is_set():
+                        try:
+                            folder = folder_queue.popleft()
+                        except IndexError:
+                            break
+                        try:
+                            # Update status using pbar description safely
+                            with count_lock:
+                                pbar.set_description(f"Scanning: {folder[:20]}")
                         
-                        # Select folder
-                        if not scan_client.select_folder(folder):
-                            continue
+                            # Select folder
+                            if not scan_client.select_folder(folder):
+                                continue
                             
-                        ids = scan_client.fetch_email_ids(folder, s_date, e_date)
+                            ids = scan_client.fetch_email_ids(folder, criteria=search_criteria)
                         
-                        if ids:
-                            count = len(ids)
+                            if ids:
+                                count = len(ids)
                             
-                            # Update total safely
-                            with count_lock:
-                                pbar.total += count
-                                pbar.refresh()
+                                # Update total safely
+                                with count_lock:
+                                    pbar.total += count
+                                    pbar.refresh()
                                 
-                            for eid in ids:
-                                if shutdown_event.is_set(): break
-                                submit_download(folder, eid)
+                                queue_folder(scan_client, folder, ids)
                              
-                    except Exception as e:
-                        error_logger.log(folder, b"SCAN", str(e))
-                
-                scan_client.close()
+                        except Exception as e:
+                            error_logger.log(folder, b"SCAN", str(e))
+
                 with count_lock:
-                    pbar.set_description("Scan complete")
+                    scanners_left -= 1
+                    if not scanners_left:
+                        pbar.set_description("Scan complete")
             
-            scan_future = scan_executor.submit(background_scan)
+            for _ in range(scanners_left):
+                scan_futures.append(scan_executor.submit(background_scan))
+            for scan_future in scan_futures:
+                scan_future.add_done_callback(lambda _: wake_event.set())
             
             # 3. Interactive Wait Loop
             # Wait until scan is done AND all downloads are done
             click.echo("\nPress M or ESC for menu, ENTER for status update...")
             
+            key_reader = KeyReader(wake_event).start()
             last_update_time = time.time()
             
-            while True:
-                # Check if scan is done
-                scan_done = scan_future.done()
-                
-                # Check if all downloads are done
-                # Optimization: Only check if scan is done, otherwise we know we aren't done
-                if scan_done:
-                    downloads_done = all(f.done() for f in download_futures)
-                    if downloads_done:
-                        break
-                
-                # Check if graceful stop was triggered via menu
-                if settings.should_stop:
-                    # Don't break immediately, wait for in-flight downloads
-                    if scan_done and all(f.done() for f in download_futures):
-                        break
-                
-                # Check for user input
-                if msvcrt.kbhit():
-                    char = msvcrt.getwche()
+            try:
+                while True:
+                    # Cleared before checking, so a wake-up during the checks is not lost
+                    wake_event.clear()
+                    
+                    # Done once the scan is finished and nothing is pending.
+                    # This also covers a graceful stop via the menu: no new
+                    # downloads are submitted, in-flight ones drain.
+                    if all(f.done() for f in scan_futures):
+                        with count_lock:
+                            downloads_done = not pending
+                        if downloads_done:
+                            break
+                    
+                    # Check for user input
+                    char = key_reader.get_key()
                     if char in ('m', 'M', '\x1b'):  # M key or ESC
                         # Pause progress bar to avoid overwriting menu
                         with count_lock:
                             pbar.clear()
                             pbar.disable = True
                         
-                        # Show interactive menu
+                        # Show interactive menu; it reads the console itself
+                        key_reader.pause()
                         menu.show()
+                        key_reader.resume()
                         
                         # Resume progress bar
                         with count_lock:
@@ -878,22 +1256,19 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
                             pbar.refresh()
                             # Print explicit status line below pbar
                             tqdm.write(f"\n[Status Update] Downloaded: {downloaded_count} | Skipped: {skipped_count} | Remaining: {pbar.total - (downloaded_count + skipped_count + len(failed_tasks))}")
-                
-                # Periodic Update (every 0.5s)
-                current_time = time.time()
-                if current_time - last_update_time > 0.5:
-                    update_speed()
-                    last_update_time = current_time
-                
-                # Sleep to prevent CPU hogging
-                time.sleep(0.1)
-            
-            # Final check for any exceptions/timeouts not caught
-            for f in download_futures:
-                try:
-                    f.result(timeout=0) # Should be done
-                except Exception:
-                    pass # Handled by callback or ignored
+                    
+                    # Periodic Update (every 0.5s)
+                    current_time = time.time()
+                    if current_time - last_update_time > 0.5:
+                        update_speed()
+                        last_update_time = current_time
+                    
+                    # Sleep until a key press, the scan finishing, the last
+                    # download completing, or the next periodic update
+                    if key_reader.keys.empty():
+                        wake_event.wait(0.5)
+            finally:
+                key_reader.stop()
                 
         except KeyboardInterrupt:
             pbar.close()
@@ -907,6 +1282,8 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
             pbar.close()
             scan_executor.shutdown(wait=False)
             download_executor.shutdown(wait=False)
+            # Flush queued files before counting, retrying or zipping
+            file_writer.close()
             
         # Retry Logic
         # Use settings.max_retries which may have been updated via menu
@@ -943,8 +1320,12 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
 
             if should_retry:
                 click.echo(f"Retrying failures with timeout {timeout_val}s...")
-                # Retry batch
-                new_failed = []
+                # Retry batch; a snapshot, as write failures may arrive while it is submitted
+                retry_batch = list(failed_tasks)
+                failed_tasks.clear()
+                new_failed = deque()
+                retry_failed = new_failed
+                retry_duplicates = deque()
                 
                 # We need a new list of futures for retry
                 retry_futures = []
@@ -957,16 +1338,21 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
                         if not success:
                              new_failed.append((folder, eid))
                              error_logger.log(folder, eid, error_msg or "Retry failed")
+                        elif error_msg == "SKIPPED":
+                            retry_duplicates.append((folder, eid))
                     except Exception as exc:
                         new_failed.append((folder, eid))
                         error_logger.log(folder, eid, f"Retry exception: {exc}")
                     pbar_retry.update(1)
 
                 with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
-                    with tqdm(total=len(failed_tasks), unit=' emails') as pbar_retry:
-                        for folder, eid in failed_tasks:
-                            # Use final_subfolder_path here as well
-                            f = executor.submit(download_wrapper, email, password, server_address, folder, eid, final_subfolder_path, seen_ids, seen_lock, shutdown_event, port, use_ssl)
+                    with tqdm(total=len(retry_batch), unit=' emails') as pbar_retry:
+                        for folder, eid in retry_batch:
+                            # Use final_subfolder_path here as well. A failed email's
+                            # Message-ID may never have been claimed (e.g. its batch
+                            # failed before the FETCH), so it is checked again; its
+                            # own earlier claim does not make it a duplicate.
+                            f = executor.submit(download_wrapper, email, password, server_address, folder, eid, final_subfolder_path, seen_ids, shutdown_event, port, use_ssl)
                             f.task_info = (folder, eid)
                             f.add_done_callback(retry_done_callback)
                             retry_futures.append(f)
@@ -978,15 +1364,22 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
                             except:
                                 pass
                             
-                recovered = len(failed_tasks) - len(new_failed)
-                click.echo(f"Recovered: {recovered}. Still failing: {len(new_failed)}")
+                # The executor has shut down, and the writer is closed, so retried
+                # files were written synchronously: every write failure is in new_failed
+                retry_failed = None
+                recovered = len(retry_batch) - len(new_failed) - len(retry_duplicates)
+                click.echo(f"Recovered: {recovered}. Duplicates: {len(retry_duplicates)}. Still failing: {len(new_failed)}")
                 failed_tasks = new_failed
                 
-                # Update total downloaded count
+                # Update total downloaded and skipped counts
                 downloaded_count += recovered
+                skipped_count += len(retry_duplicates)
             else:
                 break
 
+        # Workers and retries are done; log out of the pooled connections
+        imap_pool.close()
+
         end_time = time.time()
         duration_seconds = end_time - start_time
         duration_hours = duration_seconds / 3600.0
@@ -996,18 +1389,26 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
         processed_count = downloaded_count + skipped_count + len(failed_tasks)
         remaining_count = max(0, total_items - processed_count)
 
+        folder_stats = {
+            folder: {'downloaded': dl_counts[fid], 'skipped': skip_counts[fid], 'failed': fail_counts[fid]}
+            for folder, fid in folder_ids.items()
+            if dl_counts[fid] or skip_counts[fid] or fail_counts[fid]
+        }
+
         click.echo(f"\nDownload finished. Status: {status}")
         click.echo(f"Downloaded: {downloaded_count}")
         click.echo(f"Skipped (Duplicates): {skipped_count}")
         click.echo(f"Final Errors: {len(failed_tasks)}")
         click.echo(f"Remaining (Cancelled): {remaining_count}")
         click.echo(f"Average Speed: {emails_per_hour:.2f} emails/hour")
-        click.echo(f"Emails saved in: {os.path.abspath(output_dir)}")
+        click.echo(f"Emails saved in: {os.path.abspath(zip_path if stream_zip else output_dir)}")
         
         # Zip and Hash section
         # If ZIP was configured via interactive menu, use that setting directly
         click.echo("\n")
-        if settings.zip_configured:
+        if stream_zip:
+            user_choice = 'y'
+        elif settings.zip_configured:
             user_choice = 'y' if settings.do_zip else 'n'
             click.echo(f"ZIP creation (set via menu): {'Yes' if settings.do_zip else 'No'}")
         elif batch:
@@ -1016,54 +1417,70 @@ def main(email, password, start_date, end_date, days, output_dir, threads, max_r
             user_choice = timed_input("Create ZIP archive of downloaded emails? (y/n)", timeout=10, default='y')
         
         if user_choice.lower() == 'y':
-            zip_filename = f"{base_name}.zip"
-            zip_path = os.path.join(output_dir, zip_filename)
-            
-            click.echo(f"Creating ZIP archive: {zip_path}...")
-            
-            # Zip the subfolder
-            create_zip_archive(final_subfolder_path, zip_path, compression_method=compression_method, compress_level=compress_lvl_arg)
-            
-            click.echo("Calculating hashes...")
-            hashes = calculate_hashes(zip_path)
-            file_size = os.path.getsize(zip_path)
-            
-            click.echo(f"SHA1 Hash: {hashes['sha1']}")
-            click.echo(f"SHA256 Hash: {hashes['sha256']}")
-            click.echo(f"BLAKE2b Hash: {hashes['blake2b']}")
+            hashes = None
+            try:
+                if stream_zip:
+                    click.echo(f"Finishing ZIP archive: {zip_path}...")
+                    file_size, hashes = file_writer.finish()
+                else:
+                    click.echo(f"Creating ZIP archive: {zip_path}...")
+                
+                    # Zip the subfolder
+                    # The archive is hashed while it is written, so it is never read back
+                    file_size, hashes = create_zip_archive(final_subfolder_path, zip_path, compression_method=compression_method, compress_level=compress_lvl_arg,
+                                                           hash_algorithms=hash_algorithms)
+            except OSError as e:
+                click.echo(f"Error: ZIP creation failed, archive removed: {e}")
+
+        if user_choice.lower() == 'y' and hashes is not None:
+            for algo, digest in hashes.items():
+                click.echo(f"{HASH_LABELS[algo]} Hash: {digest}")
             
             # Save hash to file
             checksum_file = os.path.join(output_dir, f"{base_name}.txt")
-            with open(checksum_file, "w") as f:
-                f.write(f"Email Downloader v{get_current_version()}\n")
-                f.write(f"File: {zip_filename}\n")
-                f.write(f"Size: {file_size} bytes\n")
-                f.write(f"SHA1: {hashes['sha1']}\n")
-                f.write(f"SHA256: {hashes['sha256']}\n")
-                f.write(f"BLAKE2b: {hashes['blake2b']}\n")
-                f.write(f"Date: {datetime.now().isoformat()}\n")
-                f.write(f"Status: {status}\n")
-                f.write(f"Total Emails: {total_items}\n")
-                f.write(f"Downloaded: {downloaded_count}\n")
-                f.write(f"Skipped: {skipped_count}\n")
-                f.write(f"Failed: {len(failed_tasks)}\n")
-                f.write(f"Remaining: {remaining_count}\n")
-                f.write(f"Speed: {emails_per_hour:.2f} emails/hour\n")
-                f.write(f"Server Connected: {server_address}\n")
-                if hasattr(client, 'connection_attempts') and client.connection_attempts:
-                    f.write("Failed Connection Attempts:\n")
-                    for srv, err in client.connection_attempts:
-                        f.write(f"  - {srv}: {err}\n")
-                f.write("\n--- Folder Statistics ---\n")
-                for folder, stats in folder_stats.items():
-                    f.write(f"Folder: {folder} - Downloaded: {stats['downloaded']}, Skipped: {stats['skipped']}, Failed: {stats['failed']}\n")
+            details = [
+                f"Status: {status}",
+                f"Total Emails: {total_items}",
+                f"Downloaded: {downloaded_count}",
+                f"Skipped: {skipped_count}",
+                f"Failed: {len(failed_tasks)}",
+                f"Remaining: {remaining_count}",
+                f"Speed: {emails_per_hour:.2f} emails/hour",
+                f"Server Connected: {server_address}",
+            ]
+            if hasattr(client, 'connection_attempts') and client.connection_attempts:
+                details.append("Failed Connection Attempts:")
+                details.extend(f"  - {srv}: {err}" for srv, err in client.connection_attempts)
+            details.append("\n--- Folder Statistics ---")
+            details.extend(f"Folder: {folder} - Downloaded: {stats['downloaded']}, Skipped: {stats['skipped']}, Failed: {stats['failed']}"
+                           for folder, stats in folder_stats.items())
+            write_checksum_file(checksum_file, zip_filename, file_size, hashes, details)
             
             click.echo(f"Integrity info saved in {checksum_file}")
 
+        # Returned to programmatic callers (e.g. benchmark.py --in-process);
+        # ignored by click when run from the command line.
+        return {
+            'status': status,
+            'downloaded': downloaded_count,
+            'skipped': skipped_count,
+            'errors': len(failed_tasks),
+            'remaining': remaining_count,
+            'speed': emails_per_hour,
+            'connection_errors': [err for _, err in getattr(client, 'connection_attempts', [])],
+        }
+
     except Exception as e:
         click.echo(f"\nAn error occurred: {e}")
         import traceback
         traceback.print_exc()
+        if 'imap_pool' in locals():
+            imap_pool.close()
+        if 'file_writer' in locals() and isinstance(file_writer, ZipFileWriter):
+            try:
+                file_writer.finish()  # Keep what was downloaded readable
+            except OSError as zip_error:
+                click.echo(f"Error: ZIP creation failed, archive removed: {zip_error}")
         if 'client' in locals() and client.connection:
             try:
                 client.close()
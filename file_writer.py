@@ -0,0 +1,185 @@
+
+import threading
+import queue
+import os
+import time
+import zipfile
+
+from utils import write_file, prepare_zip_member, append_zip_member, HashingWriter
+
+
+class FileWriter:
+    """
+    Background writer for downloaded emails.
+    Download threads hand over (path, bytes) and go straight back to the
+    network while a single thread does the disk I/O. The queue is bounded so
+    a slow disk throttles the producers instead of buffering without limit.
+    """
+
+    def __init__(self, max_pending: int = 64, on_error=None):
+        """
+        Args:
+            max_pending: Maximum number of files waiting to be written.
+            on_error: Optional callback(path, tag, error_message) called from the
+                writer thread when a file cannot be written.
+        """
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._on_error = on_error
+        self._known_dirs = set()
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name="FileWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, path: str, data: bytes, tag=None):
+        """
+        Queues a file to be written. Blocks while the queue is full.
+        After close(), the file is written synchronously instead.
+
+        Args:
+            path: Destination file path.
+            data: File content.
+            tag: Opaque value passed back to on_error (e.g. (folder, uid)).
+        """
+        with self._close_lock:
+            if not self._closed:
+                self._queue.put((path, data, tag))
+                return
+        self._write(path, data, tag)
+
+    def close(self):
+        """Writes everything still queued and stops the writer thread."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._write(*item)
+
+    def _write(self, path: str, data: bytes, tag):
+        try:
+            directory = os.path.dirname(path)
+            if directory and directory not in self._known_dirs:
+                os.makedirs(directory, exist_ok=True)
+                self._known_dirs.add(directory)
+            write_file(path, data)
+            self.written += 1
+        except OSError as e:
+            if self._on_error:
+                self._on_error(path, tag, str(e))
+
+
+class ZipFileWriter(FileWriter):
+    """
+    FileWriter that appends each file to a ZIP archive instead of creating it
+    on disk, so downloaded emails are written once and never re-read for zipping.
+    Members are compressed by the submitting thread; the writer thread only
+    appends them. The archive is hashed as it is written.
+    After close(), files are still appended synchronously until finish().
+    A failed write can leave part of a member in the file, after which every
+    later offset is wrong: the archive is then treated as broken, later files
+    are reported through on_error and finish() removes it.
+    """
+
+    def __init__(self, zip_path: str, root_dir: str, compression_method=zipfile.ZIP_STORED, compress_level=None,
+                 hash_algorithms=None, max_pending: int = 64, on_error=None):
+        """
+        Args:
+            zip_path: Archive to create.
+            root_dir: Submitted paths are stored relative to this directory.
+            compression_method: zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED or utils.ZIP_ZSTANDARD.
+            compress_level: DEFLATE or Zstandard level, or None for the default.
+            hash_algorithms: Names from utils.HASH_ALGORITHMS to compute, or None.
+            max_pending: Maximum number of files waiting to be written.
+            on_error: Optional callback(path, tag, error_message) called when a
+                file cannot be added.
+        """
+        self._root = os.path.join(root_dir, '')
+        self._compression_method = compression_method
+        self._compress_level = compress_level
+        self._zip_lock = threading.Lock()
+        self._zip_path = zip_path
+        self._error = None
+        self._file = open(zip_path, 'wb')
+        self._out = HashingWriter(self._file, hash_algorithms) if hash_algorithms else None
+        self._zipf = zipfile.ZipFile(self._out or self._file, 'w', compression_method)
+        super().__init__(max_pending=max_pending, on_error=on_error)
+
+    def submit(self, path, data: bytes, tag=None):
+        """
+        Compresses a file and queues it to be added to the archive.
+        Blocks while the queue is full.
+
+        Args:
+            path: Destination path under root_dir (str or bytes).
+            data: File content.
+            tag: Opaque value passed back to on_error (e.g. (folder, uid)).
+        """
+        arcname = os.fsdecode(path)
+        if arcname.startswith(self._root):
+            arcname = arcname[len(self._root):]
+        zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        zinfo.external_attr = 0o644 << 16
+        payload = prepare_zip_member(zinfo, data, self._compression_method, self._compress_level)
+        super().submit(path, (zinfo, payload), tag)
+
+    def finish(self):
+        """
+        Writes everything still queued and completes the archive.
+        Returns (archive_size, digests keyed by algorithm name), or None if no
+        hash algorithms were requested.
+        Raises OSError, after removing the archive, if a write had failed.
+        """
+        self.close()
+        with self._zip_lock:
+            if self._zipf.fp is not None:
+                if self._error is None:
+                    self._zipf.close()
+                    self._file.close()
+                else:
+                    self._file.close()
+                    try:
+                        # Only detaches the ZipFile: its end record cannot reach the closed file
+                        self._zipf.close()
+                    except ValueError:
+                        pass
+                    if os.path.exists(self._zip_path):
+                        os.remove(self._zip_path)
+        if self._error is not None:
+            raise OSError(f"a write to the archive failed: {self._error}") from self._error
+        return (self._out.tell(), self._out.hexdigests()) if self._out else None
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+
+    def _write(self, path, data, tag):
+        zinfo, payload = data
+        try:
+            with self._zip_lock:
+                if self._error is not None:
+                    raise OSError(f"ZIP archive broken by an earlier write error: {self._error}")
+                if self._zipf.fp is None:
+                    raise ValueError("ZIP archive already finished")
+                try:
+                    append_zip_member(self._zipf, zinfo, payload)
+                except OSError as e:
+                    self._error = e
+                    raise
+            self.written += 1
+        except (OSError, ValueError) as e:
+            if self._on_error:
+                self._on_error(path, tag, str(e))
@@ -1,13 +1,305 @@
 import re
+import os
+import json
+import functools
+import time
+import threading
+import concurrent.futures
 import imaplib
 import socket
 import ssl
 import struct
 from datetime import datetime
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, List, Dict
+import urllib.error
 import urllib.request
 import xml.etree.ElementTree as ET
 
+# UID item in a FETCH response line, e.g. b'12 (UID 3456 BODY[] {789}'
+_UID_RE = re.compile(rb'UID (\d+)')
+# LIST response line: (flags) "delimiter" name, where name may be quoted
+_FOLDER_RE = re.compile(rb'\((?P<flags>[^)]*)\)\s+"(?P<delim>[^"]+)"\s+(?P<name>.+)')
+# Folders skipped by list_folders: spam-like ones (unless they are a trash
+# folder) and Gmail's All Mail, which repeats every other folder's messages
+_SPAM_FOLDER_RE = re.compile(r'spam|junk|bulk', re.IGNORECASE)
+_TRASH_FOLDER_RE = re.compile(r'trash', re.IGNORECASE)
+_ALL_MAIL_FOLDER_RE = re.compile(r'todos os e-mails|all mail', re.IGNORECASE)
+# Start of a new message in a FETCH response ("<seq> (")
+_FETCH_START_RE = re.compile(rb'^\s*\d+ \(')
+# Message-ID header value: an <id> or, for malformed headers, the rest of the line
+_MSGID_RE = re.compile(rb'Message-ID:\s*(<[^>]+>|[^\r\n]+)', re.IGNORECASE)
+# Gmail's permanent message id, the same in every label the message is in
+_GM_MSGID_RE = re.compile(rb'X-GM-MSGID (\d+)')
+# Message size item of a FETCH response
+_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+# Capability of servers that support the Gmail IMAP extensions
+GMAIL_EXTENSION = 'X-GM-EXT-1'
+# UID set in an ESEARCH response, e.g. b'(TAG "A1") UID ALL 1:100,205'
+_ESEARCH_ALL_RE = re.compile(rb'\bALL ([\d:,]+)')
+
+# Read buffer of the IMAP socket file. imaplib reads responses line by line;
+# with the default 8 KiB buffer a large FETCH costs many small recv() calls.
+IMAP_READ_BUFFER_SIZE = 256 * 1024
+
+# With several candidate servers, the next one is dialed if the current one
+# has not connected within this many seconds
+CONNECT_STAGGER = 0.25
+
+# Dials still in flight keep a worker until they connect or time out
+CONNECT_DIAL_WORKERS = 8
+
+@functools.lru_cache(maxsize=None)
+def _dial_pool():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=CONNECT_DIAL_WORKERS,
+                                                 thread_name_prefix="IMAPDial")
+
+# Resolved IMAP server addresses are reused for this long: the pool opens one
+# connection per worker, all to the same host
+DNS_CACHE_TTL = 300
+
+_dns_cache: Dict[Tuple[str, int], Tuple[float, list]] = {}
+_dns_lock = threading.Lock()
+
+def cached_getaddrinfo(host: str, port: int) -> list:
+    """socket.getaddrinfo for a TCP connection, cached for DNS_CACHE_TTL seconds."""
+    key = (host, port)
+    now = time.monotonic()
+    with _dns_lock:
+        entry = _dns_cache.get(key)
+    if entry and entry[0] > now:
+        return entry[1]
+    infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    with _dns_lock:
+        _dns_cache[key] = (now + DNS_CACHE_TTL, infos)
+    return infos
+
+def _connect_cached(host: str, port: int, timeout: Optional[float]) -> socket.socket:
+    """socket.create_connection, but resolving host through cached_getaddrinfo."""
+    error = None
+    for family, sock_type, proto, _, address in cached_getaddrinfo(host, port):
+        sock = socket.socket(family, sock_type, proto)
+        try:
+            if timeout is not None:
+                sock.settimeout(timeout)
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError(f"getaddrinfo returned no addresses for {host}")
+
+class _BufferedReadMixin:
+    """
+    Replaces imaplib's socket file with one using IMAP_READ_BUFFER_SIZE, and
+    turns off Nagle's algorithm: commands are small writes, each answered
+    before the next, so they should leave at once.
+    The server name is resolved through cached_getaddrinfo.
+    """
+
+    def _create_socket(self, timeout):
+        if not self.host:
+            return super()._create_socket(timeout)
+        sock = _connect_cached(self.host, self.port, timeout)
+        # IMAP4_SSL._create_socket would resolve the host again, so wrap here
+        ssl_context = getattr(self, 'ssl_context', None)
+        if ssl_context is not None:
+            return ssl_context.wrap_socket(sock, server_hostname=self.host)
+        return sock
+
+    def open(self, *args, **kwargs):
+        super().open(*args, **kwargs)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        # Nothing has been read yet (the greeting comes after open), so no data is lost.
+        # Closing the file object leaves the socket open.
+        self.file.close()
+        self.file = self.sock.makefile('rb', buffering=IMAP_READ_BUFFER_SIZE)
+
+class BufferedIMAP4(_BufferedReadMixin, imaplib.IMAP4):
+    """imaplib.IMAP4 with a large socket read buffer."""
+
+class BufferedIMAP4_SSL(_BufferedReadMixin, imaplib.IMAP4_SSL):
+    """imaplib.IMAP4_SSL with a large socket read buffer."""
+
+# Autoconfig results (domain -> IMAP hostname) are kept on disk between runs:
+# each lookup is an HTTPS request that can take seconds when the host is slow.
+AUTOCONFIG_CACHE_FILE = os.path.join(
+    os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'email-downloader', 'autoconfig.json')
+AUTOCONFIG_CACHE_TTL = 7 * 24 * 3600
+# Misses (the server answered: no config) are retried sooner than hits
+AUTOCONFIG_MISS_TTL = 24 * 3600
+# Returned by a lookup that could not get an answer (timeout, server error);
+# such a result is not written to the cache file
+AUTOCONFIG_UNAVAILABLE = object()
+
+# getaddrinfo errors meaning the name does not exist, as opposed to a failing resolver
+_NO_SUCH_HOST_ERRNOS = {code for code in (getattr(socket, 'EAI_NONAME', None), getattr(socket, 'EAI_NODATA', None))
+                        if code is not None}
+
+def _is_autoconfig_miss(exc: Exception) -> bool:
+    """
+    True if exc from an autoconfig request means there is no config there
+    (no such host, nothing listening, 4xx, not XML), False for transient
+    failures such as timeouts, resolver errors and 5xx responses.
+    """
+    if isinstance(exc, urllib.error.HTTPError):
+        return 400 <= exc.code < 500
+    if isinstance(exc, urllib.error.URLError):
+        exc = exc.reason
+    if isinstance(exc, socket.gaierror):
+        return exc.errno in _NO_SUCH_HOST_ERRNOS
+    return isinstance(exc, (ConnectionRefusedError, ssl.SSLCertVerificationError, ET.ParseError))
+
+_autoconfig_memo: Dict[str, Optional[str]] = {}
+_autoconfig_lock = threading.Lock()
+
+def _load_autoconfig_cache() -> dict:
+    try:
+        with open(AUTOCONFIG_CACHE_FILE, encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _store_autoconfig_cache(key: str, hostname: Optional[str]):
+    """Adds one entry to the cache file, replacing it atomically. Errors are ignored."""
+    try:
+        with _autoconfig_lock:
+            cache = _load_autoconfig_cache()
+            cache[key] = {'hostname': hostname, 'fetched_at': time.time()}
+            os.makedirs(os.path.dirname(AUTOCONFIG_CACHE_FILE), exist_ok=True)
+            tmp_path = f"{AUTOCONFIG_CACHE_FILE}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, AUTOCONFIG_CACHE_FILE)
+    except OSError:
+        pass
+
+def cached_autoconfig(key: str, lookup) -> Optional[str]:
+    """
+    Returns the hostname for key from the in-process memo, then the cache file
+    (if not expired), and only then by calling lookup(), whose result is stored.
+    lookup() returns AUTOCONFIG_UNAVAILABLE when it got no answer; that is only
+    remembered for this process (as None), so the next run asks again.
+    """
+    with _autoconfig_lock:
+        if key in _autoconfig_memo:
+            return _autoconfig_memo[key]
+    entry = _load_autoconfig_cache().get(key)
+    if isinstance(entry, dict):
+        hostname = entry.get('hostname')
+        ttl = AUTOCONFIG_CACHE_TTL if hostname else AUTOCONFIG_MISS_TTL
+        if time.time() - entry.get('fetched_at', 0) >= ttl:
+            entry = None
+    if not isinstance(entry, dict):
+        hostname = lookup()
+        if hostname is AUTOCONFIG_UNAVAILABLE:
+            hostname = None
+        else:
+            _store_autoconfig_cache(key, hostname)
+    with _autoconfig_lock:
+        _autoconfig_memo[key] = hostname
+    return hostname
+
+# IMAP dates always use English month names; strftime("%b") follows the locale
+_IMAP_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+def _imap_date(value: datetime) -> str:
+    """Formats a date the IMAP way: DD-Mon-YYYY."""
+    return f"{value.day:02d}-{_IMAP_MONTHS[value.month - 1]}-{value.year:04d}"
+
+def build_search_criteria(start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> str:
+    """
+    Builds the UID SEARCH criteria for a date range, as one AND-ed key list.
+    The result does not depend on the folder, so callers scanning many
+    folders build it once.
+    """
+    keys = []
+    if start_date:
+        keys.append(f'SINCE "{_imap_date(start_date)}"')
+    if end_date:
+        keys.append(f'BEFORE "{_imap_date(end_date)}"')
+    return ' '.join(keys) or 'ALL'
+
+def format_uid_set(email_ids: List[bytes]) -> str:
+    """
+    Formats UIDs as an IMAP sequence set, collapsing consecutive runs into
+    ranges ("1:100,105"). SEARCH results are mostly contiguous, so a large
+    batch stays a short command instead of hitting server line-length limits.
+    """
+    parts = []
+    start = prev = None
+    for uid in map(int, email_ids):
+        if prev is not None and uid == prev + 1:
+            prev = uid
+            continue
+        if start is not None:
+            parts.append(f"{start}:{prev}" if prev != start else str(start))
+        start = prev = uid
+    if start is not None:
+        parts.append(f"{start}:{prev}" if prev != start else str(start))
+    return ','.join(parts)
+
+def parse_uid_set(uid_set: bytes) -> List[bytes]:
+    """Expands an IMAP sequence set such as b"1:3,7" into [b"1", b"2", b"3", b"7"]."""
+    uids = []
+    for part in uid_set.split(b','):
+        if not part:
+            continue
+        start, _, end = part.partition(b':')
+        if not end:
+            uids.append(start)
+            continue
+        low, high = sorted((int(start), int(end)))
+        uids.extend(str(uid).encode() for uid in range(low, high + 1))
+    return uids
+
+def _parse_fetch_literals(data) -> Dict[bytes, dict]:
+    """
+    Groups the literals of a multi-message UID FETCH response by UID.
+    Returns {uid: {'header': bytes, 'body': bytes, 'gm_msgid': bytes, 'size': int}}
+    with whichever of the HEADER.FIELDS, BODY[], X-GM-MSGID and RFC822.SIZE
+    items the server sent for each message.
+    """
+    messages = {}
+    current = None
+    for part in data:
+        if isinstance(part, tuple):
+            prefix, literal = part
+            if current is None or _FETCH_START_RE.match(prefix):
+                if current and 'uid' in current:
+                    messages[current.pop('uid')] = current
+                current = {}
+            match = _UID_RE.search(prefix)
+            if match:
+                current['uid'] = match.group(1)
+            match = _GM_MSGID_RE.search(prefix)
+            if match:
+                current['gm_msgid'] = match.group(1)
+            match = _SIZE_RE.search(prefix)
+            if match:
+                current['size'] = int(match.group(1))
+            # The literal belongs to the last item named in the prefix
+            item = prefix[prefix.rfind(b'BODY['):].upper()
+            current['header' if b'HEADER' in item else 'body'] = literal
+        elif isinstance(part, bytes) and current is not None:
+            # Some servers send the UID after the literal: b' UID 11)'
+            match = _UID_RE.search(part)
+            if match:
+                current['uid'] = match.group(1)
+            match = _GM_MSGID_RE.search(part)
+            if match:
+                current['gm_msgid'] = match.group(1)
+            match = _SIZE_RE.search(part)
+            if match:
+                current['size'] = int(match.group(1))
+    if current and 'uid' in current:
+        messages[current.pop('uid')] = current
+    return messages
+
 class AutoIMAPClient:
     """
     A wrapper around imaplib to handle auto-discovery of IMAP servers
@@ -74,6 +366,7 @@ class AutoIMAPClient:
         self.server_address: Optional[str] = None
         self.detected_provider: Optional[str] = None  # Friendly name of detected provider
         self.connection_attempts: List[Tuple[str, str]] = [] # List of (server, error)
+        self.current_folder: Optional[str] = None  # Folder selected on the current connection
 
     def _resolve_mx_records(self) -> List[str]:
         """
@@ -475,14 +768,20 @@ class AutoIMAPClient:
         return False
 
     def _lookup_mozilla_autoconfig(self) -> Optional[str]:
+        """Cached result of _fetch_mozilla_autoconfig (see cached_autoconfig)."""
+        return cached_autoconfig(f"mozilla:{self.domain}", self._fetch_mozilla_autoconfig)
+
+    def _fetch_mozilla_autoconfig(self) -> Optional[str]:
         """
         Queries the domain's own Mozilla autoconfig endpoint.
         Many mail providers host autoconfig XML at:
           https://autoconfig.{domain}/mail/config-v1.1.xml
           or
           https://{domain}/.well-known/autoconfig/mail/config-v1.1.xml
-        Returns the IMAP hostname if found, otherwise None.
+        Returns the IMAP hostname if found, None if no URL has a config, or
+        AUTOCONFIG_UNAVAILABLE if some URL could not be checked.
         """
+        result = None
         urls = [
             f"https://autoconfig.{self.domain}/mail/config-v1.1.xml",
             f"http://autoconfig.{self.domain}/mail/config-v1.1.xml",
@@ -507,14 +806,21 @@ class AutoIMAPClient:
                                 hostname = server.find(f'{ns}hostname')
                                 if hostname is not None and hostname.text:
                                     return hostname.text.strip()
-            except Exception:
+            except Exception as e:
+                if not _is_autoconfig_miss(e):
+                    result = AUTOCONFIG_UNAVAILABLE
                 continue
-        return None
+        return result
 
     def _lookup_thunderbird_config(self) -> Optional[str]:
+        """Cached result of _fetch_thunderbird_config (see cached_autoconfig)."""
+        return cached_autoconfig(f"thunderbird:{self.domain}", self._fetch_thunderbird_config)
+
+    def _fetch_thunderbird_config(self) -> Optional[str]:
         """
         Queries Thunderbird's autoconfig service for the domain.
-        Returns the hostname if found, otherwise None.
+        Returns the hostname if found, None if the service has no config for it,
+        or AUTOCONFIG_UNAVAILABLE if the service could not be reached.
         """
         try:
             url = f"https://autoconfig.thunderbird.net/v1.1/{self.domain}"
@@ -528,8 +834,9 @@ class AutoIMAPClient:
                             hostname = server.find('hostname')
                             if hostname is not None:
                                 return hostname.text
-        except Exception:
-            pass
+        except Exception as e:
+            if not _is_autoconfig_miss(e):
+                return AUTOCONFIG_UNAVAILABLE
         return None
 
     def _guess_server(self) -> List[str]:
@@ -715,31 +1022,113 @@ class AutoIMAPClient:
             potential_servers = self._guess_server()
         
         self.connection_attempts = [] # Reset attempts on new connect call
-        
-        for server in potential_servers:
+        self.current_folder = None
+        mode = 'SSL' if use_ssl else 'No-SSL'
+
+        if len(potential_servers) == 1:
+            server = potential_servers[0]
+            if verbose:
+                print(f"Attempting to connect to {server}:{port} ({mode})...")
+            connection = None
             try:
-                if verbose:
-                    print(f"Attempting to connect to {server}:{port} ({'SSL' if use_ssl else 'No-SSL'})...")
-                
-                if use_ssl:
-                    self.connection = imaplib.IMAP4_SSL(server, port, timeout=10)
-                else:
-                    self.connection = imaplib.IMAP4(server, port, timeout=10)
-                    
-                self.connection.login(self.email_address, self.password)
-                self.server_address = server
-                if verbose:
-                    print(f"Successfully connected to {server}!")
-                return True
+                connection = self._open_connection(server, port, use_ssl)
+                connection.login(self.email_address, self.password)
+                self._refresh_capabilities(connection)
             except (imaplib.IMAP4.error, socket.gaierror, socket.timeout, ssl.SSLError) as e:
-                error_msg = str(e)
-                self.connection_attempts.append((server, error_msg))
+                self._discard_connection(connection)
+                self.connection_attempts.append((server, str(e)))
                 if verbose:
                     print(f"Failed to connect to {server}:{port}: {e}")
-                continue
+                return False
+            self.connection = connection
+            self.server_address = server
+            if verbose:
+                print(f"Successfully connected to {server}!")
+            return True
+
+        # Several candidates: dials are staggered (happy eyeballs). The next
+        # candidate is dialed once the current one failed or has not answered
+        # within CONNECT_STAGGER seconds, so an unreachable server costs one
+        # stagger instead of a full timeout. LOGIN still goes to them one at a
+        # time in priority order: the password is only sent to a server once
+        # every better candidate failed.
+        opening = []
+
+        def dial_next():
+            server = potential_servers[len(opening)]
+            if verbose:
+                print(f"Attempting to connect to {server}:{port} ({mode})...")
+            opening.append(_dial_pool().submit(self._open_connection, server, port, use_ssl))
+
+        try:
+            for index, server in enumerate(potential_servers):
+                if index == len(opening):
+                    dial_next()
+                future = opening[index]
+                while not future.done() and len(opening) < len(potential_servers):
+                    concurrent.futures.wait([future], timeout=CONNECT_STAGGER)
+                    if not future.done():
+                        dial_next()
+                try:
+                    connection = future.result()
+                    connection.login(self.email_address, self.password)
+                    self._refresh_capabilities(connection)
+                    self.connection = connection
+                    self.server_address = server
+                    if verbose:
+                        print(f"Successfully connected to {server}!")
+                    return True
+                except (imaplib.IMAP4.error, socket.gaierror, socket.timeout, ssl.SSLError) as e:
+                    error_msg = str(e)
+                    self.connection_attempts.append((server, error_msg))
+                    if verbose:
+                        print(f"Failed to connect to {server}:{port}: {e}")
+                    continue
+        finally:
+            # Close every connection but the logged-in one (including those
+            # whose LOGIN failed), now or once they finish connecting
+            for future in opening:
+                future.add_done_callback(self._close_unused)
         
         return False
 
+    @staticmethod
+    def _open_connection(server: str, port: int, use_ssl: bool):
+        if use_ssl:
+            return BufferedIMAP4_SSL(server, port, timeout=10)
+        return BufferedIMAP4(server, port, timeout=10)
+
+    @staticmethod
+    def _refresh_capabilities(connection):
+        """
+        imaplib reads CAPABILITY once, before LOGIN, but servers such as Dovecot
+        and Cyrus only advertise extensions like ESEARCH once authenticated.
+        Keeps the pre-login list if the command fails.
+        """
+        try:
+            typ, dat = connection.capability()
+        except (imaplib.IMAP4.error, OSError):
+            return
+        if typ == 'OK' and dat and isinstance(dat[-1], bytes):
+            connection.capabilities = tuple(dat[-1].upper().decode().split())
+
+    def _close_unused(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        connection = future.result()
+        if connection is not self.connection:
+            self._discard_connection(connection)
+
+    @staticmethod
+    def _discard_connection(connection):
+        """Drops a connection that was never logged in (or failed to)."""
+        if connection is None:
+            return
+        try:
+            connection.shutdown()
+        except Exception:
+            pass
+
     def list_folders(self) -> List[str]:
         """
         Lists all available folders on the server, excluding Spam/Junk.
@@ -754,35 +1143,33 @@ class AutoIMAPClient:
                 return []
             
             folders = []
-
-            # Regex to capture folder name. 
-            # Matches: ... "Delimiter" "Name"  OR  ... "Delimiter" Name
-            # We focus on the last part.
-            pattern = re.compile(r'\((?P<flags>[^)]*)\)\s+"(?P<delim>[^"]+)"\s+(?P<name>.+)')
             
             for line in data:
+                # Literal (tuple) responses and anything unexpected are skipped
+                if not isinstance(line, bytes):
+                    continue
+                match = _FOLDER_RE.search(line)
+                if match is None:
+                    continue
+                name = match.group('name')
+                # Remove surrounding quotes if present and unescape
+                if name.startswith(b'"') and name.endswith(b'"'):
+                    name = name[1:-1]
+                    name = name.replace(b'\\"', b'"').replace(b'\\\\', b'\\')
                 try:
-                    decoded_line = line.decode()
-                    match = pattern.search(decoded_line)
-                    if match:
-                        name = match.group('name')
-                        # Remove surrounding quotes if present and unescape
-                        if name.startswith('"') and name.endswith('"'):
-                            name = name[1:-1]
-                            name = name.replace('\\"', '"').replace('\\\\', '\\')
-                        
-                        # Filter Spam/Junk but allow Trash
-                        lower_name = name.lower()
-                        if ('spam' in lower_name or 'junk' in lower_name or 'bulk' in lower_name) and 'trash' not in lower_name:
-                            continue
-                        
-                        # Exclude [Gmail]/Todos os e-mails and All Mail to avoid duplication
-                        if 'todos os e-mails' in lower_name or 'all mail' in lower_name:
-                            continue
-                            
-                        folders.append(name)
-                except:
+                    name = name.decode()
+                except UnicodeDecodeError:
+                    continue
+                
+                # Filter Spam/Junk but allow Trash
+                if _SPAM_FOLDER_RE.search(name) and not _TRASH_FOLDER_RE.search(name):
                     continue
+                
+                # Exclude [Gmail]/Todos os e-mails and All Mail to avoid duplication
+                if _ALL_MAIL_FOLDER_RE.search(name):
+                    continue
+                    
+                folders.append(name)
             
             return folders
         except:
@@ -802,13 +1189,17 @@ class AutoIMAPClient:
                     target_folder = f'"{escaped}"'
             
             typ, _ = self.connection.select(target_folder, readonly=readonly)
+            self.current_folder = folder if typ == 'OK' else None
             return typ == 'OK'
         except Exception as e:
+            self.current_folder = None
             return False
 
-    def fetch_email_ids(self, folder: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[bytes]:
+    def fetch_email_ids(self, folder: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                        criteria: Optional[str] = None) -> List[bytes]:
         """
         Fetches email UIDs from a specific folder based on date filters.
+        criteria, from build_search_criteria(), replaces the dates when given.
         """
         if not self.connection:
             raise RuntimeError("Not connected to IMAP server.")
@@ -817,22 +1208,13 @@ class AutoIMAPClient:
             print(f"Failed to select folder: {folder} (Skipping)")
             return []
         
-        search_criteria = []
-        
-        if start_date:
-            # IMAP date format: DD-Mon-YYYY
-            fmt_date = start_date.strftime("%d-%b-%Y")
-            search_criteria.append(f'(SINCE "{fmt_date}")')
-        
-        if end_date:
-            fmt_date = end_date.strftime("%d-%b-%Y")
-            search_criteria.append(f'(BEFORE "{fmt_date}")')
-            
-        if not search_criteria:
-            search_criteria.append('ALL')
-            
-        criteria_str = ' '.join(search_criteria)
+        criteria_str = criteria or build_search_criteria(start_date, end_date)
         
+        if 'ESEARCH' in (getattr(self.connection, 'capabilities', None) or ()):
+            uids = self._esearch_uids(criteria_str)
+            if uids is not None:
+                return uids
+
         try:
             # Use UID search for consistency across connections
             typ, data = self.connection.uid('search', None, criteria_str)
@@ -843,6 +1225,29 @@ class AutoIMAPClient:
             print(f"IMAP search error in {folder}: {e}")
             return []
 
+    def _esearch_uids(self, criteria: str) -> Optional[List[bytes]]:
+        """
+        Runs UID SEARCH RETURN (ALL) (RFC 4731). The server answers with one
+        compact sequence set ("1:5000,5002") instead of every UID spelled out.
+        Returns None if the command failed or the server sent no ESEARCH
+        response, so the caller can fall back to SEARCH.
+        """
+        try:
+            # uid() only returns SEARCH responses; the ESEARCH one stays queued
+            # until response() collects (and clears) it
+            typ, _ = self.connection.uid('SEARCH', 'RETURN', '(ALL)', criteria)
+            _, data = self.connection.response('ESEARCH')
+        except imaplib.IMAP4.error:
+            return None
+        if typ != 'OK' or data == [None]:
+            return None
+        uids = []
+        for line in data:
+            match = _ESEARCH_ALL_RE.search(line) if isinstance(line, bytes) else None
+            if match:
+                uids.extend(parse_uid_set(match.group(1)))
+        return uids
+
     def fetch_message_id(self, email_uid: bytes) -> Optional[str]:
         """Fetches the Message-ID header for a specific email UID."""
         if not self.connection:
@@ -856,19 +1261,116 @@ class AutoIMAPClient:
             # Parse response to extract Message-ID
             for part in data:
                 if isinstance(part, tuple):
-                    header_content = part[1].decode(errors='ignore')
-                    # Extract value after "Message-ID:"
-        
-                    match = re.search(r'Message-ID:\s*(<[^>]+>|[^(\r\n)]+)', header_content, re.IGNORECASE)
-                    if match:
-                        return match.group(1).strip()
+                    msg_id = self._parse_message_id(part[1])
+                    if msg_id:
+                        return msg_id
             return None
         except Exception:
             return None
 
+    @staticmethod
+    def _parse_message_id(header_bytes: bytes) -> Optional[str]:
+        """Extracts the Message-ID value from raw header bytes."""
+        # Matched on the bytes: only the value is decoded, not the whole header
+        match = _MSGID_RE.search(header_bytes)
+        if match:
+            return match.group(1).strip().decode(errors='ignore')
+        return None
+
+    def uses_gmail_ids(self) -> bool:
+        """
+        True if the server supports the Gmail extensions. Duplicates are then
+        keyed on X-GM-MSGID, which the server keeps as metadata, instead of
+        the Message-ID header it has to read from each message.
+        """
+        return GMAIL_EXTENSION in (getattr(self.connection, 'capabilities', None) or ())
+
+    @staticmethod
+    def _gmail_key(gm_msgid: bytes) -> str:
+        """Dedup key for a Gmail message id; never equal to a Message-ID header."""
+        return 'X-GM-MSGID ' + gm_msgid.decode()
+
+    def fetch_message_ids_batch(self, email_ids: List[bytes]) -> Dict[bytes, Optional[str]]:
+        """
+        Fetches the dedup key of several emails with a single UID FETCH: the
+        Message-ID header, or the X-GM-MSGID on Gmail (see uses_gmail_ids).
+        Returns {uid: message_id}; UIDs the server did not return are absent.
+        """
+        return {uid: msg_id for uid, (msg_id, _) in self.fetch_message_ids_and_sizes_batch(email_ids).items()}
+
+    def fetch_message_ids_and_sizes_batch(self, email_ids: List[bytes]) -> Dict[bytes, Tuple[Optional[str], Optional[int]]]:
+        """
+        Like fetch_message_ids_batch, but also returns each message's RFC822.SIZE
+        from the same UID FETCH. Returns {uid: (message_id, size)}.
+        """
+        if not self.connection:
+            raise RuntimeError("Not connected.")
+        if not email_ids:
+            return {}
+
+        uid_set = format_uid_set(email_ids)
+        if self.uses_gmail_ids():
+            typ, data = self.connection.uid('fetch', uid_set, '(UID RFC822.SIZE X-GM-MSGID)')
+            if typ != 'OK':
+                return {}
+            results = {}
+            for part in data:
+                line = part[0] if isinstance(part, tuple) else part
+                if not isinstance(line, bytes):
+                    continue
+                uid, gm_msgid = _UID_RE.search(line), _GM_MSGID_RE.search(line)
+                if uid and gm_msgid:
+                    size = _SIZE_RE.search(line)
+                    results[uid.group(1)] = (self._gmail_key(gm_msgid.group(1)), int(size.group(1)) if size else None)
+            return results
+
+        typ, data = self.connection.uid('fetch', uid_set, '(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])')
+        if typ != 'OK':
+            return {}
+
+        return {uid: (self._parse_message_id(items['header']) if 'header' in items else None, items.get('size'))
+                for uid, items in _parse_fetch_literals(data).items()}
+
+    def fetch_id_and_content(self, email_uid: bytes) -> Tuple[Optional[str], Optional[bytes]]:
+        """
+        Fetches the Message-ID and the raw content of one email in a single
+        UID FETCH. Returns (message_id, content); either may be None.
+        """
+        return self.fetch_ids_and_contents_batch([email_uid]).get(email_uid, (None, None))
+
+    def fetch_ids_and_contents_batch(self, email_ids: List[bytes]) -> Dict[bytes, Tuple[Optional[str], Optional[bytes]]]:
+        """
+        Fetches the dedup key (as in fetch_message_ids_batch) and raw content of
+        several emails with one UID FETCH.
+        Returns {uid: (message_id, content)}; UIDs the server did not return are absent.
+        """
+        if not self.connection:
+            raise RuntimeError("Not connected.")
+        if not email_ids:
+            return {}
+
+        uid_set = format_uid_set(email_ids)
+        gmail = self.uses_gmail_ids()
+        key_item = 'X-GM-MSGID' if gmail else 'BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)]'
+        typ, data = self.connection.uid('fetch', uid_set, f'(UID {key_item} BODY.PEEK[])')
+        if typ != 'OK':
+            return {}
+
+        results = {}
+        for uid, items in _parse_fetch_literals(data).items():
+            if gmail:
+                gm_msgid = items.get('gm_msgid')
+                msg_id = self._gmail_key(gm_msgid) if gm_msgid else None
+            else:
+                header = items.get('header')
+                msg_id = self._parse_message_id(header) if header else None
+            results[uid] = (msg_id, items.get('body'))
+        return results
+
     def fetch_email_content(self, email_id: bytes) -> Optional[bytes]:
         """
         Fetches the raw content of a single email using UID.
+        Returns None on a failed FETCH; a dropped connection raises.
         """
         if not self.connection:
             raise RuntimeError("Not connected.")
@@ -884,10 +1386,31 @@ class AutoIMAPClient:
                 if isinstance(response_part, tuple):
                     return response_part[1]
             return None
-        except:
+        except (imaplib.IMAP4.abort, OSError):
+            raise  # Dropped connection: the caller may reconnect and retry
+        except Exception:
             return None
 
+    def fetch_email_contents_batch(self, email_ids: List[bytes]) -> Dict[bytes, bytes]:
+        """
+        Fetches the raw content of several emails with a single UID FETCH.
+        Returns {uid: content}; UIDs the server did not return are absent.
+        """
+        if not self.connection:
+            raise RuntimeError("Not connected.")
+        if not email_ids:
+            return {}
+
+        uid_set = format_uid_set(email_ids)
+        # BODY.PEEK[] is the same bytes as RFC822 but never sets \Seen
+        typ, data = self.connection.uid('fetch', uid_set, '(UID BODY.PEEK[])')
+        if typ != 'OK':
+            return {}
+
+        return {uid: items['body'] for uid, items in _parse_fetch_literals(data).items() if 'body' in items}
+
     def close(self):
+        self.current_folder = None
         if self.connection:
             try:
                 self.connection.close()
@@ -3,8 +3,68 @@ import sys
 import time
 import msvcrt
 import threading
+import queue
+import functools
 from tqdm import tqdm
 
+STD_INPUT_HANDLE = -10
+WAIT_OBJECT_0 = 0
+# Fallback poll interval when the console input handle cannot be waited on
+KEY_POLL_INTERVAL = 0.1
+
+
+@functools.lru_cache(maxsize=None)
+def _console_input():
+    """
+    Returns (kernel32, handle) for waiting on the Windows console input, or
+    None when there is no console to wait on (not Windows, or input redirected).
+    """
+    try:
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.WinDLL('kernel32')
+    except (ImportError, AttributeError, OSError, ValueError):
+        return None
+    kernel32.GetStdHandle.restype = wintypes.HANDLE
+    kernel32.GetStdHandle.argtypes = (wintypes.DWORD,)
+    kernel32.GetConsoleMode.argtypes = (wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD))
+    kernel32.WaitForSingleObject.restype = wintypes.DWORD
+    kernel32.WaitForSingleObject.argtypes = (wintypes.HANDLE, wintypes.DWORD)
+    kernel32.FlushConsoleInputBuffer.argtypes = (wintypes.HANDLE,)
+
+    handle = kernel32.GetStdHandle(wintypes.DWORD(STD_INPUT_HANDLE).value)
+    mode = wintypes.DWORD()
+    if not handle or not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+        return None
+    return kernel32, handle
+
+
+def wait_for_key(timeout: float) -> bool:
+    """
+    Blocks until a key press is waiting on the console or timeout seconds pass.
+    Returns True if a key can be read with msvcrt.getwche().
+    On a Windows console the thread sleeps in WaitForSingleObject on the input
+    handle, so it only wakes up for input; elsewhere it polls msvcrt.kbhit().
+    """
+    console = _console_input()
+    deadline = time.monotonic() + timeout
+    while True:
+        if msvcrt.kbhit():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if console is None:
+            time.sleep(min(KEY_POLL_INTERVAL, remaining))
+            continue
+        kernel32, handle = console
+        if kernel32.WaitForSingleObject(handle, int(remaining * 1000) + 1) != WAIT_OBJECT_0:
+            return msvcrt.kbhit()
+        if not msvcrt.kbhit():
+            # Woken by an event kbhit() ignores (key release, mouse, focus).
+            # It stays in the buffer and keeps the handle signalled, so drop it.
+            kernel32.FlushConsoleInputBuffer(handle)
+
 
 class DownloadSettings:
     """
@@ -149,7 +209,7 @@ class InteractiveMenu:
         sys.stdout.flush()
         chars = []
         while True:
-            if msvcrt.kbhit():
+            if wait_for_key(1.0):
                 char = msvcrt.getwche()
                 if char in ("\r", "\n"):
                     sys.stdout.write("\n")
@@ -162,5 +222,74 @@ class InteractiveMenu:
                         sys.stdout.flush()
                 else:
                     chars.append(char)
-            else:
-                time.sleep(0.05)
+
+
+class KeyReader:
+    """
+    Watches the console for key presses on a background thread.
+    Pressed keys are put on the `keys` queue and `wake_event` is set, so the
+    caller can sleep on the event instead of polling the keyboard itself.
+    Pause the reader while something else (e.g. the menu) reads the console.
+    """
+
+    def __init__(self, wake_event: threading.Event = None, interval: float = 0.5):
+        """
+        Args:
+            wake_event: Optional event set whenever a key is read.
+            interval: Longest wait for a key before checking for stop or pause.
+        """
+        self.keys = queue.Queue()
+        self._wake_event = wake_event
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._paused = False
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="KeyReader", daemon=True)
+
+    def start(self):
+        """Starts the reader thread. Returns self for chaining."""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the reader. Returns at once: the thread may still be waiting for a
+        key, but it will not read one, so the console is free for the caller.
+        """
+        self._stop_event.set()
+        # Once the lock is free no read is in progress, and later ones see the stop flag
+        with self._lock:
+            pass
+
+    def pause(self):
+        """Stops reading keys; returns once no read is in progress."""
+        with self._lock:
+            self._paused = True
+
+    def resume(self):
+        """Resumes reading keys after pause()."""
+        with self._lock:
+            self._paused = False
+
+    def get_key(self):
+        """Returns the next pressed key, or None if there is none."""
+        try:
+            return self.keys.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                paused = self._paused
+            if paused:
+                self._stop_event.wait(self._interval)
+                continue
+            # Sleeps until a key arrives instead of polling the keyboard
+            if not wait_for_key(self._interval):
+                continue
+            with self._lock:
+                if not self._paused and not self._stop_event.is_set() and msvcrt.kbhit():
+                    self.keys.put(msvcrt.getwche())
+                    if self._wake_event:
+                        self._wake_event.set()
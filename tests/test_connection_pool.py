@@ -0,0 +1,108 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from connection_pool import ImapConnectionPool
+
+
+def make_client(connected=True):
+    client = MagicMock()
+    client.connection = MagicMock() if connected else None
+    return client
+
+
+class TestImapConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ImapConnectionPool("test@example.com", "pass", "imap.test.com", maxsize=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    # --- Reuse ---
+
+    def test_reuses_released_connection(self):
+        client = make_client()
+        self.pool.release(client)
+
+        with patch('connection_pool.AutoIMAPClient') as MockClient:
+            with self.pool.acquire() as c:
+                self.assertIs(c, client)
+            MockClient.assert_not_called()
+
+        # Just released: handed out again without a NOOP round-trip
+        client.connection.noop.assert_not_called()
+
+    def test_checks_connection_idle_past_validate_after(self):
+        self.pool.validate_after = 0
+        client = make_client()
+        self.pool.release(client)
+
+        with self.pool.acquire() as c:
+            self.assertIs(c, client)
+
+        client.connection.noop.assert_called_once()
+
+    def test_creates_connection_when_empty(self):
+        with patch('connection_pool.AutoIMAPClient') as MockClient:
+            MockClient.return_value.connect.return_value = True
+            with self.pool.acquire() as c:
+                self.assertIs(c, MockClient.return_value)
+            MockClient.return_value.connect.assert_called_once_with(
+                server_hostname="imap.test.com", port=993, verbose=False, use_ssl=True)
+
+        # Released on exit and reused next time
+        with self.pool.acquire() as c:
+            self.assertIs(c, MockClient.return_value)
+
+    def test_acquire_yields_none_when_connect_fails(self):
+        with patch('connection_pool.AutoIMAPClient') as MockClient:
+            MockClient.return_value.connect.return_value = False
+            with self.pool.acquire() as c:
+                self.assertIsNone(c)
+
+    # --- Invalidation ---
+
+    def test_dead_connection_is_replaced(self):
+        self.pool.validate_after = 0
+        dead = make_client()
+        dead.connection.noop.side_effect = OSError("socket closed")
+        self.pool.release(dead)
+
+        with patch('connection_pool.AutoIMAPClient') as MockClient:
+            MockClient.return_value.connect.return_value = True
+            with self.pool.acquire() as c:
+                self.assertIs(c, MockClient.return_value)
+
+        dead.close.assert_called_once()
+        self.assertIsNone(dead.connection)
+
+    def test_release_beyond_maxsize_closes_connection(self):
+        clients = [make_client() for _ in range(3)]
+        for client in clients:
+            self.pool.release(client)
+        clients[2].close.assert_called_once()
+        clients[0].close.assert_not_called()
+
+    def test_reap_idle_closes_stale_connections(self):
+        client = make_client()
+        self.pool.release(client)
+        self.pool.idle_timeout = 0
+        self.pool.reap_idle()
+        client.close.assert_called_once()
+
+    def test_close_closes_idle_and_later_releases(self):
+        idle = make_client()
+        self.pool.release(idle)
+        self.pool.close()
+        idle.close.assert_called_once()
+
+        late = make_client()
+        self.pool.release(late)
+        late.close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
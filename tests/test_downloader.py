@@ -2,15 +2,16 @@ import unittest
 from unittest.mock import MagicMock, patch
 import sys
 import os
-import threading
+import imaplib
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import specific functions to test
 # Note: Testing the main loop is hard, so we focus on helper functions and worker tasks
-from email_downloader import download_email_task
+from email_downloader import download_email_task, download_email_batch_task, filter_duplicates, split_by_size, write_checksum_file
 import email_downloader
+from utils import ConcurrentSet
 
 class TestEmailDownloader(unittest.TestCase):
 
@@ -20,17 +21,18 @@ class TestEmailDownloader(unittest.TestCase):
         # causing it to skip AutoIMAPClient() creation and reuse a stale mock.
         if hasattr(email_downloader.thread_local, 'client'):
             del email_downloader.thread_local.client
+        # Folder paths are memoized per process; start each test uncached.
+        email_downloader.get_folder_path.cache_clear()
 
     @patch('email_downloader.AutoIMAPClient')
     @patch('email_downloader.ensure_directory')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
-    def test_download_email_task_success(self, mock_file, mock_ensure_dir, MockClient):
+    @patch('email_downloader.write_file')
+    def test_download_email_task_success(self, mock_write, mock_ensure_dir, MockClient):
         # Setup Mock Client
         client_instance = MockClient.return_value
         client_instance.connect.return_value = True
         client_instance.select_folder.return_value = True
-        client_instance.fetch_message_id.return_value = "msg-id-123"
-        client_instance.fetch_email_content.return_value = b"Email Content"
+        client_instance.fetch_id_and_content.return_value = ("msg-id-123", b"Email Content")
         
         # Setup args
         email = "test@example.com"
@@ -39,19 +41,16 @@ class TestEmailDownloader(unittest.TestCase):
         folder = "INBOX"
         email_id = b"1"
         output_dir = "/tmp/downloads"
-        seen_ids = set()
-        seen_lock = threading.Lock()
+        seen_ids = ConcurrentSet()
         
-        success, error = download_email_task(email, password, server, folder, email_id, output_dir, seen_ids, seen_lock)
+        success, error = download_email_task(email, password, server, folder, email_id, output_dir, seen_ids)
         
         self.assertTrue(success)
         self.assertIsNone(error)
         self.assertIn("msg-id-123", seen_ids)
         
         # Verify file write
-        mock_file.assert_called()
-        handle = mock_file()
-        handle.write.assert_called_with(b"Email Content")
+        mock_write.assert_called_once_with(os.fsencode(os.path.join(output_dir, "INBOX", "email_INBOX_1.eml")), b"Email Content")
 
     @patch('email_downloader.AutoIMAPClient')
     def test_download_email_task_connection_fail(self, MockClient):
@@ -64,21 +63,203 @@ class TestEmailDownloader(unittest.TestCase):
         self.assertEqual(error, "Connection failed")
 
     @patch('email_downloader.AutoIMAPClient')
-    def test_download_email_task_duplicate(self, MockClient):
+    @patch('email_downloader.write_file')
+    def test_download_email_task_duplicate(self, mock_write, MockClient):
         client_instance = MockClient.return_value
         client_instance.connect.return_value = True
         client_instance.select_folder.return_value = True
-        client_instance.fetch_message_id.return_value = "msg-id-123"
+        client_instance.fetch_id_and_content.return_value = ("msg-id-123", b"Email Content")
         
-        seen_ids = {"msg-id-123"}
-        seen_lock = threading.Lock()
+        seen_ids = ConcurrentSet()
+        seen_ids.add_if_absent("msg-id-123")
         
-        success, error = download_email_task("e", "p", "s", "f", b"1", "o", seen_ids, seen_lock)
+        success, error = download_email_task("e", "p", "s", "f", b"1", "o", seen_ids)
         
         self.assertTrue(success)
         self.assertEqual(error, "SKIPPED")
-        # Should not fetch content
-        client_instance.fetch_email_content.assert_not_called()
+        # Message-ID and content share one FETCH; the duplicate is not saved
+        client_instance.fetch_id_and_content.assert_called_once_with(b"1")
+        client_instance.fetch_message_id.assert_not_called()
+        mock_write.assert_not_called()
+
+    @patch('email_downloader.AutoIMAPClient')
+    @patch('email_downloader.write_file')
+    def test_download_email_task_retry_keeps_own_claim(self, mock_write, MockClient):
+        client_instance = MockClient.return_value
+        client_instance.connect.return_value = True
+        client_instance.select_folder.return_value = True
+        client_instance.fetch_id_and_content.return_value = ("msg-id-123", b"Email Content")
+        seen_ids = ConcurrentSet()
+
+        # Claimed by an earlier attempt at the same email: still saved
+        email_downloader.claim_message_id(seen_ids, "msg-id-123", "f", b"1")
+        self.assertEqual(download_email_task("e", "p", "s", "f", b"1", "o", seen_ids), (True, None))
+        # A copy of it in another folder is a duplicate
+        self.assertEqual(download_email_task("e", "p", "s", "All Mail", b"9", "o", seen_ids), (True, "SKIPPED"))
+        mock_write.assert_called_once()
+
+    @patch('email_downloader.AutoIMAPClient')
+    @patch('email_downloader.ensure_directory')
+    @patch('email_downloader.write_file')
+    def test_download_email_batch_task(self, mock_write, mock_ensure_dir, MockClient):
+        client_instance = MockClient.return_value
+        client_instance.connect.return_value = True
+        client_instance.select_folder.return_value = True
+        # UID 3 is missing from the server response
+        client_instance.fetch_ids_and_contents_batch.return_value = {
+            b"1": ("msg-1", b"One"),
+            b"2": ("msg-2", b"Two"),
+        }
+        
+        seen_ids = ConcurrentSet()
+        seen_ids.add_if_absent("msg-2")
+        
+        results = download_email_batch_task("e", "p", "s", "INBOX", [b"1", b"2", b"3"], "/tmp/downloads", seen_ids)
+        
+        self.assertEqual(sorted(results), [
+            (b"1", True, None),
+            (b"2", True, "SKIPPED"),
+            (b"3", False, "Empty content (UID: 3)"),
+        ])
+        # One FETCH for the whole batch; the duplicate is not saved
+        client_instance.fetch_ids_and_contents_batch.assert_called_once_with([b"1", b"2", b"3"])
+        client_instance.fetch_message_id.assert_not_called()
+        mock_write.assert_called_once_with(unittest.mock.ANY, b"One")
+
+    @patch('email_downloader.AutoIMAPClient')
+    @patch('email_downloader.ensure_directory')
+    @patch('email_downloader.write_file')
+    def test_download_email_batch_task_concurrent_set(self, mock_write, mock_ensure_dir, MockClient):
+        client_instance = MockClient.return_value
+        client_instance.connect.return_value = True
+        client_instance.select_folder.return_value = True
+        client_instance.fetch_ids_and_contents_batch.return_value = {
+            b"1": ("msg-1", b"One"),
+            b"2": ("msg-1", b"One again"),
+        }
+
+        seen_ids = ConcurrentSet()
+        results = download_email_batch_task("e", "p", "s", "INBOX", [b"1", b"2"], "/tmp/downloads", seen_ids)
+
+        self.assertEqual(sorted(results), [(b"1", True, None), (b"2", True, "SKIPPED")])
+        self.assertIn("msg-1", seen_ids)
+
+    @patch('email_downloader.AutoIMAPClient')
+    @patch('email_downloader.ensure_directory')
+    @patch('email_downloader.write_file')
+    def test_download_email_batch_task_reconnects_on_abort(self, mock_write, mock_ensure_dir, MockClient):
+        client_instance = MockClient.return_value
+        client_instance.connect.return_value = True
+        client_instance.select_folder.return_value = True
+        # The server drops the connection on the first FETCH
+        client_instance.fetch_email_contents_batch.side_effect = [
+            imaplib.IMAP4.abort("socket error: EOF"),
+            {b"1": b"One"},
+        ]
+
+        results = download_email_batch_task("e", "p", "s", "INBOX", [b"1"], "/tmp/downloads")
+
+        self.assertEqual(results, [(b"1", True, None)])
+        self.assertEqual(client_instance.fetch_email_contents_batch.call_count, 2)
+        self.assertEqual(client_instance.connect.call_count, 2)
+
+    @patch('email_downloader.AutoIMAPClient')
+    @patch('email_downloader.write_file')
+    def test_download_email_task_without_dedup_reconnects_on_abort(self, mock_write, MockClient):
+        client_instance = MockClient.return_value
+        client_instance.connect.return_value = True
+        client_instance.select_folder.return_value = True
+        client_instance.fetch_email_content.side_effect = [
+            imaplib.IMAP4.abort("socket error: EOF"),
+            b"Email Content",
+        ]
+
+        self.assertEqual(download_email_task("e", "p", "s", "INBOX", b"1", "o"), (True, None))
+        self.assertEqual(client_instance.fetch_email_content.call_count, 2)
+        self.assertEqual(client_instance.connect.call_count, 2)
+
+    @patch('email_downloader.AutoIMAPClient')
+    @patch('email_downloader.ensure_directory')
+    @patch('email_downloader.write_file')
+    def test_download_email_batch_task_borrows_from_pool(self, mock_write, mock_ensure_dir, MockClient):
+        pool = MagicMock()
+        client_instance = pool.checkout.return_value
+        client_instance.select_folder.return_value = True
+        client_instance.fetch_email_contents_batch.return_value = {b"1": b"One"}
+
+        results = download_email_batch_task("e", "p", "s", "INBOX", [b"1"], "/tmp/downloads", pool=pool)
+
+        self.assertEqual(results, [(b"1", True, None)])
+        MockClient.assert_not_called()
+        pool.release.assert_called_once_with(client_instance)
+
+    def test_download_email_batch_task_pool_connection_fail(self):
+        pool = MagicMock()
+        pool.checkout.return_value = None
+
+        results = download_email_batch_task("e", "p", "s", "INBOX", [b"1"], "o", pool=pool)
+
+        self.assertEqual(results, [(b"1", False, "Connection failed")])
+        pool.release.assert_not_called()
+
+    @patch('email_downloader.AutoIMAPClient')
+    def test_download_email_batch_task_connection_fail(self, MockClient):
+        MockClient.return_value.connect.return_value = False
+        
+        results = download_email_batch_task("e", "p", "s", "f", [b"1", b"2"], "o")
+        
+        self.assertEqual(results, [(b"1", False, "Connection failed"), (b"2", False, "Connection failed")])
+
+    @patch('email_downloader.AutoIMAPClient')
+    @patch('email_downloader.ensure_directory')
+    @patch('email_downloader.write_file')
+    def test_download_email_batch_task_skips_select_of_current_folder(self, mock_write, mock_ensure_dir, MockClient):
+        client_instance = MockClient.return_value
+        client_instance.connect.return_value = True
+        client_instance.current_folder = "INBOX"
+        client_instance.fetch_email_contents_batch.return_value = {b"1": b"One"}
+
+        results = download_email_batch_task("e", "p", "s", "INBOX", [b"1"], "/tmp/downloads")
+
+        self.assertEqual(results, [(b"1", True, None)])
+        client_instance.select_folder.assert_not_called()
+
+    def test_filter_duplicates(self):
+        client = MagicMock()
+        # UID 3 has no Message-ID, UID 4 is missing from the response
+        client.fetch_message_ids_and_sizes_batch.return_value = {
+            b"1": ("msg-1", 100), b"2": ("msg-2", 200), b"3": (None, None),
+        }
+        seen_ids = ConcurrentSet()
+        seen_ids.add_if_absent("msg-2")
+
+        new_ids, duplicate_ids, sizes = filter_duplicates(client, "INBOX", [b"1", b"2", b"3", b"4"], seen_ids)
+
+        self.assertEqual(new_ids, [b"1", b"3", b"4"])
+        self.assertEqual(duplicate_ids, [b"2"])
+        self.assertEqual(sizes, {b"1": 100, b"2": 200})
+        self.assertIn("msg-1", seen_ids)
+        client.fetch_message_ids_and_sizes_batch.assert_called_once_with([b"1", b"2", b"3", b"4"])
+
+    def test_split_by_size(self):
+        sizes = {b"1": 10, b"2": 10, b"3": 50, b"4": 5}
+        # UID 3 alone exceeds the limit, so it gets a batch of its own
+        self.assertEqual(split_by_size([b"1", b"2", b"3", b"4", b"5"], sizes, max_bytes=25),
+                         [[b"1", b"2"], [b"3"], [b"4", b"5"]])
+        self.assertEqual(split_by_size([], sizes), [])
+
+    def test_write_checksum_file(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "report.txt")
+            write_checksum_file(path, "a.zip", 123, {"sha1": "abc", "crc32": "0000002a"}, ["Mode: Zip Only"])
+            with open(path) as f:
+                lines = f.read().splitlines()
+
+        self.assertEqual(lines[1:4], ["File: a.zip", "Size: 123 bytes", "SHA1: abc"])
+        self.assertEqual(lines[4], "CRC32: 0000002a")
+        self.assertTrue(lines[5].startswith("Date: "))
+        self.assertEqual(lines[6:], ["Mode: Zip Only"])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,178 @@
+import unittest
+from unittest.mock import patch
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import zipfile
+from file_writer import FileWriter, ZipFileWriter
+from utils import calculate_hashes
+
+
+class TestFileWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    # --- Basic functionality ---
+
+    def test_writes_files_and_creates_directories(self):
+        path = os.path.join(self.test_dir, "INBOX", "email_INBOX_1.eml")
+        with FileWriter() as writer:
+            writer.submit(path, b"Email Content")
+        self.assertEqual(self._read(path), b"Email Content")
+        self.assertEqual(writer.written, 1)
+
+    def test_overwrites_existing_file(self):
+        path = os.path.join(self.test_dir, "email.eml")
+        with open(path, "wb") as f:
+            f.write(b"old content that is longer")
+        with FileWriter() as writer:
+            writer.submit(path, b"new")
+        self.assertEqual(self._read(path), b"new")
+
+    def test_close_flushes_queue(self):
+        writer = FileWriter(max_pending=2)
+        paths = [os.path.join(self.test_dir, f"email_{i}.eml") for i in range(20)]
+        for i, path in enumerate(paths):
+            writer.submit(path, str(i).encode())
+        writer.close()
+        for i, path in enumerate(paths):
+            self.assertEqual(self._read(path), str(i).encode())
+
+    def test_submit_after_close_writes_synchronously(self):
+        writer = FileWriter()
+        writer.close()
+        path = os.path.join(self.test_dir, "late.eml")
+        writer.submit(path, b"late")
+        self.assertEqual(self._read(path), b"late")
+
+    def test_close_is_idempotent(self):
+        writer = FileWriter()
+        writer.close()
+        writer.close()
+
+    # --- Error handling ---
+
+    def test_on_error_called_with_tag(self):
+        errors = []
+        # A regular file where a directory is expected makes the write fail
+        blocker = os.path.join(self.test_dir, "blocker")
+        with open(blocker, "wb") as f:
+            f.write(b"x")
+        path = os.path.join(blocker, "email.eml")
+
+        with FileWriter(on_error=lambda p, tag, msg: errors.append((p, tag))) as writer:
+            writer.submit(path, b"data", tag=("INBOX", b"1"))
+
+        self.assertEqual(errors, [(path, ("INBOX", b"1"))])
+        self.assertEqual(writer.written, 0)
+
+    # --- Thread safety ---
+
+    def test_concurrent_producers(self):
+        writer = FileWriter(max_pending=4)
+
+        def produce(n):
+            for i in range(25):
+                writer.submit(os.path.join(self.test_dir, f"t{n}", f"{i}.eml"), b"x")
+
+        threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        writer.close()
+        self.assertEqual(writer.written, 100)
+
+
+
+class _FailingFile:
+    """Accepts limit bytes, then writes what still fits and fails like a full disk."""
+
+    def __init__(self, path, limit):
+        self._fp = open(path, 'wb')
+        self._left = limit
+
+    def write(self, data):
+        if len(data) > self._left:
+            self._fp.write(bytes(data[:self._left]))
+            self._left = 0
+            raise OSError(errno.ENOSPC, "No space left on device")
+        self._left -= len(data)
+        return self._fp.write(data)
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+class TestZipFileWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.test_dir, "emails")
+        self.zip_path = os.path.join(self.test_dir, "emails.zip")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_writes_members_relative_to_root(self):
+        writer = ZipFileWriter(self.zip_path, self.root, zipfile.ZIP_DEFLATED, 6, hash_algorithms=("sha1", "crc32"))
+        writer.submit(os.fsencode(os.path.join(self.root, "INBOX", "email_INBOX_1.eml")), b"one")
+        writer.submit(os.path.join(self.root, "Sent", "email_Sent_2.eml"), b"two")
+        size, hashes = writer.finish()
+
+        self.assertFalse(os.path.exists(self.root))
+        self.assertEqual(hashes, calculate_hashes(self.zip_path, ("sha1", "crc32")))
+        self.assertEqual(size, os.path.getsize(self.zip_path))
+        with zipfile.ZipFile(self.zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("INBOX/email_INBOX_1.eml"), b"one")
+            self.assertEqual(zf.read("Sent/email_Sent_2.eml"), b"two")
+        self.assertEqual(writer.written, 2)
+
+    def test_submit_after_close_appends_until_finish(self):
+        errors = []
+        writer = ZipFileWriter(self.zip_path, self.root, on_error=lambda p, tag, msg: errors.append(tag))
+        writer.close()
+        writer.submit(os.path.join(self.root, "late.eml"), b"late", tag="late")
+        self.assertIsNone(writer.finish())
+        writer.submit(os.path.join(self.root, "too_late.eml"), b"x", tag="too late")
+
+        self.assertEqual(errors, ["too late"])
+        with zipfile.ZipFile(self.zip_path) as zf:
+            self.assertEqual(zf.namelist(), ["late.eml"])
+
+    def test_partial_write_breaks_archive(self):
+        errors = []
+        # Room for the first member and part of the second one's content
+        limit = 30 + len("f0.eml") + 1000 + 30 + len("f1.eml") + 100
+        with patch('file_writer.open', create=True, side_effect=lambda path, mode: _FailingFile(path, limit)):
+            writer = ZipFileWriter(self.zip_path, self.root, hash_algorithms=("crc32",),
+                                   on_error=lambda p, tag, msg: errors.append(tag))
+        for i in range(3):
+            writer.submit(os.path.join(self.root, f"f{i}.eml"), b"x" * 1000, tag=i)
+
+        with self.assertRaises(OSError):
+            writer.finish()
+        self.assertEqual(errors, [1, 2])
+        self.assertEqual(writer.written, 1)
+        self.assertFalse(os.path.exists(self.zip_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
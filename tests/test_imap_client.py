@@ -2,11 +2,17 @@ import unittest
 from unittest.mock import MagicMock, patch, mock_open
 import sys
 import os
+import json
+import shutil
+import tempfile
+import time
 
 # Add parent directory to path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from imap_client import AutoIMAPClient
+import imap_client
+from imap_client import AutoIMAPClient, build_search_criteria, format_uid_set, parse_uid_set
+from datetime import datetime
 
 class TestAutoIMAPClient(unittest.TestCase):
 
@@ -14,6 +20,14 @@ class TestAutoIMAPClient(unittest.TestCase):
         self.email = "test@example.com"
         self.password = "password"
         self.client = AutoIMAPClient(self.email, self.password)
+        # Keep autoconfig results out of the user's cache and between tests
+        self.cache_dir = tempfile.mkdtemp()
+        cache_patch = patch.object(imap_client, 'AUTOCONFIG_CACHE_FILE', os.path.join(self.cache_dir, 'autoconfig.json'))
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        imap_client._autoconfig_memo.clear()
+        self.addCleanup(imap_client._autoconfig_memo.clear)
 
     def test_guess_server(self):
         # Test standard guessing
@@ -52,9 +66,72 @@ class TestAutoIMAPClient(unittest.TestCase):
         config = self.client._lookup_thunderbird_config()
         self.assertEqual(config, "imap.config.example.com")
 
-    @patch('imaplib.IMAP4_SSL')
+    def test_autoconfig_lookup_is_cached(self):
+        lookup = MagicMock(return_value="imap.config.example.com")
+        self.assertEqual(imap_client.cached_autoconfig("thunderbird:example.com", lookup), "imap.config.example.com")
+        self.assertEqual(imap_client.cached_autoconfig("thunderbird:example.com", lookup), "imap.config.example.com")
+        lookup.assert_called_once()
+
+        # A new process reads it from the file
+        imap_client._autoconfig_memo.clear()
+        self.assertEqual(imap_client.cached_autoconfig("thunderbird:example.com", lookup), "imap.config.example.com")
+        lookup.assert_called_once()
+
+    def test_autoconfig_expired_entry_is_refetched(self):
+        with open(imap_client.AUTOCONFIG_CACHE_FILE, 'w') as f:
+            json.dump({"thunderbird:example.com": {"hostname": "old.example.com",
+                                                   "fetched_at": time.time() - imap_client.AUTOCONFIG_CACHE_TTL - 1}}, f)
+        lookup = MagicMock(return_value="new.example.com")
+
+        self.assertEqual(imap_client.cached_autoconfig("thunderbird:example.com", lookup), "new.example.com")
+        with open(imap_client.AUTOCONFIG_CACHE_FILE) as f:
+            self.assertEqual(json.load(f)["thunderbird:example.com"]["hostname"], "new.example.com")
+
+    def test_autoconfig_unavailable_is_not_stored(self):
+        lookup = MagicMock(return_value=imap_client.AUTOCONFIG_UNAVAILABLE)
+        self.assertIsNone(imap_client.cached_autoconfig("thunderbird:example.com", lookup))
+        self.assertFalse(os.path.exists(imap_client.AUTOCONFIG_CACHE_FILE))
+
+        # The next run asks again
+        imap_client._autoconfig_memo.clear()
+        lookup.return_value = "imap.config.example.com"
+        self.assertEqual(imap_client.cached_autoconfig("thunderbird:example.com", lookup), "imap.config.example.com")
+
+    @patch('urllib.request.urlopen')
+    def test_thunderbird_config_tells_misses_from_failures(self, mock_urlopen):
+        import socket
+        import urllib.error
+        mock_urlopen.side_effect = urllib.error.HTTPError("url", 404, "Not Found", {}, None)
+        self.assertIsNone(self.client._fetch_thunderbird_config())
+
+        mock_urlopen.side_effect = urllib.error.URLError(socket.timeout("timed out"))
+        self.assertIs(self.client._fetch_thunderbird_config(), imap_client.AUTOCONFIG_UNAVAILABLE)
+
+        mock_urlopen.side_effect = urllib.error.HTTPError("url", 503, "Unavailable", {}, None)
+        self.assertIs(self.client._fetch_thunderbird_config(), imap_client.AUTOCONFIG_UNAVAILABLE)
+
+    @patch('imap_client.socket.getaddrinfo')
+    def test_getaddrinfo_is_cached(self, mock_getaddrinfo):
+        mock_getaddrinfo.return_value = [('family', 'type', 'proto', '', ('203.0.113.5', 993))]
+        self.addCleanup(imap_client._dns_cache.clear)
+
+        first = imap_client.cached_getaddrinfo("imap.cached.example", 993)
+        second = imap_client.cached_getaddrinfo("imap.cached.example", 993)
+
+        self.assertEqual(first, second)
+        mock_getaddrinfo.assert_called_once()
+
+        # Expired entries are resolved again
+        with patch.object(imap_client, 'DNS_CACHE_TTL', -1):
+            imap_client._dns_cache.clear()
+            imap_client.cached_getaddrinfo("imap.cached.example", 993)
+            imap_client.cached_getaddrinfo("imap.cached.example", 993)
+        self.assertEqual(mock_getaddrinfo.call_count, 3)
+
+    @patch('imap_client.BufferedIMAP4_SSL')
     def test_connect_success(self, mock_imap):
         mock_conn = MagicMock()
+        mock_conn.capability.return_value = ('OK', [b'IMAP4rev1'])
         mock_imap.return_value = mock_conn
         
         # Test connecting to specific server
@@ -64,13 +141,73 @@ class TestAutoIMAPClient(unittest.TestCase):
         mock_conn.login.assert_called_with(self.email, self.password)
         self.assertEqual(self.client.server_address, "imap.test.com")
 
-    @patch('imaplib.IMAP4_SSL')
+    @patch('imap_client.BufferedIMAP4_SSL')
     def test_connect_failure(self, mock_imap):
         import imaplib
         mock_imap.side_effect = imaplib.IMAP4.error("Connection failed")
         result = self.client.connect("imap.test.com", verbose=False)
         self.assertFalse(result)
 
+    @patch('imap_client.BufferedIMAP4_SSL')
+    def test_connect_logs_in_to_candidates_in_order(self, mock_imap):
+        import imaplib
+        conns = {name: MagicMock(name=name) for name in ("imap.example.com", "mail.example.com", "other.example.com")}
+        for conn in conns.values():
+            conn.capability.return_value = ('OK', [b'IMAP4rev1'])
+        mock_imap.side_effect = lambda server, port, timeout: conns[server]
+        conns["imap.example.com"].login.side_effect = imaplib.IMAP4.error("AUTHENTICATIONFAILED")
+
+        with patch.object(self.client, '_guess_server', return_value=list(conns)):
+            self.assertTrue(self.client.connect(verbose=False))
+
+        self.assertIs(self.client.connection, conns["mail.example.com"])
+        self.assertEqual(self.client.server_address, "mail.example.com")
+        # Dials answered at once, so the candidate after the winner was never dialed
+        self.assertEqual(mock_imap.call_count, 2)
+        conns["other.example.com"].login.assert_not_called()
+        conns["imap.example.com"].shutdown.assert_called_once()
+        conns["mail.example.com"].shutdown.assert_not_called()
+        self.assertEqual(self.client.connection_attempts, [("imap.example.com", "AUTHENTICATIONFAILED")])
+
+    @patch('imap_client.BufferedIMAP4_SSL')
+    def test_connect_dials_next_candidate_when_one_stalls(self, mock_imap):
+        import imaplib
+        import threading
+        release = threading.Event()
+        conns = {name: MagicMock(name=name) for name in ("slow.example.com", "fast.example.com")}
+        for conn in conns.values():
+            conn.capability.return_value = ('OK', [b'IMAP4rev1'])
+        conns["slow.example.com"].login.side_effect = imaplib.IMAP4.error("AUTHENTICATIONFAILED")
+        dialed_while_stalled = []
+
+        def open_conn(server, port, timeout):
+            if server == "slow.example.com":
+                release.wait(5)
+            else:
+                dialed_while_stalled.append(not release.is_set())
+                release.set()
+            return conns[server]
+        mock_imap.side_effect = open_conn
+
+        with patch.object(imap_client, 'CONNECT_STAGGER', 0.01), \
+                patch.object(self.client, '_guess_server', return_value=list(conns)):
+            self.assertTrue(self.client.connect(verbose=False))
+
+        self.assertEqual(dialed_while_stalled, [True])
+        self.assertIs(self.client.connection, conns["fast.example.com"])
+        conns["slow.example.com"].shutdown.assert_called_once()
+
+    @patch('imap_client.BufferedIMAP4_SSL')
+    def test_connect_single_server_closes_connection_on_failed_login(self, mock_imap):
+        import imaplib
+        mock_conn = MagicMock()
+        mock_conn.login.side_effect = imaplib.IMAP4.error("AUTHENTICATIONFAILED")
+        mock_imap.return_value = mock_conn
+        self.assertFalse(self.client.connect("imap.test.com", verbose=False))
+        mock_conn.shutdown.assert_called_once()
+        self.assertIsNone(self.client.connection)
+        self.assertEqual(self.client.connection_attempts, [("imap.test.com", "AUTHENTICATIONFAILED")])
+
     def test_list_folders_parsing(self):
         self.client.connection = MagicMock()
         # Mock response for list()
@@ -79,6 +216,7 @@ class TestAutoIMAPClient(unittest.TestCase):
             b'(\\HasNoChildren) "/" "INBOX"',
             b'(\\HasChildren) "/" "Sent"',
             b'(\\HasNoChildren) "/" "Trash"',
+            b'(\\HasNoChildren) "/" "Trash/Junk"', # Kept: trash wins over junk
             b'(\\HasNoChildren) "/" "[Gmail]/Spam"', # Should be ignored
             b'(\\HasNoChildren) "/" "[Gmail]/Todos os e-mails"', # Should be ignored
             b'(\\HasNoChildren) "/" "[Gmail]/All Mail"' # Should be ignored
@@ -88,12 +226,26 @@ class TestAutoIMAPClient(unittest.TestCase):
         self.assertIn("INBOX", folders)
         self.assertIn("Sent", folders)
         self.assertIn("Trash", folders)
+        self.assertIn("Trash/Junk", folders)
         # Spam should be filtered out by default logic if it contains 'spam'
         # The logic is: if ('spam' in lower_name or 'junk' in lower_name or 'bulk' in lower_name) and 'trash' not in lower_name: continue
         self.assertNotIn("[Gmail]/Spam", folders)
         self.assertNotIn("[Gmail]/Todos os e-mails", folders)
         self.assertNotIn("[Gmail]/All Mail", folders)
 
+    def test_list_folders_quoting_and_literals(self):
+        self.client.connection = MagicMock()
+        self.client.connection.list.return_value = ('OK', [
+            b'(\\HasNoChildren) "." INBOX',
+            b'(\\HasNoChildren) "/" "Say \\"hi\\""',
+            # Folder name sent as a literal; not parsed, but must not break the rest
+            (b'(\\HasNoChildren) "/" {5}', b'Notes'),
+            b'(\\HasNoChildren) "/" "Archive"',
+        ])
+
+        folders = self.client.list_folders()
+        self.assertEqual(folders, ["INBOX", 'Say "hi"', "Archive"])
+
     def test_select_folder(self):
         self.client.connection = MagicMock()
         self.client.connection.select.return_value = ('OK', [b'1'])
@@ -105,6 +257,183 @@ class TestAutoIMAPClient(unittest.TestCase):
         # Test folder with spaces
         self.assertTrue(self.client.select_folder("Sent Items"))
         self.client.connection.select.assert_called_with('"Sent Items"', readonly=True)
+        self.assertEqual(self.client.current_folder, "Sent Items")
+
+        # A failed select leaves no folder selected
+        self.client.connection.select.return_value = ('NO', [b'Unknown folder'])
+        self.assertFalse(self.client.select_folder("Missing"))
+        self.assertIsNone(self.client.current_folder)
+
+    def test_fetch_email_content_raises_on_dropped_connection(self):
+        import imaplib
+        self.client.connection = MagicMock()
+        self.client.connection.uid.side_effect = imaplib.IMAP4.abort("socket error: EOF")
+        with self.assertRaises(imaplib.IMAP4.abort):
+            self.client.fetch_email_content(b'1')
+        self.client.connection.uid.side_effect = imaplib.IMAP4.error("BAD")
+        self.assertIsNone(self.client.fetch_email_content(b'1'))
+
+    def test_fetch_email_contents_batch(self):
+        self.client.connection = MagicMock()
+        # UID may come before the literal or, on some servers, after it
+        self.client.connection.uid.return_value = ('OK', [
+            (b'1 (UID 10 BODY[] {5}', b'first'),
+            b')',
+            (b'2 (BODY[] {6}', b'second'),
+            b' UID 11)',
+        ])
+        
+        contents = self.client.fetch_email_contents_batch([b'10', b'11', b'12'])
+        
+        self.client.connection.uid.assert_called_with('fetch', '10:12', '(UID BODY.PEEK[])')
+        self.assertEqual(contents, {b'10': b'first', b'11': b'second'})
+        self.assertEqual(self.client.fetch_email_contents_batch([]), {})
+
+    def test_fetch_ids_and_contents_batch(self):
+        self.client.connection = MagicMock()
+        self.client.connection.uid.return_value = ('OK', [
+            (b'1 (UID 10 BODY[HEADER.FIELDS (MESSAGE-ID)] {24}', b'Message-ID: <a@b>\r\n\r\n'),
+            (b' BODY[] {5}', b'first'),
+            b')',
+            # Server may order the items differently
+            (b'2 (UID 11 BODY[] {6}', b'second'),
+            (b' BODY[HEADER.FIELDS ("MESSAGE-ID")] {2}', b'\r\n'),
+            b')',
+        ])
+        
+        results = self.client.fetch_ids_and_contents_batch([b'10', b'11'])
+        
+        self.client.connection.uid.assert_called_with('fetch', '10:11', '(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)] BODY.PEEK[])')
+        self.assertEqual(results, {b'10': ('<a@b>', b'first'), b'11': (None, b'second')})
+
+    def test_fetch_message_ids_batch(self):
+        self.client.connection = MagicMock()
+        self.client.connection.uid.return_value = ('OK', [
+            (b'1 (UID 10 RFC822.SIZE 512 BODY[HEADER.FIELDS (MESSAGE-ID)] {24}', b'Message-ID: <a@b>\r\n\r\n'),
+            b')',
+            (b'2 (BODY[HEADER.FIELDS (MESSAGE-ID)] {2}', b'\r\n'),
+            b' UID 11 RFC822.SIZE 2048)',
+        ])
+
+        results = self.client.fetch_message_ids_and_sizes_batch([b'10', b'11'])
+
+        self.client.connection.uid.assert_called_with('fetch', '10:11', '(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])')
+        self.assertEqual(results, {b'10': ('<a@b>', 512), b'11': (None, 2048)})
+        self.assertEqual(self.client.fetch_message_ids_batch([b'10', b'11']), {b'10': '<a@b>', b'11': None})
+
+    def test_fetch_message_ids_batch_gmail(self):
+        self.client.connection = MagicMock()
+        self.client.connection.capabilities = ('IMAP4REV1', 'X-GM-EXT-1')
+        self.client.connection.uid.return_value = ('OK', [
+            b'1 (X-GM-MSGID 1278455344230334865 UID 10 RFC822.SIZE 300)',
+            b'2 (UID 11 RFC822.SIZE 400 X-GM-MSGID 1278455344230334866)',
+        ])
+
+        results = self.client.fetch_message_ids_and_sizes_batch([b'10', b'11'])
+
+        self.client.connection.uid.assert_called_with('fetch', '10:11', '(UID RFC822.SIZE X-GM-MSGID)')
+        self.assertEqual(results, {b'10': ('X-GM-MSGID 1278455344230334865', 300),
+                                   b'11': ('X-GM-MSGID 1278455344230334866', 400)})
+
+    def test_fetch_ids_and_contents_batch_gmail(self):
+        self.client.connection = MagicMock()
+        self.client.connection.capabilities = ('IMAP4REV1', 'X-GM-EXT-1')
+        self.client.connection.uid.return_value = ('OK', [
+            (b'1 (X-GM-MSGID 42 UID 10 BODY[] {5}', b'first'),
+            b')',
+        ])
+
+        results = self.client.fetch_ids_and_contents_batch([b'10'])
+
+        self.client.connection.uid.assert_called_with('fetch', '10', '(UID X-GM-MSGID BODY.PEEK[])')
+        # Same key as the header-only prefetch, so both dedup paths agree
+        self.assertEqual(results, {b'10': ('X-GM-MSGID 42', b'first')})
+
+    def test_parse_message_id(self):
+        parse = AutoIMAPClient._parse_message_id
+        self.assertEqual(parse(b'Message-ID: <a@b>\r\n\r\n'), '<a@b>')
+        self.assertEqual(parse(b'message-id:\r\n <folded@b>\r\n'), '<folded@b>')
+        # Unbracketed values run to the end of the line, parentheses included
+        self.assertEqual(parse(b'Message-ID: a(1)@b \r\n'), 'a(1)@b')
+        self.assertIsNone(parse(b'Subject: x\r\n'))
+
+    def test_build_search_criteria(self):
+        self.assertEqual(build_search_criteria(), 'ALL')
+        self.assertEqual(build_search_criteria(datetime(2024, 3, 5)), 'SINCE "05-Mar-2024"')
+        self.assertEqual(build_search_criteria(end_date=datetime(2024, 12, 31)), 'BEFORE "31-Dec-2024"')
+        self.assertEqual(build_search_criteria(datetime(2024, 1, 1), datetime(2024, 2, 1)),
+                         'SINCE "01-Jan-2024" BEFORE "01-Feb-2024"')
+
+    def test_format_uid_set(self):
+        self.assertEqual(format_uid_set([b'1', b'2', b'3', b'7', b'9', b'10']), '1:3,7,9:10')
+        self.assertEqual(format_uid_set([b'5']), '5')
+        # Unordered UIDs are kept as given rather than merged
+        self.assertEqual(format_uid_set([b'3', b'2', b'1']), '3,2,1')
+        self.assertEqual(format_uid_set([]), '')
+
+    def test_fetch_email_ids_uses_given_criteria(self):
+        self.client.connection = MagicMock()
+        self.client.connection.select.return_value = ('OK', [b'2'])
+        self.client.connection.uid.return_value = ('OK', [b'1 2'])
+
+        ids = self.client.fetch_email_ids("INBOX", criteria='SINCE "01-Jan-2024"')
+
+        self.assertEqual(ids, [b'1', b'2'])
+        self.client.connection.uid.assert_called_once_with('search', None, 'SINCE "01-Jan-2024"')
+
+    def test_fetch_email_ids_uses_esearch(self):
+        self.client.connection = MagicMock()
+        self.client.connection.capabilities = ('IMAP4REV1', 'ESEARCH')
+        self.client.connection.select.return_value = ('OK', [b'6'])
+        self.client.connection.uid.return_value = ('OK', [None])
+        self.client.connection.response.return_value = ('ESEARCH', [b'(TAG "A5") UID ALL 3:5,9'])
+
+        ids = self.client.fetch_email_ids("INBOX", criteria='ALL')
+
+        self.assertEqual(ids, [b'3', b'4', b'5', b'9'])
+        self.client.connection.uid.assert_called_once_with('SEARCH', 'RETURN', '(ALL)', 'ALL')
+        self.client.connection.response.assert_called_once_with('ESEARCH')
+
+    @patch('imap_client.BufferedIMAP4_SSL')
+    def test_esearch_advertised_only_after_login(self, mock_imap):
+        conn = MagicMock()
+        conn.capabilities = ('IMAP4REV1', 'AUTH=PLAIN')
+        conn.capability.return_value = ('OK', [b'IMAP4rev1 ESEARCH X-GM-EXT-1'])
+        conn.select.return_value = ('OK', [b'6'])
+        conn.uid.return_value = ('OK', [None])
+        conn.response.return_value = ('ESEARCH', [b'(TAG "A5") UID ALL 3:4'])
+        mock_imap.return_value = conn
+
+        self.assertTrue(self.client.connect("imap.test.com", verbose=False))
+
+        self.assertEqual(conn.capabilities, ('IMAP4REV1', 'ESEARCH', 'X-GM-EXT-1'))
+        self.assertEqual(self.client.fetch_email_ids("INBOX", criteria='ALL'), [b'3', b'4'])
+        conn.uid.assert_called_once_with('SEARCH', 'RETURN', '(ALL)', 'ALL')
+
+    def test_fetch_email_ids_esearch_falls_back_to_search(self):
+        import imaplib
+        self.client.connection = MagicMock()
+        self.client.connection.capabilities = ('IMAP4REV1', 'ESEARCH')
+        self.client.connection.select.return_value = ('OK', [b'2'])
+        self.client.connection.uid.side_effect = [imaplib.IMAP4.error("BAD"), ('OK', [b'1 2'])]
+
+        self.assertEqual(self.client.fetch_email_ids("INBOX", criteria='ALL'), [b'1', b'2'])
+        self.client.connection.uid.assert_called_with('search', None, 'ALL')
+
+    def test_fetch_email_ids_without_esearch_response_falls_back_to_search(self):
+        self.client.connection = MagicMock()
+        self.client.connection.capabilities = ('IMAP4REV1', 'ESEARCH')
+        self.client.connection.select.return_value = ('OK', [b'2'])
+        self.client.connection.uid.side_effect = [('OK', [b'1 2']), ('OK', [b'1 2'])]
+        self.client.connection.response.return_value = ('ESEARCH', [None])
+
+        self.assertEqual(self.client.fetch_email_ids("INBOX", criteria='ALL'), [b'1', b'2'])
+        self.assertEqual(self.client.connection.uid.call_count, 2)
+
+    def test_parse_uid_set(self):
+        self.assertEqual(parse_uid_set(b'1:3,7,10:9'), [b'1', b'2', b'3', b'7', b'9', b'10'])
+        self.assertEqual(parse_uid_set(b''), [])
+        self.assertEqual(parse_uid_set(format_uid_set([b'4', b'5', b'8']).encode()), [b'4', b'5', b'8'])
 
 if __name__ == '__main__':
     unittest.main()
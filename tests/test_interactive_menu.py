@@ -5,7 +5,7 @@ import sys
 import threading
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from interactive_menu import DownloadSettings, InteractiveMenu
+from interactive_menu import DownloadSettings, InteractiveMenu, KeyReader, wait_for_key
 from error_logger import ErrorLogger
 import tempfile
 import shutil
@@ -196,5 +196,64 @@ class TestInteractiveMenu(unittest.TestCase):
         self.assertIn("Close menu", InteractiveMenu.MENU_TEXT)
 
 
+
+class TestKeyReader(unittest.TestCase):
+
+    def _fake_console(self, keys):
+        fake = MagicMock()
+        pending = list(keys)
+        fake.kbhit.side_effect = lambda: bool(pending)
+        fake.getwche.side_effect = lambda: pending.pop(0)
+        return fake
+
+    def test_reads_keys_and_sets_wake_event(self):
+        wake = threading.Event()
+        with patch('interactive_menu.msvcrt', self._fake_console(['m', '\r'])):
+            reader = KeyReader(wake, interval=0.01).start()
+            self.assertTrue(wake.wait(2))
+            reader.stop()
+        self.assertEqual(reader.get_key(), 'm')
+        self.assertEqual(reader.get_key(), '\r')
+        self.assertIsNone(reader.get_key())
+
+    def test_paused_reader_leaves_console_alone(self):
+        fake = self._fake_console(['1'])
+        with patch('interactive_menu.msvcrt', fake):
+            reader = KeyReader(interval=0.01)
+            reader.pause()
+            reader.start()
+            reader._stop_event.wait(0.1)
+            reader.stop()
+        fake.getwche.assert_not_called()
+        self.assertIsNone(reader.get_key())
+
+
+class TestWaitForKey(unittest.TestCase):
+
+    def test_returns_true_when_key_waiting(self):
+        fake = MagicMock()
+        fake.kbhit.return_value = True
+        with patch('interactive_menu.msvcrt', fake):
+            self.assertTrue(wait_for_key(5))
+
+    def test_times_out_without_key(self):
+        fake = MagicMock()
+        fake.kbhit.return_value = False
+        with patch('interactive_menu.msvcrt', fake), \
+                patch('interactive_menu._console_input', return_value=None):
+            self.assertFalse(wait_for_key(0.05))
+
+    def test_console_wait_drops_non_key_events(self):
+        fake = MagicMock()
+        # Signalled by a key release first, then by a key press
+        fake.kbhit.side_effect = [False, False, False, True, True]
+        kernel32 = MagicMock()
+        kernel32.WaitForSingleObject.return_value = 0
+        with patch('interactive_menu.msvcrt', fake), \
+                patch('interactive_menu._console_input', return_value=(kernel32, 1)):
+            self.assertTrue(wait_for_key(5))
+        kernel32.FlushConsoleInputBuffer.assert_called_once_with(1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -16,16 +16,17 @@ class TestTimedInput(unittest.TestCase):
 
         Args:
             time_values: sequence of floats returned by time.time()
-            kbhit_values: sequence of booleans returned by msvcrt.kbhit()
+            kbhit_values: sequence of booleans returned by wait_for_key()
             getwche_values: sequence of chars returned by msvcrt.getwche()
         """
         with patch('email_downloader.msvcrt') as mock_msvcrt, \
+             patch('email_downloader.wait_for_key') as mock_wait, \
              patch('email_downloader.time') as mock_time, \
              patch('email_downloader.sys') as mock_sys:
 
             mock_time.time = MagicMock(side_effect=time_values)
             mock_time.sleep = MagicMock()
-            mock_msvcrt.kbhit = MagicMock(side_effect=kbhit_values)
+            mock_wait.side_effect = kbhit_values
             mock_msvcrt.getwche = MagicMock(side_effect=getwche_values)
             mock_sys.stdout = MagicMock()
 
@@ -93,13 +94,14 @@ class TestTimedInput(unittest.TestCase):
     def test_countdown_updates_display(self):
         """Verify that the countdown display is updated as time passes."""
         with patch('email_downloader.msvcrt') as mock_msvcrt, \
+             patch('email_downloader.wait_for_key') as mock_wait, \
              patch('email_downloader.time') as mock_time, \
              patch('email_downloader.sys') as mock_sys:
 
             # Simulate: start=0, loops at 1s, 3s, 5s, then timeout at 11s
             mock_time.time = MagicMock(side_effect=[0.0, 1.0, 3.0, 5.0, 11.0])
             mock_time.sleep = MagicMock()
-            mock_msvcrt.kbhit = MagicMock(side_effect=[False, False, False])
+            mock_wait.side_effect = [False, False, False]
             mock_stdout = MagicMock()
             mock_sys.stdout = mock_stdout
 
@@ -115,31 +117,34 @@ class TestTimedInput(unittest.TestCase):
             self.assertIn('-> y', countdown_text)
             self.assertEqual(result, 'y')
 
-    def test_sleep_called_between_checks(self):
-        """Verify that time.sleep is called to prevent CPU hogging."""
+    def test_waits_until_countdown_changes(self):
+        """Verify that it blocks for a key only until the next countdown second."""
         with patch('email_downloader.msvcrt') as mock_msvcrt, \
+             patch('email_downloader.wait_for_key') as mock_wait, \
              patch('email_downloader.time') as mock_time, \
              patch('email_downloader.sys') as mock_sys:
 
-            mock_time.time = MagicMock(side_effect=[0.0, 5.0, 11.0])
-            mock_time.sleep = MagicMock()
-            mock_msvcrt.kbhit = MagicMock(side_effect=[False])
+            mock_time.time = MagicMock(side_effect=[0.0, 5.25, 11.0])
+            mock_wait.side_effect = [False]
             mock_sys.stdout = MagicMock()
 
             from email_downloader import timed_input
             timed_input("Q?", timeout=10, default='y')
 
-            mock_time.sleep.assert_called_with(0.25)
+            # At 5.25s the display shows 4s, which becomes 3s at 6s
+            mock_wait.assert_called_once_with(0.75)
+            mock_msvcrt.getwche.assert_not_called()
 
     def test_prompt_shows_default_value(self):
         """Verify that the prompt includes the default value."""
         with patch('email_downloader.msvcrt') as mock_msvcrt, \
+             patch('email_downloader.wait_for_key') as mock_wait, \
              patch('email_downloader.time') as mock_time, \
              patch('email_downloader.sys') as mock_sys:
 
             mock_time.time = MagicMock(side_effect=[0.0, 11.0])
             mock_time.sleep = MagicMock()
-            mock_msvcrt.kbhit = MagicMock(side_effect=[])
+            mock_wait.side_effect = []
             mock_stdout = MagicMock()
             mock_sys.stdout = mock_stdout
 
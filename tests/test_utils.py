@@ -1,10 +1,11 @@
 import unittest
+import unittest.mock
 import os
 import shutil
 import tempfile
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import sanitize_filename, ensure_directory, calculate_hashes, create_zip_archive
+from utils import sanitize_filename, ensure_directory, write_file, calculate_hashes, create_zip_archive, set_deflate_impl, FAST_HASH_ALGORITHMS, ConcurrentSet, message_id_key, ZIP_ZSTANDARD
 
 class TestUtils(unittest.TestCase):
 
@@ -22,6 +23,9 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(sanitize_filename("name with spaces"), "name_with_spaces")
         self.assertEqual(sanitize_filename("special@#chars"), "special__chars")
         self.assertEqual(sanitize_filename(".."), "..") # Depending on implementation, this might be allowed or not, but regex says keep dots
+        # Non-ASCII letters are kept, other symbols replaced
+        self.assertEqual(sanitize_filename("Caixa de Saída/Não lidos"), "Caixa_de_Saída_Não_lidos")
+        self.assertEqual(sanitize_filename("Notes• 2024"), "Notes__2024")
 
     def test_ensure_directory(self):
         new_dir = os.path.join(self.test_dir, "subdir")
@@ -32,6 +36,13 @@ class TestUtils(unittest.TestCase):
         # Ensure calling it again doesn't raise error
         ensure_directory(new_dir)
 
+    def test_write_file_replaces_content(self):
+        file_path = os.path.join(self.test_dir, "email.eml")
+        write_file(file_path, b"old content that is longer\r\n")
+        write_file(file_path, b"new\r\n")
+        with open(file_path, "rb") as f:
+            self.assertEqual(f.read(), b"new\r\n")
+
     def test_calculate_hashes(self):
         file_path = os.path.join(self.test_dir, "test_file.txt")
         content = b"test content"
@@ -49,6 +60,42 @@ class TestUtils(unittest.TestCase):
         # echo -n "test content" | sha1sum -> 1eebdf4fdc9fc7bf283031b93f9aef3338de9052
         expected_sha1 = "1eebdf4fdc9fc7bf283031b93f9aef3338de9052"
         self.assertEqual(hashes['sha1'], expected_sha1)
+        # zlib.crc32(b"test content")
+        self.assertEqual(hashes['crc32'], "57f4675d")
+
+    def test_calculate_hashes_fast_only(self):
+        file_path = os.path.join(self.test_dir, "test_file.txt")
+        with open(file_path, "wb") as f:
+            f.write(b"test content")
+
+        hashes = calculate_hashes(file_path, FAST_HASH_ALGORITHMS)
+
+        self.assertEqual(hashes, {'crc32': "57f4675d"})
+
+    def test_calculate_hashes_large_file_matches_hashlib(self):
+        import hashlib
+        import zlib
+        file_path = os.path.join(self.test_dir, "big.bin")
+        # Several slices above HASH_PARALLEL_MIN, plus a short tail
+        data = os.urandom(1024 * 1024) * 9 + b"tail"
+        with open(file_path, "wb") as f:
+            f.write(data)
+
+        hashes = calculate_hashes(file_path)
+
+        self.assertEqual(hashes['sha1'], hashlib.sha1(data).hexdigest())
+        self.assertEqual(hashes['sha256'], hashlib.sha256(data).hexdigest())
+        self.assertEqual(hashes['blake2b'], hashlib.blake2b(data).hexdigest())
+        self.assertEqual(hashes['crc32'], f"{zlib.crc32(data):08x}")
+
+    def test_calculate_hashes_empty_file(self):
+        file_path = os.path.join(self.test_dir, "empty.txt")
+        open(file_path, "wb").close()
+
+        hashes = calculate_hashes(file_path)
+
+        # echo -n "" | sha1sum -> da39a3ee5e6b4b0d3255bfef95601890afd80709
+        self.assertEqual(hashes['sha1'], "da39a3ee5e6b4b0d3255bfef95601890afd80709")
 
     def test_create_zip_archive(self):
         src_dir = os.path.join(self.test_dir, "src")
@@ -68,5 +115,310 @@ class TestUtils(unittest.TestCase):
         with zipfile.ZipFile(zip_path, 'r') as zf:
             self.assertIn("file1.txt", zf.namelist())
 
+    @unittest.skipUnless(hasattr(os, 'symlink'), "needs symlinks")
+    def test_create_zip_archive_skips_directory_symlinks(self):
+        import zipfile
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(os.path.join(src_dir, "INBOX"))
+        with open(os.path.join(src_dir, "INBOX", "a.eml"), "wb") as f:
+            f.write(b"Subject: a\r\n\r\nbody")
+        try:
+            # A loop back to the top of the tree
+            os.symlink(src_dir, os.path.join(src_dir, "INBOX", "loop"), target_is_directory=True)
+        except OSError:
+            self.skipTest("cannot create symlinks here")
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        create_zip_archive(src_dir, zip_path)
+
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.assertEqual(zf.namelist(), ["INBOX/a.eml"])
+
+    def test_create_zip_archive_deflated_round_trip(self):
+        import zipfile
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(os.path.join(src_dir, "INBOX"))
+        contents = {}
+        for i in range(50):
+            name = f"INBOX/email_{i}.eml"
+            contents[name] = (f"Subject: {i}\r\n\r\n" + "body line\r\n" * i).encode()
+            with open(os.path.join(src_dir, name), "wb") as f:
+                f.write(contents[name])
+        open(os.path.join(src_dir, "empty.eml"), "wb").close()
+        contents["empty.eml"] = b""
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        create_zip_archive(src_dir, zip_path, compression_method=zipfile.ZIP_DEFLATED, compress_level=6)
+
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(sorted(zf.namelist()), sorted(contents))
+            for name, data in contents.items():
+                # Members DEFLATE cannot shrink (the empty and tiny ones) are stored
+                if len(data) >= 200:
+                    self.assertEqual(zf.getinfo(name).compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(zf.read(name), data)
+
+    def test_create_zip_archive_streams_large_files(self):
+        import zipfile
+        import utils
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(src_dir)
+        big = os.urandom(4096) * 10
+        with open(os.path.join(src_dir, "big.eml"), "wb") as f:
+            f.write(big)
+        with open(os.path.join(src_dir, "small.eml"), "wb") as f:
+            f.write(b"small")
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        with unittest.mock.patch.object(utils, 'ZIP_STREAM_THRESHOLD', 1024), \
+                unittest.mock.patch.object(utils, 'ZIP_COPY_BLOCK_SIZE', 1000):
+            create_zip_archive(src_dir, zip_path, compression_method=zipfile.ZIP_DEFLATED, compress_level=6)
+
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("big.eml"), big)
+            self.assertEqual(zf.read("small.eml"), b"small")
+            self.assertEqual(zf.getinfo("big.eml").compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_create_zip_archive_deflates_large_file_blocks_in_parallel(self):
+        import zipfile
+        import zlib
+        import utils
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(src_dir)
+        text = b"".join(b"Line %d of a long message body\r\n" % i for i in range(20000))
+        with open(os.path.join(src_dir, "big.eml"), "wb") as f:
+            f.write(text)
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        with unittest.mock.patch.object(utils, 'ZIP_STREAM_THRESHOLD', 1024), \
+                unittest.mock.patch.object(utils, 'ZIP_COPY_BLOCK_SIZE', 50000):
+            create_zip_archive(src_dir, zip_path, compression_method=zipfile.ZIP_DEFLATED, compress_level=6)
+
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("big.eml"), text)
+            info = zf.getinfo("big.eml")
+            self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+            # Primed blocks cost next to nothing over one serial stream
+            serial = zlib.compressobj(6, zlib.DEFLATED, -15)
+            serial_size = len(serial.compress(text) + serial.flush())
+            self.assertLess(info.compress_size, serial_size * 1.05)
+
+    def test_create_zip_archive_removes_archive_when_stream_fails(self):
+        import zipfile
+        import utils
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(src_dir)
+        with open(os.path.join(src_dir, "big.eml"), "wb") as f:
+            f.write(b"body line\r\n" * 1000)
+
+        def failing_copy(src, dest, length):
+            dest.write(src.read(length))
+            raise OSError("read error")
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        with unittest.mock.patch.object(utils, 'ZIP_STREAM_THRESHOLD', 1024), \
+                unittest.mock.patch.object(utils.shutil, 'copyfileobj', failing_copy):
+            with self.assertRaises(OSError):
+                create_zip_archive(src_dir, zip_path, compression_method=zipfile.ZIP_DEFLATED, compress_level=6)
+
+        # No archive with a truncated (but CRC-valid) member is left behind
+        self.assertFalse(os.path.exists(zip_path))
+
+    def test_zipfile_internals_used_for_streaming(self):
+        # _stream_entry falls back to plain zipfile streaming without these;
+        # this fails when a Python release renames them, so the fallback is noticed
+        import io
+        import zipfile
+        import utils
+        self.assertIsNotNone(utils._ZIPINFO_LEVEL_ATTR)
+        with zipfile.ZipFile(io.BytesIO(), 'w') as zf:
+            zinfo = zipfile.ZipInfo("a.eml")
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with zf.open(zinfo, 'w') as dest:
+                self.assertIsNotNone(getattr(dest, '_compressor', None))
+                self.assertTrue(hasattr(dest._compressor, 'compress'))
+
+    def test_create_zip_archive_hashes_while_writing(self):
+        import zipfile
+        import utils
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(src_dir)
+        big = os.urandom(4096) * 10
+        with open(os.path.join(src_dir, "big.eml"), "wb") as f:
+            f.write(big)
+        with open(os.path.join(src_dir, "small.eml"), "wb") as f:
+            f.write(b"small")
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        with unittest.mock.patch.object(utils, 'ZIP_STREAM_THRESHOLD', 1024):
+            size, hashes = create_zip_archive(src_dir, zip_path, compression_method=zipfile.ZIP_DEFLATED, compress_level=6,
+                                        hash_algorithms=("sha256", "crc32"))
+
+        # Same digests as hashing the finished file
+        self.assertEqual(hashes, calculate_hashes(zip_path, ("sha256", "crc32")))
+        self.assertEqual(size, os.path.getsize(zip_path))
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("big.eml"), big)
+            self.assertEqual(zf.read("small.eml"), b"small")
+
+    def test_create_zip_archive_stores_incompressible_files(self):
+        import zipfile
+        import utils
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(src_dir)
+        noise = os.urandom(200 * 1024)
+        text = b"Subject: hi\r\n\r\n" + b"body line\r\n" * 20000
+        for name, data in (("photo.jpg", noise), ("big_photo.jpg", noise * 2), ("tiny.bin", os.urandom(100)), ("mail.eml", text)):
+            with open(os.path.join(src_dir, name), "wb") as f:
+                f.write(data)
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        # big_photo.jpg takes the streaming path
+        with unittest.mock.patch.object(utils, 'ZIP_STREAM_THRESHOLD', 300 * 1024):
+            create_zip_archive(src_dir, zip_path, compression_method=zipfile.ZIP_DEFLATED, compress_level=6)
+
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.getinfo("photo.jpg").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo("big_photo.jpg").compress_type, zipfile.ZIP_STORED)
+            # Too small to sample, but DEFLATE grew it
+            self.assertEqual(zf.getinfo("tiny.bin").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo("mail.eml").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(zf.read("big_photo.jpg"), noise * 2)
+            self.assertEqual(zf.read("mail.eml"), text)
+
+    def test_create_zip_archive_is_reproducible(self):
+        import zipfile
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(os.path.join(src_dir, "INBOX"))
+        names = []
+        for i in range(100):
+            name = os.path.join("INBOX", f"{i:03d}.eml")
+            with open(os.path.join(src_dir, name), "wb") as f:
+                # Uneven sizes so workers finish out of order
+                f.write(b"x" * ((i * 7919) % 50000))
+            names.append(name.replace(os.sep, "/"))
+
+        first = create_zip_archive(src_dir, os.path.join(self.test_dir, "a.zip"), zipfile.ZIP_DEFLATED, 6, ("sha256",))
+        second = create_zip_archive(src_dir, os.path.join(self.test_dir, "b.zip"), zipfile.ZIP_DEFLATED, 6, ("sha256",))
+
+        self.assertEqual(first, second)
+        with zipfile.ZipFile(os.path.join(self.test_dir, "a.zip")) as zf:
+            self.assertEqual(zf.namelist(), names)
+
+    @unittest.skipIf(ZIP_ZSTANDARD is None, "zipfile has no Zstandard support before Python 3.14")
+    def test_create_zip_archive_zstandard_round_trip(self):
+        import zipfile
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(src_dir)
+        contents = {
+            "small.eml": b"Subject: hi\r\n\r\n" + b"body line\r\n" * 100,
+            # Above ZIP_STREAM_THRESHOLD, so written through _stream_entry
+            "large.eml": b"Subject: big\r\n\r\n" + b"body line\r\n" * 300000,
+        }
+        for name, data in contents.items():
+            with open(os.path.join(src_dir, name), "wb") as f:
+                f.write(data)
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        create_zip_archive(src_dir, zip_path, compression_method=ZIP_ZSTANDARD, compress_level=3)
+
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.assertIsNone(zf.testzip())
+            for name, data in contents.items():
+                self.assertEqual(zf.getinfo(name).compress_type, ZIP_ZSTANDARD)
+                self.assertEqual(zf.read(name), data)
+
+    def test_create_zip_archive_with_libdeflate(self):
+        import types
+        import zipfile
+        import zlib
+        levels = []
+
+        def deflate_compress(data, compresslevel):
+            levels.append(compresslevel)
+            c = zlib.compressobj(min(compresslevel, 9), zlib.DEFLATED, -15)
+            return c.compress(data) + c.flush()
+
+        fake = types.SimpleNamespace(deflate_compress=deflate_compress, crc32=zlib.crc32)
+        src_dir = os.path.join(self.test_dir, "src")
+        os.makedirs(src_dir)
+        data = b"Subject: hi\r\n\r\n" + b"body line\r\n" * 5000
+        with open(os.path.join(src_dir, "a.eml"), "wb") as f:
+            f.write(data)
+
+        zip_path = os.path.join(self.test_dir, "archive.zip")
+        with unittest.mock.patch.dict(sys.modules, {'deflate': fake}):
+            set_deflate_impl("libdeflate")
+            try:
+                create_zip_archive(src_dir, zip_path, compression_method=zipfile.ZIP_DEFLATED, compress_level=12)
+            finally:
+                set_deflate_impl("zlib")
+
+        self.assertIn(12, levels)
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.getinfo("a.eml").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(zf.read("a.eml"), data)
+
+    def test_set_deflate_impl_rejects_unknown_name(self):
+        with self.assertRaises(ValueError):
+            set_deflate_impl("brotli")
+        set_deflate_impl("zlib")
+
+    def test_concurrent_set_add_if_absent(self):
+        seen = ConcurrentSet()
+        self.assertTrue(seen.add_if_absent("<a@example.com>"))
+        self.assertFalse(seen.add_if_absent("<a@example.com>"))
+        self.assertTrue(seen.add_if_absent("<b@example.com>"))
+        self.assertIn("<a@example.com>", seen)
+        self.assertNotIn("<c@example.com>", seen)
+        self.assertEqual(len(seen), 2)
+
+    def test_concurrent_set_owner_can_repeat_its_claim(self):
+        seen = ConcurrentSet()
+        self.assertTrue(seen.add_if_absent("<a@example.com>", owner=("INBOX", b"1")))
+        self.assertTrue(seen.add_if_absent("<a@example.com>", owner=("INBOX", b"1")))
+        self.assertFalse(seen.add_if_absent("<a@example.com>", owner=("All Mail", b"9")))
+        self.assertFalse(seen.add_if_absent("<a@example.com>"))
+
+    def test_concurrent_set_with_message_id_key(self):
+        seen = ConcurrentSet(key=message_id_key)
+        self.assertTrue(seen.add_if_absent("<a@example.com>"))
+        self.assertFalse(seen.add_if_absent("<a@example.com>"))
+        self.assertIn("<a@example.com>", seen)
+        self.assertNotIn("<b@example.com>", seen)
+
+    def test_message_id_key(self):
+        key = message_id_key("<a@example.com>")
+        self.assertIsInstance(key, int)
+        self.assertLess(key, 2 ** 64)
+        self.assertEqual(key, message_id_key("<a@example.com>"))
+        self.assertNotEqual(key, message_id_key("<b@example.com>"))
+
+    def test_concurrent_set_concurrent_adds_claim_each_key_once(self):
+        import threading
+        seen = ConcurrentSet()
+        claimed = []
+        claimed_lock = threading.Lock()
+
+        def worker():
+            for i in range(500):
+                if seen.add_if_absent(f"<{i}@example.com>"):
+                    with claimed_lock:
+                        claimed.append(i)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(claimed), list(range(500)))
+        self.assertEqual(len(seen), 500)
+
 if __name__ == '__main__':
     unittest.main()
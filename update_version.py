@@ -1,34 +1,12 @@
 import os
+import string
+import tempfile
 
 VERSION_FILE = 'version.txt'
 VERSION_INFO_FILE = 'file_version_info.txt'
 
-def get_next_version():
-
-    with open(VERSION_FILE, 'r') as f:
-        version_str = f.read().strip()
-        parts = list(map(int, version_str.split('.')))
-        
-        # Increment minor
-        parts[1] += 1
-        parts[2] = 0
-        return parts
-
-def write_version(parts):
-    version_str = ".".join(map(str, parts))
-    with open(VERSION_FILE, 'w') as f:
-        f.write(version_str)
-    return version_str, parts
-
-def create_version_info_file(version_parts):
-    # PyInstaller version file format
-    # Windows version resource usually requires 4 numbers (Major, Minor, Patch, Build)
-    # We will use 0 for Build
-    v = version_parts + [0]
-    version_tuple = tuple(v)
-    version_str = ".".join(map(str, version_parts))
-    
-    content = f"""# UTF-8
+# PyInstaller version file format
+_VERSION_INFO_TEMPLATE = string.Template("""# UTF-8
 #
 # For more details about fixed file info 'ffi' see:
 # http://msdn.microsoft.com/en-us/library/ms646997.aspx
@@ -36,8 +14,8 @@ VSVersionInfo(
   ffi=FixedFileInfo(
     # filevers and prodvers should be always a tuple with four items: (1, 2, 3, 4)
     # Set not needed items to zero 0.
-    filevers={version_tuple},
-    prodvers={version_tuple},
+    filevers=$version_tuple,
+    prodvers=$version_tuple,
     # Contains a bitmask that specifies the valid bits 'flags'r
     mask=0x3f,
     # Contains a bitmask that specifies the Boolean attributes of the file.
@@ -61,24 +39,64 @@ VSVersionInfo(
         u'040904B0',
         [StringStruct(u'CompanyName', u'Email Downloader'),
         StringStruct(u'FileDescription', u'Email Downloader Tool'),
-        StringStruct(u'FileVersion', u'{version_str}'),
+        StringStruct(u'FileVersion', u'$version_str'),
         StringStruct(u'InternalName', u'email_downloader'),
         StringStruct(u'LegalCopyright', u'MIT License'),
         StringStruct(u'OriginalFilename', u'email_downloader.exe'),
         StringStruct(u'ProductName', u'Email Downloader'),
-        StringStruct(u'ProductVersion', u'{version_str}')])
+        StringStruct(u'ProductVersion', u'$version_str')])
       ]), 
     VarFileInfo([VarStruct(u'Translation', [1033, 1200])])
   ]
 )
-"""
-    with open(VERSION_INFO_FILE, 'w', encoding='utf-8') as f:
-        f.write(content)
+""")
+
+def _write_atomic(path, content):
+    """
+    Writes content to path through a temporary file in the same directory,
+    so an interrupted build never leaves a truncated version file behind.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def get_next_version():
+
+    with open(VERSION_FILE, 'r') as f:
+        version_str = f.read().strip()
+        parts = list(map(int, version_str.split('.')))
+        
+        # Increment minor
+        parts[1] += 1
+        parts[2] = 0
+        return parts
+
+def write_version(parts):
+    version_str = ".".join(map(str, parts))
+    _write_atomic(VERSION_FILE, version_str)
+    return version_str, parts
+
+def create_version_info_file(version_parts):
+    # PyInstaller version file format
+    # Windows version resource usually requires 4 numbers (Major, Minor, Patch, Build)
+    # We will use 0 for Build
+    v = version_parts + [0]
+    version_tuple = tuple(v)
+    version_str = ".".join(map(str, version_parts))
+    
+    content = _VERSION_INFO_TEMPLATE.substitute(version_tuple=version_tuple, version_str=version_str)
+    _write_atomic(VERSION_INFO_FILE, content)
 
 def main():
     parts = get_next_version()
-    v_str, _ = write_version(parts)
+    # version.txt last: if anything fails, the next run retries the same version
     create_version_info_file(parts)
+    v_str, _ = write_version(parts)
     print(f"Build Version Updated to: {v_str}")
 
 if __name__ == '__main__':
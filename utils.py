@@ -1,141 +1,561 @@
 import re
 import os
+import io
 import zipfile
 import hashlib
-import threading
+import mmap
+import zlib
+import shutil
+import time
+import collections
+import functools
+import itertools
 import concurrent.futures
-import queue
 from tqdm import tqdm
 
+# Keep only alphanumeric, dots, dashes and underscores
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w\-\.]')
+# Same rule for ASCII as a str.translate table: one C-level pass, no regex engine
+_ASCII_FILENAME_TABLE = str.maketrans({
+    chr(c): '_' for c in range(128) if _UNSAFE_FILENAME_RE.match(chr(c))
+})
+
 def sanitize_filename(filename: str) -> str:
     """
     Removes illegal characters from filenames.
     """
-    # Keep only alphanumeric, dots, dashes and underscores
-    return re.sub(r'[^\w\-\.]', '_', filename)
+    if filename.isascii():
+        return filename.translate(_ASCII_FILENAME_TABLE)
+    return _UNSAFE_FILENAME_RE.sub('_', filename)
+
+def message_id_key(msg_id: str) -> int:
+    """
+    64-bit BLAKE2b digest of a Message-ID, for dedup sets. An int takes a fraction
+    of the memory of the full header string; a collision is ~2^-64 per pair.
+    """
+    digest = hashlib.blake2b(msg_id.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+class ConcurrentSet:
+    """
+    Thread-safe set whose test-and-add takes no lock: add_if_absent is a single
+    dict.setdefault call, which CPython runs atomically for keys with built-in
+    hashing (str, int). If key is given (e.g. message_id_key), values are
+    stored and looked up as key(value).
+    """
+
+    def __init__(self, key=None):
+        self._items = {}
+        self._key = key
+
+    def add_if_absent(self, value, owner=None) -> bool:
+        """
+        Adds value. Returns True if it was added, False if it was already present.
+        If owner (any hashable token) is given and value was added with an equal
+        owner, it counts as added again, so the same caller can repeat a claim.
+        """
+        k = self._key(value) if self._key else value
+        # Only the thread whose marker got stored added the value
+        marker = object() if owner is None else owner
+        stored = self._items.setdefault(k, marker)
+        return stored is marker or (owner is not None and stored == owner)
+
+    def __contains__(self, value) -> bool:
+        k = self._key(value) if self._key else value
+        return k in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
 
 def ensure_directory(path: str):
     """
-    Ensures the directory exists.
+    Ensures the directory exists. Safe to call from several threads at once.
+    """
+    os.makedirs(path, exist_ok=True)
+
+# Binary mode matters on Windows; the flag does not exist elsewhere.
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+
+def write_file(path, data: bytes):
+    """
+    Writes data to path (str or bytes), replacing any existing file.
+    Raw fd write: skips the buffered-IO layer and file object for a one-shot write.
+    """
+    fd = os.open(path, _WRITE_FLAGS, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+# Files larger than this are streamed into the zip in blocks instead of read whole
+ZIP_STREAM_THRESHOLD = 2 * 1024 * 1024
+ZIP_COPY_BLOCK_SIZE = 2 * 1024 * 1024
+
+# DEFLATE is skipped (member STORED) when a level-1 trial on the first
+# ZIP_SAMPLE_SIZE bytes saves less than 1 - ZIP_STORE_RATIO of them, e.g. for
+# JPEG/PDF/ZIP files in a --zip-only directory
+ZIP_SAMPLE_SIZE = 64 * 1024
+ZIP_STORE_RATIO = 0.97
+
+# Small files handed to a zip worker per task, so the submit/future overhead
+# is shared; fewer when there are too few files to keep every worker busy
+ZIP_TASK_FILES = 8
+
+# Seconds between redraws of the zipping progress bar; members are counted in between
+ZIP_PROGRESS_INTERVAL = 0.1
+
+# Zstandard members (method 93); zipfile supports them from Python 3.14
+ZIP_ZSTANDARD = getattr(zipfile, 'ZIP_ZSTANDARD', None)
+
+# DEFLATE implementation used for zip members; see set_deflate_impl()
+_deflate = zlib
+
+class _Libdeflate:
+    """
+    zlib-style front for the `deflate` package (libdeflate), which compresses
+    whole buffers only: compressobj() collects the data and compresses on flush().
+    Members are compressed in one piece anyway, so nothing is lost.
+    """
+    DEFLATED = zlib.DEFLATED
+    Z_DEFAULT_COMPRESSION = 6
+    Z_BEST_COMPRESSION = 12
+
+    def __init__(self, module):
+        self._module = module
+        self.crc32 = module.crc32
+
+    def compressobj(self, level, method=zlib.DEFLATED, wbits=-15):
+        return _LibdeflateCompressor(self._module, level)
+
+class _LibdeflateCompressor:
+    def __init__(self, module, level):
+        self._module = module
+        self._level = level
+        self._chunks = []
+
+    def compress(self, data) -> bytes:
+        self._chunks.append(data)
+        return b''
+
+    def flush(self) -> bytes:
+        data = self._chunks[0] if len(self._chunks) == 1 else b''.join(self._chunks)
+        self._chunks = []
+        return self._module.deflate_compress(data, self._level)
+
+def set_deflate_impl(name: str):
+    """
+    Selects the DEFLATE implementation used by create_zip_archive:
+    'zlib' (standard library), 'isal' (Intel ISA-L, from the optional `isal` package)
+    or 'libdeflate' (from the optional `deflate` package).
+    ISA-L is several times faster but only has levels 0-3; higher levels are capped at 3.
+    libdeflate is about twice as fast as zlib at the same level and adds levels 10-12.
+    Raises ImportError if the requested implementation is not installed.
+    """
+    global _deflate
+    if name == 'isal':
+        from isal import isal_zlib
+        _deflate = isal_zlib
+    elif name == 'libdeflate':
+        import deflate
+        _deflate = _Libdeflate(deflate)
+    elif name == 'zlib':
+        _deflate = zlib
+    else:
+        raise ValueError(f"Unknown DEFLATE implementation: {name}")
+
+def _compress_entry(data: bytes, compression_method, compress_level):
+    """
+    Compresses one archive member the way ZipFile would store it.
+    DEFLATE output is a raw stream (no zlib header), as the ZIP format expects;
+    Zstandard output is a single frame.
+    """
+    if compression_method == zipfile.ZIP_DEFLATED:
+        if compress_level is None:
+            level = _deflate.Z_DEFAULT_COMPRESSION
+        else:
+            level = min(compress_level, _deflate.Z_BEST_COMPRESSION)
+        compressor = _deflate.compressobj(level, _deflate.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    if ZIP_ZSTANDARD is not None and compression_method == ZIP_ZSTANDARD:
+        from compression import zstd
+        return zstd.compress(data, compress_level)
+    return data
+
+def looks_incompressible(sample) -> bool:
+    """
+    True if DEFLATE is not worth running on data starting with sample.
+    The trial uses level 1, so it costs a fraction of the real compression.
+    """
+    if len(sample) < ZIP_SAMPLE_SIZE:
+        return False  # Too short to judge; small members are just compressed
+    compressor = _deflate.compressobj(1, _deflate.DEFLATED, -15)
+    trial_size = len(compressor.compress(sample[:ZIP_SAMPLE_SIZE])) + len(compressor.flush())
+    return trial_size > ZIP_SAMPLE_SIZE * ZIP_STORE_RATIO
+
+def prepare_zip_member(zinfo: zipfile.ZipInfo, data: bytes, compression_method, compress_level):
+    """
+    Fills in CRC and sizes of zinfo and compresses data (STORED, DEFLATED or ZSTANDARD).
+    Incompressible data is stored even if DEFLATED was asked for.
+    Returns the payload for append_zip_member. Safe to call from any thread,
+    so the CPU work stays off the thread that owns the archive.
+    """
+    if compression_method == zipfile.ZIP_DEFLATED and looks_incompressible(data):
+        compression_method = zipfile.ZIP_STORED
+    zinfo.file_size = len(data)
+    zinfo.CRC = _deflate.crc32(data)
+    payload = _compress_entry(data, compression_method, compress_level)
+    if len(payload) >= len(data) and compression_method != zipfile.ZIP_STORED:
+        # Compression made it bigger: store the original instead
+        compression_method, payload = zipfile.ZIP_STORED, data
+    zinfo.compress_type = compression_method
+    zinfo.compress_size = len(payload)
+    return payload
+
+def append_zip_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, payload: bytes):
+    """
+    Appends an already compressed member to zipf. CRC and sizes are known up
+    front, so they go straight into the local header and no data descriptor is needed.
+    """
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zinfo.header_offset = zipf.fp.tell()
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.write(payload)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+# O_SEQUENTIAL maps to FILE_FLAG_SEQUENTIAL_SCAN on Windows; elsewhere posix_fadvise does the job
+_SEQUENTIAL_OPEN_FLAGS = os.O_RDONLY | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_SEQUENTIAL', 0)
+
+def _open_sequential(path: str):
+    """
+    Opens a file for reading with a sequential-access hint, so the OS reads
+    ahead aggressively (helps on spinning disks and network shares).
+    """
+    fd = os.open(path, _SEQUENTIAL_OPEN_FLAGS)
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+    return os.fdopen(fd, 'rb')
+
+def _walk_files(source_dir: str, prefix: str = ''):
+    """
+    Yields (file_path, arcname) for every file under source_dir.
+    os.scandir returns the file type with each entry, so no extra stat is needed.
     """
-    if not os.path.exists(path):
-        os.makedirs(path)
+    with os.scandir(source_dir) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        arcname = prefix + entry.name
+        # Like os.walk(): symlinked directories are not entered, so a link loop cannot recurse forever
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk_files(entry.path, arcname + os.sep)
+        elif entry.is_file(follow_symlinks=True):
+            yield entry.path, arcname
 
-def create_zip_archive(source_dir: str, output_filename: str, compression_method=zipfile.ZIP_STORED, compress_level=None):
+# DEFLATE keeps a 32 KiB window; each block is primed with the previous one's tail
+_DEFLATE_WINDOW = 32 * 1024
+
+class _ParallelDeflater:
     """
-    Zips the contents of source_dir into output_filename using multi-threading for reading
-    and a progress bar.
+    zlib-style compressor that deflates the blocks written to it on an executor,
+    pigz-style, so a single large member uses several cores.
+    Every block is its own raw DEFLATE segment ended by a sync flush and primed
+    with the last 32 KiB of the block before, so the joined output is one valid
+    stream that is barely bigger than a serial one.
+    At most max_pending blocks are in flight, which keeps memory use bounded.
+    """
+
+    def __init__(self, executor, level, max_pending):
+        self._executor = executor
+        self._level = level
+        self._max_pending = max_pending
+        self._pending = collections.deque()
+        self._tail = None
+
+    def _deflate_block(self, data, zdict):
+        if zdict is None:
+            compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        else:
+            compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15, zdict=zdict)
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def compress(self, data) -> bytes:
+        data = bytes(data)
+        self._pending.append(self._executor.submit(self._deflate_block, data, self._tail))
+        self._tail = data[-_DEFLATE_WINDOW:]
+        out = []
+        # Hand back finished blocks in order; wait only when the window is full
+        while self._pending and (self._pending[0].done() or len(self._pending) > self._max_pending):
+            out.append(self._pending.popleft().result())
+        return b''.join(out)
+
+    def flush(self) -> bytes:
+        out = [f.result() for f in self._pending]
+        self._pending.clear()
+        # An empty final block closes the stream
+        out.append(zlib.compressobj(self._level, zlib.DEFLATED, -15).flush())
+        return b''.join(out)
+
+# Per-member compression level: public as ZipInfo.compress_level from Python 3.13,
+# only the private _compresslevel slot before that
+_ZIPINFO_LEVEL_ATTR = next((name for name in ('compress_level', '_compresslevel')
+                            if hasattr(zipfile.ZipInfo('x'), name)), None)
+
+def _stream_entry(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, path: str, compression_method, compress_level,
+                  executor=None):
+    """
+    Copies a large file into zipf in ZIP_COPY_BLOCK_SIZE blocks, so memory use
+    does not grow with the file size. The first block decides STORED vs DEFLATED.
+    With an executor, DEFLATED blocks are compressed in parallel (_ParallelDeflater)
+    where zipfile's member writer exposes its compressor; else zipfile compresses them.
+    A read error part-way through propagates: zipfile has already committed the
+    truncated member by then, so the archive must not be used.
+    """
+    with _open_sequential(path) as src:
+        head = src.read(ZIP_SAMPLE_SIZE)
+        if compression_method == zipfile.ZIP_DEFLATED and looks_incompressible(head):
+            compression_method = zipfile.ZIP_STORED
+        zinfo.compress_type = compression_method
+        level = compress_level
+        if level is not None and compression_method == zipfile.ZIP_DEFLATED:
+            # zipfile streams through the standard zlib, which stops at level 9
+            level = min(level, zlib.Z_BEST_COMPRESSION)
+        if level is not None and _ZIPINFO_LEVEL_ATTR:
+            setattr(zinfo, _ZIPINFO_LEVEL_ATTR, level)
+        with zipf.open(zinfo, 'w') as dest:
+            if (executor is not None and compression_method == zipfile.ZIP_DEFLATED
+                    and getattr(dest, '_compressor', None) is not None):
+                dest._compressor = _ParallelDeflater(executor, zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+                                                     os.cpu_count() or 1)
+            dest.write(head)
+            shutil.copyfileobj(src, dest, ZIP_COPY_BLOCK_SIZE)
+
+def create_zip_archive(source_dir: str, output_filename: str, compression_method=zipfile.ZIP_STORED, compress_level=None,
+                       hash_algorithms=None):
+    """
+    Zips the contents of source_dir into output_filename with a progress bar.
+    Worker threads read, CRC and compress the files in parallel, a few small
+    files per task (zlib releases the GIL); the calling thread only appends the
+    finished members to the archive.
+    Files above ZIP_STREAM_THRESHOLD are not loaded whole: the calling thread
+    streams them in blocks instead, which keeps peak memory flat, and the
+    workers deflate those blocks in parallel.
+    If hash_algorithms is given, the archive is hashed as it is written and
+    (archive_size, digests) is returned, digests as calculate_hashes() would
+    give them, without re-reading or stat-ing the file.
+    Small files that cannot be read are reported and left out. If a streamed
+    file fails part-way, or the archive cannot be written, the incomplete
+    archive is deleted and the OSError is raised.
     """
     # 1. Collect all files to zip
-    file_list = []
-    for root, _, files in os.walk(source_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            arcname = os.path.relpath(file_path, start=source_dir)
-            file_list.append((file_path, arcname))
+    file_list = list(_walk_files(source_dir))
 
     total_files = len(file_list)
-    
+    # Only STORED, DEFLATED and ZSTANDARD members are built by the workers; other methods go through writestr
+    precompress = compression_method in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, ZIP_ZSTANDARD)
 
-    # 2. Define a worker to read file content
+    # 2. Define a worker to read and compress file content
     def read_file(path_info):
         f_path, arc_name = path_info
         try:
-            with open(f_path, 'rb') as f:
+            zinfo = zipfile.ZipInfo.from_file(f_path, arc_name)
+            if zinfo.file_size > ZIP_STREAM_THRESHOLD:
+                return zinfo, None, None, f_path
+            with _open_sequential(f_path) as f:
                 data = f.read()
-            return arc_name, data, None
+            if not precompress:
+                return zinfo, data, None, None
+            return zinfo, prepare_zip_member(zinfo, data, compression_method, compress_level), None, None
         except Exception as e:
-            return arc_name, None, e
+            return arc_name, None, e, None
+
+    def read_files(batch):
+        return [read_file(path_info) for path_info in batch]
 
     # 3. Bounded Parallel Execution
     # We use a thread pool but limit the number of active futures to prevent reading ALL files into RAM.
     max_workers = min(32, (os.cpu_count() or 1) * 4)
+    batch_size = max(1, min(ZIP_TASK_FILES, total_files // (max_workers * 2)))
     file_iter = iter(file_list)
-    futures = set()
+    # In submission order: members are appended in directory order whatever
+    # order the workers finish in, so the same input gives the same archive
+    futures = collections.deque()
     
     # Setup compression args
     kwargs = {}
     if compression_method == zipfile.ZIP_DEFLATED and compress_level is not None:
-        kwargs['compresslevel'] = compress_level
+        kwargs['compresslevel'] = min(compress_level, zlib.Z_BEST_COMPRESSION)
 
-    with zipfile.ZipFile(output_filename, 'w', compression_method, **kwargs) as zipf:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+    try:
+        with open(output_filename, 'wb') as out_file:
+            out = HashingWriter(out_file, hash_algorithms) if hash_algorithms else out_file
+            with zipfile.ZipFile(out, 'w', compression_method, **kwargs) as zipf:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             
-            # Helper to submit tasks
-            def submit_tasks():
-                while len(futures) < max_workers * 2:
-                    try:
-                        file_info = next(file_iter)
-                        fut = executor.submit(read_file, file_info)
-                        futures.add(fut)
-                    except StopIteration:
-                        break
-
-            # Progress bar
-            pbar = tqdm(total=total_files, unit=' files', desc="Zipping")
+                    # Helper to submit tasks
+                    def submit_tasks():
+                        while len(futures) < max_workers * 2:
+                            batch = list(itertools.islice(file_iter, batch_size))
+                            if not batch:
+                                break
+                            futures.append(executor.submit(read_files, batch))
+
+                    # Progress bar
+                    pbar = tqdm(total=total_files, unit=' files', desc="Zipping")
             
-            # Initial fill
-            submit_tasks()
+                    # Initial fill
+                    submit_tasks()
+                    zipped = 0
+                    last_progress = time.monotonic()
             
-            while futures:
-                # Wait for at least one future to complete
-                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    while futures:
+                        # The oldest task; later ones keep compressing meanwhile
+                        for zinfo, data, error, stream_path in futures.popleft().result():
+                            if error:
+                                print(f"Error reading {zinfo}: {error}")
+                            elif stream_path:
+                                _stream_entry(zipf, zinfo, stream_path, compression_method, compress_level, executor)
+                            elif precompress:
+                                append_zip_member(zipf, zinfo, data)
+                            else:
+                                zipf.writestr(zinfo, data, compress_type=compression_method, compresslevel=compress_level)
+                            zipped += 1
+                        now = time.monotonic()
+                        if now - last_progress >= ZIP_PROGRESS_INTERVAL:
+                            pbar.update(zipped)
+                            zipped, last_progress = 0, now
                 
-                for future in done:
-                    futures.remove(future)
-                    arcname, data, error = future.result()
-                    if error:
-                        print(f"Error reading {arcname}: {error}")
-                    else:
-                        zipf.writestr(arcname, data)
-                    pbar.update(1)
-                
-                # Submit new tasks to keep the pool full
-                submit_tasks()
+                        # Submit new tasks to keep the pool full
+                        submit_tasks()
             
-            pbar.close()
+                    pbar.update(zipped)
+                    pbar.close()
+    except OSError:
+        # Incomplete, or holding a truncated member that would still pass its CRC check
+        if os.path.exists(output_filename):
+            os.remove(output_filename)
+        raise
+
+    return (out.tell(), out.hexdigests()) if hash_algorithms else None
 
-def calculate_hashes(filename: str) -> dict:
+# Digests written to the checksum file, in output order, and their display labels.
+# CRC32 is a quick transfer check; the cryptographic hashes are the provenance record.
+HASH_ALGORITHMS = ('sha1', 'sha256', 'blake2b', 'crc32')
+FAST_HASH_ALGORITHMS = ('crc32',)
+HASH_LABELS = {'sha1': 'SHA1', 'sha256': 'SHA256', 'blake2b': 'BLAKE2b', 'crc32': 'CRC32'}
+
+# Blocks at least this big are fed to all hash algorithms at once, one thread each
+HASH_PARALLEL_MIN = 256 * 1024
+
+@functools.lru_cache(maxsize=None)
+def _hash_pool():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=len(HASH_ALGORITHMS) - 1,
+                                                 thread_name_prefix="Hasher")
+
+def _update_hashers(hashers, data):
+    """
+    Feeds data to every hasher. hashlib releases the GIL on large updates, so
+    for big blocks all but the first hasher run on _hash_pool() while the calling
+    thread does the first: a block costs the slowest algorithm, not their sum.
+    """
+    if len(hashers) < 2 or len(data) < HASH_PARALLEL_MIN:
+        for hasher in hashers:
+            hasher.update(data)
+        return
+    futures = [_hash_pool().submit(hasher.update, data) for hasher in hashers[1:]]
+    hashers[0].update(data)
+    for future in futures:
+        future.result()
+
+class HashingWriter:
     """
-    Calculates the SHA1, SHA256, and BLAKE2b hashes of a file using a producer-consumer model for read-ahead buffering.
+    Write-only file wrapper that feeds everything written through it to the
+    given hash algorithms. It reports itself as not seekable, so ZipFile never
+    rewrites earlier bytes (streamed members get a data descriptor instead),
+    and the digests match those of the finished file.
     """
-    sha1 = hashlib.sha1()
-    sha256 = hashlib.sha256()
-    blake2b = hashlib.blake2b()
+
+    def __init__(self, fp, algorithms=HASH_ALGORITHMS):
+        """
+        Args:
+            fp: Binary file object to write to.
+            algorithms: Names from HASH_ALGORITHMS.
+        """
+        self._fp = fp
+        self._algorithms = tuple(algorithms)
+        self._hashers = [hashlib.new(name) for name in self._algorithms if name != 'crc32']
+        self._crc = 0 if 'crc32' in self._algorithms else None
+        self._pos = 0
+
+    def write(self, data) -> int:
+        _update_hashers(self._hashers, data)
+        if self._crc is not None:
+            self._crc = _deflate.crc32(data, self._crc)
+        self._fp.write(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seekable(self) -> bool:
+        return False
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        raise io.UnsupportedOperation("HashingWriter is write-once")
+
+    def flush(self):
+        self._fp.flush()
+
+    def hexdigests(self) -> dict:
+        """Returns the digests of everything written so far, keyed by algorithm name."""
+        hashers = iter(self._hashers)
+        return {name: f"{self._crc:08x}" if name == 'crc32' else next(hashers).hexdigest()
+                for name in self._algorithms}
+
+def calculate_hashes(filename: str, algorithms=HASH_ALGORITHMS) -> dict:
+    """
+    Calculates the requested digests of a file (default: SHA1, SHA256, BLAKE2b and CRC32)
+    in a single pass, returned as hex strings keyed by algorithm name.
+    The file is memory-mapped and fed to the hashers as memoryview slices, so no
+    chunk is copied into Python bytes; the algorithms hash each slice side by side.
+    Where madvise exists, the next slice is requested from disk while the current
+    one is hashed.
+    """
+    hashers = {name: hashlib.new(name) for name in algorithms if name != 'crc32'}
+    hasher_list = list(hashers.values())
+    crc = 0 if 'crc32' in algorithms else None
     file_size = os.path.getsize(filename)
-    chunk_size = 1024 * 1024 * 4 # 4MB chunks
-    
-    q = queue.Queue(maxsize=5) # Buffer a few chunks ahead
-    
-    def producer():
-        try:
-            with open(filename, 'rb') as f:
-                while True:
-                    data = f.read(chunk_size)
-                    if not data:
-                        break
-                    q.put(data)
-        except Exception as e:
-            print(f"Error reading file for hash: {e}")
-        finally:
-            q.put(None) # Sentinel
+    chunk_size = 1024 * 1024 * 4 # 4MB slices, only to drive the progress bar
 
-    t = threading.Thread(target=producer)
-    t.start()
-    
-    with tqdm(total=file_size, unit='B', unit_scale=True, unit_divisor=1024, desc="Hashing") as pbar:
-        while True:
-            data = q.get()
-            if data is None:
-                break
-            sha1.update(data)
-            sha256.update(data)
-            blake2b.update(data)
-            pbar.update(len(data))
-            
-    t.join()
-    return {
-        'sha1': sha1.hexdigest(),
-        'sha256': sha256.hexdigest(),
-        'blake2b': blake2b.hexdigest()
-    }
+    with open(filename, 'rb') as f, \
+            tqdm(total=file_size, unit='B', unit_scale=True, unit_divisor=1024, desc="Hashing") as pbar:
+        if file_size:  # mmap cannot map an empty file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                prefetch = hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_WILLNEED')
+                with memoryview(mm) as view:
+                    for offset in range(0, file_size, chunk_size):
+                        next_offset = offset + chunk_size
+                        if prefetch and next_offset < file_size:
+                            # Start reading the next slice while this one is hashed
+                            mm.madvise(mmap.MADV_WILLNEED, next_offset, min(chunk_size, file_size - next_offset))
+                        chunk = view[offset:offset + chunk_size]
+                        _update_hashers(hasher_list, chunk)
+                        if crc is not None:
+                            crc = _deflate.crc32(chunk, crc)
+                        chunk.release()
+                        pbar.update(min(chunk_size, file_size - offset))
+
+    result = {}
+    for name in algorithms:
+        result[name] = f"{crc:08x}" if name == 'crc32' else hashers[name].hexdigest()
+    return result